@@ -0,0 +1,71 @@
+"""
+Synthetic dependency graphs, as project records in the format LocalRepository and FakePyPI serve:
+{name: {"releases": [...], "metadata": {version: {"version": ..., "requires_dist": [...]}}}}.
+"""
+import glob
+import json
+import os
+from typing import Dict, List, Optional
+
+FIXTURES = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'pypi')
+
+
+def project(name: str, requires: Optional[List[str]] = None, releases: int = 1) -> Dict[str, dict]:
+    versions = [f"1.{minor}" for minor in range(releases)]
+    return {name: {'releases': versions,
+                   'metadata': {version: {'version': version, 'requires_dist': requires or None}
+                                for version in versions}}}
+
+
+def wide(width: int = 200) -> Dict[str, dict]:
+    """A root with width leaf dependencies."""
+    projects = project('root', [f"leaf{i}>=1.0" for i in range(width)])
+    for i in range(width):
+        projects.update(project(f"leaf{i}"))
+    return projects
+
+
+def deep(depth: int = 50) -> Dict[str, dict]:
+    """A single chain of depth projects."""
+    projects = project('root', ['node0'])
+    for i in range(depth):
+        projects.update(project(f"node{i}", [f"node{i + 1}"] if i + 1 < depth else None))
+    return projects
+
+
+def diamonds(layers: int = 6, width: int = 6) -> Dict[str, dict]:
+    """Layers of projects where every project depends on every project in the next layer."""
+    projects = project('root', [f"l0n{i}" for i in range(width)])
+    for layer in range(layers):
+        requires = [f"l{layer + 1}n{i}" for i in range(width)] if layer + 1 < layers else None
+        for i in range(width):
+            projects.update(project(f"l{layer}n{i}", requires))
+    return projects
+
+
+def cyclic(size: int = 50) -> Dict[str, dict]:
+    """A ring of projects, each depending on the next, the last one on the first."""
+    projects = project('root', ['ring0'])
+    for i in range(size):
+        projects.update(project(f"ring{i}", [f"ring{(i + 1) % size}"]))
+    return projects
+
+
+def many_releases(projects_count: int = 20, releases: int = 5000) -> Dict[str, dict]:
+    """Projects with thousands of releases each, constrained by ranges so version filtering does real work."""
+    projects = project('root', [f"big{i}>=1.{i * 10},<1.{releases - i * 10}" for i in range(projects_count)])
+    for i in range(projects_count):
+        projects.update(project(f"big{i}", releases=releases))
+    return projects
+
+
+def fixtures() -> Dict[str, dict]:
+    """The PyPI documents the test suite uses. Only the latest release of each project has metadata."""
+    projects = {}
+    for path in glob.glob(os.path.join(FIXTURES, 'pypi_*.json')):
+        with open(path, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+        info = {'version': document['info']['version'], 'requires_dist': document['info']['requires_dist']}
+        name = os.path.basename(path)[len('pypi_'):-len('.json')]
+        projects[name] = {'releases': list(document['releases']), 'metadata': {info['version']: info}}
+    return projects
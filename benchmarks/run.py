@@ -0,0 +1,222 @@
+"""
+Resolver benchmarks against a local fake PyPI.
+
+    python -m benchmarks.run                 # run everything and compare against the stored baselines
+    python -m benchmarks.run --save          # record new baselines
+    python -m benchmarks.run wide deep --latency 0.02 --error-rate 0.1
+
+Each scenario runs in a fresh process so peak RSS and thread counts belong to that scenario alone. Only deterministic
+metrics fail the run: request and byte counts must not grow, and the number of resolved nodes and pins must not change.
+Times, memory and threads vary from run to run by more than most real regressions, so growth past --tolerance is only
+reported.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from benchmarks import graphs
+from benchmarks.server import FakePyPI
+from snek.cache import CacheEntry, MemoryCache
+from snek.reducer import Reducer
+from snek.requirement import Requirement
+from snek.resolver import Resolver
+from snek.solver import Solver
+from snek.tracing import Tracer, tracing
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+# Metrics that only depend on the code, not the machine, so any increase is a regression
+EXACT_METRICS = ('requests', 'bytes')
+# What the resolve produced, which shouldn't change at all
+RESULT_METRICS = ('nodes', 'pins')
+# Reported when they grow, but too noisy to fail the run on
+MEASURED_METRICS = ('resolve_seconds', 'reduce_seconds', 'peak_rss_kb', 'peak_threads')
+
+
+class Scenario(NamedTuple):
+    projects: Callable[[], Dict[str, dict]]
+    roots: List[str]
+    # 'resolve' builds the tree with Resolver and reduces it, 'solve' runs the backtracking Solver
+    mode: str = 'resolve'
+    # Resolve once beforehand and measure a resolve against the expired cache that leaves, like a returning user's
+    stale: bool = False
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    'flask': Scenario(graphs.fixtures, ['Flask[dev, docs, test]']),
+    'wide': Scenario(graphs.wide, ['root']),
+    'deep': Scenario(graphs.deep, ['root']),
+    'diamonds': Scenario(graphs.diamonds, ['root']),
+    'releases': Scenario(graphs.many_releases, ['root']),
+    'deep-stale': Scenario(graphs.deep, ['root'], stale=True),
+    # The tree resolver rejects cycles, the solver handles them
+    'cyclic': Scenario(graphs.cyclic, ['root'], mode='solve'),
+}
+
+
+class _ExpiredCache(MemoryCache):
+    """A cache whose entries all went stale at expire(), and whose later entries stay fresh."""
+
+    expired_at = 0.0
+
+    def expire(self):
+        self.expired_at = time.time()
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return entry.fetched_at > self.expired_at and super().is_fresh(entry)
+
+
+class _ThreadSampler(threading.Thread):
+    def __init__(self, interval: float = 0.005):
+        super().__init__(name='thread-sampler', daemon=True)
+        self.interval = interval
+        self.peak = self.count()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, self.count())
+
+    @staticmethod
+    def count() -> int:
+        # The fake server's threads are part of the harness, not the code being measured
+        return sum(1 for thread in threading.enumerate()
+                   if 'process_request' not in thread.name and thread.name not in ('fake-pypi', 'thread-sampler'))
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def run_scenario(name: str, latency: float = 0, bandwidth: float = None, error_rate: float = 0,
+                 trace_dir: str = None) -> dict:
+    scenario = SCENARIOS[name]
+    with FakePyPI(scenario.projects(), latency=latency, bandwidth=bandwidth, error_rate=error_rate) as pypi:
+        roots = {Requirement(root) for root in scenario.roots}
+        if scenario.stale:
+            cache = _ExpiredCache()
+            Resolver(pypi.repository(cache=cache)).resolve_many({Requirement(root) for root in scenario.roots})
+            cache.expire()
+            pypi.reset_counters()
+            repository = pypi.repository(cache=cache)
+        else:
+            repository = pypi.repository()
+        baseline_threads = _ThreadSampler.count()
+        sampler = _ThreadSampler()
+        sampler.start()
+
+        tracer = Tracer() if trace_dir else None
+        with tracing(tracer):
+            start = time.perf_counter()
+            reduce_seconds = 0.0
+            nodes = 0
+            if scenario.mode == 'solve':
+                pins = Solver(repository).solve(roots)
+                resolve_seconds = time.perf_counter() - start
+            else:
+                graph = Resolver(repository).resolve_many(roots)
+                resolve_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                pins = Reducer.reduce(graph)
+                reduce_seconds = time.perf_counter() - start
+                nodes = len(Reducer.flatten(graph))
+        if tracer is not None:
+            tracer.dump_chrome_trace(os.path.join(trace_dir, f"{name}.json"))
+
+        peak_threads = sampler.stop() - baseline_threads
+        return {
+            'resolve_seconds': round(resolve_seconds, 4),
+            'reduce_seconds': round(reduce_seconds, 4),
+            'requests': pypi.requests,
+            'bytes': pypi.bytes_sent,
+            'errors_injected': pypi.errors,
+            'nodes': nodes,
+            'pins': len(pins),
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_threads': max(peak_threads, 0),
+        }
+
+
+def _run_in_child(queue, name: str, options: dict):
+    queue.put(run_scenario(name, **options))
+
+
+def run_isolated(name: str, **options) -> dict:
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_in_child, args=(queue, name, options))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def compare(results: Dict[str, dict], baselines: Dict[str, dict], tolerance: float) -> Tuple[List[str], List[str]]:
+    """Regressions in the deterministic metrics, and notes on measured ones that grew by more than tolerance."""
+    regressions, notes = [], []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        for metric in EXACT_METRICS + RESULT_METRICS:
+            # Baselines saved before a metric was added don't have it
+            if metric not in baseline:
+                continue
+            if result[metric] > baseline[metric] if metric in EXACT_METRICS else result[metric] != baseline[metric]:
+                regressions.append(f"{name}: {metric} went from {baseline[metric]} to {result[metric]}")
+        for metric in MEASURED_METRICS:
+            # Ignore noise in very small measurements
+            limit = max(baseline[metric] * (1 + tolerance), baseline[metric] + 0.01)
+            if result[metric] > limit:
+                notes.append(f"{name}: {metric} went from {baseline[metric]} to {result[metric]}")
+    return regressions, notes
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the resolver against a local fake PyPI.')
+    parser.add_argument('scenarios', nargs='*', help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes per second per response')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of URLs that fail once with a 503')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='growth of times and memory to report, which never fails the run')
+    parser.add_argument('--baselines', default=BASELINES, help='baseline file to compare against or save to')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baselines')
+    parser.add_argument('--trace-dir', help='write a Chrome trace of each scenario to this directory')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    options = {'latency': args.latency, 'bandwidth': args.bandwidth, 'error_rate': args.error_rate}
+    results = {}
+    for name in args.scenarios or SCENARIOS:
+        results[name] = run_isolated(name, trace_dir=args.trace_dir, **options)
+        print(f"{name:>10}  " + '  '.join(f"{metric}={value}" for metric, value in results[name].items()))
+
+    if args.save:
+        with open(args.baselines, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+
+    # Baselines are recorded without latency, bandwidth limits or errors, other runs aren't comparable
+    if any(options.values()) or not os.path.exists(args.baselines):
+        return 0
+    with open(args.baselines, 'r', encoding='utf-8') as f:
+        regressions, notes = compare(results, json.load(f), args.tolerance)
+    for note in notes:
+        print(f"NOTE {note}", file=sys.stderr)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Optional, Tuple
+
+from snek.repository import Repository
+from snek.utils import convert_to_version
+
+
+class FakePyPI:
+    """
+    A local stand-in for PyPI's JSON and Simple APIs, serving project records in the format LocalRepository reads
+    ({"releases": [...], "metadata": {version: info}}).
+
+    Every response can be delayed by a fixed latency and throttled to a bandwidth in bytes per second. error_rate is the
+    fraction of URLs that answer 503 the first time they're requested, picked by hashing the URL with the seed so the
+    same URLs fail on every run and request counts stay comparable between runs.
+    """
+
+    def __init__(self, projects: Dict[str, dict], latency: float = 0, bandwidth: Optional[float] = None,
+                 error_rate: float = 0, seed: int = 0):
+        self.projects = {name.lower(): project for name, project in projects.items()}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.seed = seed
+        self.requests = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def repository(self, simple: bool = True, **kwargs) -> Repository:
+        # No backoff, injected errors should cost a request, not a sleep
+        kwargs.setdefault('backoff_factor', 0)
+        return Repository(f"{self.url}/pypi", simple_url=f"{self.url}/simple" if simple else '', **kwargs)
+
+    def start(self) -> 'FakePyPI':
+        handler = type('Handler', (_Handler,), {'pypi': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-pypi', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakePyPI':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counters(self):
+        """Start counting requests from zero. URLs that already failed once still won't fail again."""
+        with self._lock:
+            self.requests = self.bytes_sent = self.errors = 0
+
+    def should_fail(self, path: str) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            if path in self._failed:
+                return False
+            if zlib.crc32(f"{self.seed}:{path}".encode('utf-8')) / 0xffffffff >= self.error_rate:
+                return False
+            self._failed.add(path)
+            self.errors += 1
+            return True
+
+    def route(self, path: str) -> Tuple[int, str, bytes]:
+        parts = [part for part in path.split('/') if part]
+        if len(parts) >= 3 and parts[0] == 'pypi' and parts[-1] == 'json':
+            project = self.projects.get(parts[1].lower())
+            if project is not None:
+                document = self._json_document(project, parts[2] if len(parts) == 4 else None)
+                if document is not None:
+                    return 200, 'application/json', json.dumps(document).encode('utf-8')
+        elif len(parts) == 2 and parts[0] == 'simple':
+            name = parts[1].lower()
+            project = self.projects.get(name)
+            if project is not None:
+                return 200, Repository.SIMPLE_JSON_TYPE, json.dumps(self._simple_page(name, project)).encode('utf-8')
+        elif len(parts) == 4 and parts[0] == 'files' and parts[3].endswith('.whl.metadata'):
+            info = self.projects.get(parts[1], {}).get('metadata', {}).get(parts[2])
+            if info is not None:
+                return 200, 'text/plain', self._core_metadata(parts[1], info)
+        return 404, 'text/plain', b'Not Found'
+
+    def _json_document(self, project: dict, version: Optional[str]) -> Optional[dict]:
+        metadata = project['metadata']
+        if version is None:
+            version = max(metadata, key=convert_to_version)
+        if version not in metadata:
+            return None
+        return {'info': metadata[version], 'releases': {release: [] for release in project['releases']}}
+
+    def _simple_page(self, name: str, project: dict) -> dict:
+        files = []
+        for version, info in project['metadata'].items():
+            filename = f"{name.replace('-', '_')}-{version}-py3-none-any.whl"
+            files.append({'filename': filename, 'url': f"{self.url}/files/{name.lower()}/{version}/{filename}",
+                          'hashes': {},
+                          'core-metadata': {'sha256': hashlib.sha256(self._core_metadata(name, info)).hexdigest()}})
+        return {'meta': {'api-version': '1.1'}, 'name': name, 'files': files, 'versions': project['releases']}
+
+    @staticmethod
+    def _core_metadata(name: str, info: dict) -> bytes:
+        lines = ['Metadata-Version: 2.1', f"Name: {name}", f"Version: {info['version']}"]
+        lines.extend(f"Requires-Dist: {requirement}" for requirement in info.get('requires_dist') or [])
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    pypi: FakePyPI
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, don't let the second one wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        pypi = self.pypi
+        if pypi.latency:
+            time.sleep(pypi.latency)
+        if pypi.should_fail(self.path):
+            status, content_type, body = 503, 'text/plain', b'Service Unavailable'
+        else:
+            status, content_type, body = pypi.route(self.path)
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if pypi.bandwidth:
+            # Send in 4K slices, sleeping as long as each would take at the configured rate
+            for start in range(0, len(body), 4096):
+                self.wfile.write(body[start:start + 4096])
+                time.sleep(min(4096, len(body) - start) / pypi.bandwidth)
+        else:
+            self.wfile.write(body)
+        with pypi._lock:
+            pypi.requests += 1
+            pypi.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,136 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from snek import tracing
+from snek.lockfile import LockFile
+from snek.offline import read_manifest
+from snek.reducer import Reducer
+from snek.repository import Repository
+from snek.requirement import Requirement
+from snek.resolver import Resolver
+from snek.utils import parallel_map
+
+log = logging.getLogger(__name__)
+
+
+class ManifestResult(NamedTuple):
+    pins: Optional[Dict[str, str]]
+    error: Optional[str] = None
+
+
+class BatchResolver:
+    """
+    Resolves many manifests in one go. Every root requirement that appears in any manifest is resolved once, against
+    one repository and one subtree memo, so the network and tree building cost grows with the number of distinct
+    packages rather than with the number of manifests.
+
+    Reducing is done per manifest in a process pool. The resolved roots are handed to the workers once, serialized as
+    a lock file, and each task is just the list of root requirements to reduce. Manifests with the same requirements
+    are only reduced once.
+    """
+
+    def __init__(self, repository: Optional[Repository] = None, processes: Optional[int] = None,
+                 timeout: Optional[float] = None, tracer: Optional[tracing.Tracer] = None):
+        self.resolver = Resolver(repository, timeout=timeout, tracer=tracer)
+        # 0 reduces in this process, which is faster for a handful of small manifests
+        self.processes = processes
+
+    def resolve(self, manifests: Dict[str, Iterable[Requirement]]) -> Dict[str, ManifestResult]:
+        manifests = {name: sorted(set(requirements), key=str) for name, requirements in manifests.items()}
+        unique_roots = {str(requirement): requirement for requirements in manifests.values()
+                        for requirement in requirements}
+        log.info(f"Resolving {len(unique_roots)} distinct requirement(s) from {len(manifests)} manifest(s)")
+
+        # A root that can't be resolved only fails the manifests it's in
+        errors: Dict[str, str] = {}
+
+        def resolve_root(requirement: Requirement):
+            try:
+                self.resolver.resolve(requirement)
+            except Exception as e:
+                errors[str(requirement)] = f"{requirement}: {e!r}"
+
+        parallel_map(resolve_root, unique_roots.values())
+        resolved = {root: requirement for root, requirement in unique_roots.items() if root not in errors}
+        lock_file = LockFile.from_graph({requirement: {} for requirement in resolved.values()}, {})
+
+        results: Dict[str, ManifestResult] = {}
+        tasks: Dict[str, List[str]] = {}
+        for name, requirements in manifests.items():
+            failed = [errors[str(requirement)] for requirement in requirements if str(requirement) in errors]
+            if failed:
+                results[name] = ManifestResult(None, '; '.join(failed))
+            else:
+                tasks.setdefault(LockFile.hash_manifest(requirements), list(map(str, requirements)))
+
+        with tracing.tracing(self.resolver.tracer), tracing.current_tracer().span('reduce', manifests=len(tasks)):
+            reduced = self._reduce_all(lock_file, tasks)
+        for name, requirements in manifests.items():
+            if name not in results:
+                results[name] = reduced[LockFile.hash_manifest(requirements)]
+        return results
+
+    def _reduce_all(self, lock_file: LockFile, tasks: Dict[str, List[str]]) -> Dict[str, ManifestResult]:
+        if self.processes == 0 or len(tasks) <= 1:
+            _init_worker(lock_file.roots, lock_file.releases)
+            return {key: _reduce_roots(roots) for key, roots in tasks.items()}
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                 initargs=(lock_file.roots, lock_file.releases)) as executor:
+            return dict(zip(tasks, executor.map(_reduce_roots, tasks.values(), chunksize=8)))
+
+    @staticmethod
+    def write(results: Dict[str, ManifestResult], suffix: str = '.pins.json'):
+        """Write each manifest's pins next to it. Manifests that failed don't get a file."""
+        for name, result in results.items():
+            if result.pins is None:
+                continue
+            path = f"{name}{suffix}"
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(result.pins, f, indent=2, sort_keys=True)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+
+
+# The resolved roots, shared by every task a worker process runs
+_worker_lock_file: Optional[LockFile] = None
+
+
+def _init_worker(roots: Dict[str, dict], releases: Dict[str, List[str]]):
+    global _worker_lock_file
+    _worker_lock_file = LockFile(roots, releases)
+
+
+def _reduce_roots(roots: List[str]) -> ManifestResult:
+    graph = {}
+    for root in roots:
+        requirement = _worker_lock_file.load_requirement(Requirement(root))
+        graph.update(Resolver.to_graph(requirement))
+    try:
+        return ManifestResult({name: str(version) for name, version in Reducer.reduce(graph).items()})
+    except Exception as e:
+        return ManifestResult(None, repr(e))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resolve many manifests at once, writing pins next to each one.')
+    parser.add_argument('manifests', nargs='+', help='requirements files, one requirement per line')
+    parser.add_argument('--processes', type=int, default=None, help='reduction processes (0 to reduce in-process)')
+    parser.add_argument('--suffix', default='.pins.json', help='appended to each manifest path for its pins')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    batch = BatchResolver(processes=args.processes)
+    batch_results = batch.resolve({path: read_manifest(path) for path in args.manifests})
+    BatchResolver.write(batch_results, args.suffix)
+    for path, batch_result in sorted(batch_results.items()):
+        if batch_result.error:
+            log.error(f"{path}: {batch_result.error}")
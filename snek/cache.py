@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, NamedTuple, Tuple
+
+log = logging.getLogger(__name__)
+
+# (index URL, project name, version or None for the project-level document)
+CacheKey = Tuple[str, str, Optional[str]]
+
+
+class CacheEntry(NamedTuple):
+    document: dict
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_at: float = 0.0
+
+
+class Cache:
+    """
+    Storage for metadata documents fetched by a Repository. Subclasses only need to implement get and set; entries
+    older than the TTL are revalidated by the repository using their ETag/Last-Modified headers.
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+
+    def get(self, key: CacheKey) -> Optional[CacheEntry]:
+        raise NotImplementedError
+
+    def set(self, key: CacheKey, entry: CacheEntry):
+        raise NotImplementedError
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.fetched_at < self.ttl
+
+    def requirements_path(self) -> Optional[str]:
+        """Where parsed requirement strings are saved next to the documents, if they are (see snek.parsing)."""
+        return None
+
+
+class MemoryCache(Cache):
+    def __init__(self, ttl: float = 600, max_entries: int = 4096):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: CacheKey) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: CacheKey, entry: CacheEntry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskCache(Cache):
+    """
+    Content-addressed on-disk cache. Each entry lives in its own file named after the hash of its key, and is written
+    to a temporary file first and then atomically renamed into place, so any number of processes can share the same
+    directory without locking. File modification times double as LRU timestamps for size-bounded eviction.
+    """
+
+    def __init__(self, directory: str, ttl: float = 600, max_size: int = 256 * 1024 * 1024):
+        super().__init__(ttl)
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key: CacheKey) -> str:
+        digest = hashlib.sha256('\0'.join(part or '' for part in key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def requirements_path(self) -> Optional[str]:
+        # Entries live in subdirectories, so this is never mistaken for one or evicted
+        return os.path.join(self.directory, 'requirements.json')
+
+    def get(self, key: CacheKey) -> Optional[CacheEntry]:
+        path = self.path_for(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            log.warning(f"Discarding unreadable cache entry {path}")
+            self._remove(path)
+            return None
+        try:
+            # Bump the modification time so recently used entries survive eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return CacheEntry(**data)
+
+    def set(self, key: CacheKey, entry: CacheEntry):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry._asdict(), f)
+            size = os.path.getsize(temp_path)
+            # An entry being overwritten no longer counts towards the size
+            try:
+                size -= os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += size
+            over_limit = self._size > self.max_size
+        if over_limit:
+            self.evict()
+
+    def size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_size."""
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+        with self._lock:
+            self._size = total
+
+    def _entries(self):
+        for directory in os.scandir(self.directory):
+            if not directory.is_dir():
+                continue
+            for file in os.scandir(directory.path):
+                if not file.name.endswith('.json'):
+                    continue
+                try:
+                    stat = file.stat()
+                except FileNotFoundError:
+                    # Another process evicted it first
+                    continue
+                yield stat.st_mtime, file.path, stat.st_size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,157 @@
+import threading
+from typing import Dict, List, Optional, Tuple, Any, Iterator
+
+NO_PARENT = -1
+
+
+class DependencyGraph:
+    """
+    Arena holding every node of one or more requirement trees. Nodes are integer ids into parallel lists, project names
+    are interned to ids, and metadata documents and version indexes are stored once per project rather than per node.
+    snek.requirement.Requirement objects are thin views over a node in one of these.
+    """
+
+    __slots__ = ('lock', '_project_ids', '_project_names', '_nodes', '_projects', '_parents', '_attached',
+                 '_children', '_compatible_versions', '_best_versions', '_metadata_keys', '_metadata',
+                 '_version_indexes', '_by_key')
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._project_ids: Dict[str, int] = {}
+        self._project_names: List[str] = []
+        # Per-node columns, indexed by node id
+        self._nodes: List[Any] = []
+        self._projects: List[int] = []
+        self._parents: List[int] = []
+        # Whether the node has been added to its parent's children, as opposed to only pointing at its parent
+        self._attached = bytearray()
+        self._children: List[List[int]] = []
+        self._compatible_versions: List[list] = []
+        self._best_versions: List[Any] = []
+        self._metadata_keys: List[Optional[Tuple[int, Optional[str]]]] = []
+        # Per-project data
+        self._metadata: Dict[Tuple[int, Optional[str]], dict] = {}
+        self._version_indexes: Dict[int, Any] = {}
+        # Node ids by requirement string, for equality-based lookups
+        self._by_key: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def project_id(self, name: str) -> int:
+        name = name.lower()
+        project = self._project_ids.get(name)
+        if project is None:
+            with self.lock:
+                project = self._project_ids.setdefault(name, len(self._project_names))
+                if project == len(self._project_names):
+                    self._project_names.append(name)
+        return project
+
+    def add_node(self, node, key: str, parent: int = NO_PARENT) -> int:
+        project = self.project_id(node.name)
+        with self.lock:
+            node_id = len(self._nodes)
+            self._nodes.append(node)
+            self._projects.append(project)
+            self._parents.append(parent)
+            self._attached.append(0)
+            self._children.append([])
+            self._compatible_versions.append([])
+            self._best_versions.append(None)
+            self._metadata_keys.append(None)
+            self._by_key.setdefault(key, []).append(node_id)
+        return node_id
+
+    def node(self, node_id: int):
+        return self._nodes[node_id]
+
+    def parent(self, node_id: int) -> int:
+        return self._parents[node_id]
+
+    def children(self, node_id: int) -> List[int]:
+        return self._children[node_id]
+
+    def is_attached(self, node_id: int) -> bool:
+        return bool(self._attached[node_id])
+
+    def attach(self, parent: int, child: int):
+        with self.lock:
+            self._parents[child] = parent
+            if not self._attached[child]:
+                self._attached[child] = 1
+                self._children[parent].append(child)
+
+    def ancestors(self, node_id: int) -> Iterator[int]:
+        node_id = self._parents[node_id]
+        while node_id != NO_PARENT:
+            yield node_id
+            node_id = self._parents[node_id]
+
+    def has_descendant(self, node_id: int, key: str) -> bool:
+        # Walk up from every node equal to the one we're looking for, rather than down the whole subtree
+        for candidate in self._by_key.get(key, ()):
+            while candidate != node_id and self._attached[candidate]:
+                candidate = self._parents[candidate]
+                if candidate == node_id:
+                    return True
+        return False
+
+    def subtree(self, node_id: int) -> List[int]:
+        """Node ids of the attached subtree rooted at node_id, parents before children."""
+        result = [node_id]
+        for current in result:
+            result.extend(self._children[current])
+        return result
+
+    def get_metadata(self, node_id: int) -> dict:
+        key = self._metadata_keys[node_id]
+        return self._metadata[key] if key is not None else {}
+
+    def set_metadata(self, node_id: int, metadata: dict):
+        if not metadata:
+            self._metadata_keys[node_id] = None
+            return
+        key = (self._projects[node_id], metadata.get('info', {}).get('version'))
+        with self.lock:
+            # Every node for the same release shares one document
+            self._metadata.setdefault(key, metadata)
+            self._metadata_keys[node_id] = key
+
+    def get_compatible_versions(self, node_id: int) -> list:
+        return self._compatible_versions[node_id]
+
+    def set_compatible_versions(self, node_id: int, versions: list):
+        self._compatible_versions[node_id] = versions
+
+    def get_best_version(self, node_id: int):
+        return self._best_versions[node_id]
+
+    def set_best_version(self, node_id: int, version):
+        self._best_versions[node_id] = version
+
+    def get_version_index(self, node_id: int):
+        return self._version_indexes.get(self._projects[node_id])
+
+    def set_version_index(self, node_id: int, index):
+        self._version_indexes[self._projects[node_id]] = index
+
+    def adopt(self, other: 'DependencyGraph', node_id: int, parent: int = NO_PARENT) -> int:
+        """Move the attached subtree rooted at node_id in another graph into this one, returning its new id."""
+        with self.lock, other.lock:
+            mapping = {NO_PARENT: parent}
+            for old_id in other.subtree(node_id):
+                node = other._nodes[old_id]
+                old_parent = other._parents[old_id] if old_id != node_id else NO_PARENT
+                new_id = self.add_node(node, str(node), mapping[old_parent])
+                mapping[old_id] = new_id
+                if old_id != node_id:
+                    self.attach(mapping[old_parent], new_id)
+                self._compatible_versions[new_id] = other._compatible_versions[old_id]
+                self._best_versions[new_id] = other._best_versions[old_id]
+                self.set_metadata(new_id, other.get_metadata(old_id))
+                index = other.get_version_index(old_id)
+                if index is not None:
+                    self.set_version_index(new_id, index)
+                node._bind(self, new_id)
+            return mapping[node_id]
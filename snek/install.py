@@ -0,0 +1,192 @@
+import argparse
+import logging
+import subprocess
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Union
+
+from packaging.version import Version, LegacyVersion
+
+from snek.reducer import Reducer, IncrementalReducer
+from snek.requirement import Requirement
+from snek.resolver import ResolveEvent, RESOLVED, FINISHED
+
+log = logging.getLogger(__name__)
+
+
+class InstallError(RuntimeError):
+    pass
+
+
+class InstallStep(NamedTuple):
+    name: str
+    version: str
+    # Names of the steps that have to be installed first
+    dependencies: FrozenSet[str]
+
+
+class InstallPlan:
+    """The reduced pins of a graph as install steps, each depending on the pinned packages its requirement needs."""
+
+    def __init__(self, steps: Dict[str, InstallStep]):
+        self.steps = steps
+
+    @staticmethod
+    def from_graph(dependencies: Dict[Requirement, Dict],
+                   pins: Dict[str, Union[Version, LegacyVersion]]) -> 'InstallPlan':
+        edges: Dict[str, set] = {name: set() for name in pins}
+        for requirement in Reducer.flatten(dependencies):
+            if requirement.name not in pins or not Reducer.is_compatible(requirement):
+                continue
+            edges[requirement.name].update(child.name for child in requirement.children()
+                                           if child.name in pins and child.name != requirement.name
+                                           and Reducer.is_compatible(child))
+        return InstallPlan({name: InstallStep(name, str(pins[name]), frozenset(edges[name])) for name in pins})
+
+    def levels(self) -> List[List[InstallStep]]:
+        """
+        Steps grouped so each group only depends on earlier ones, deepest dependencies first. Steps in the same group
+        can be installed in parallel. A dependency cycle is broken at the step with the fewest uninstalled dependencies.
+        """
+        remaining = {name: set(step.dependencies) for name, step in self.steps.items()}
+        levels = []
+        while remaining:
+            ready = sorted(name for name, dependencies in remaining.items() if not dependencies)
+            if not ready:
+                ready = [min(sorted(remaining), key=lambda name: len(remaining[name]))]
+                log.warning(f"Dependency cycle through {ready[0]}, "
+                            f"installing it before {', '.join(sorted(remaining[ready[0]]))}")
+            for name in ready:
+                del remaining[name]
+            for dependencies in remaining.values():
+                dependencies.difference_update(ready)
+            levels.append([self.steps[name] for name in ready])
+        return levels
+
+    def order(self) -> List[InstallStep]:
+        return [step for level in self.levels() for step in level]
+
+
+class InstallExecutor:
+    """
+    Installs pinned packages from a local wheel directory with pip install --no-deps, running every step whose
+    dependencies are already installed in parallel.
+
+    run() takes the events of Resolver.stream and installs a package while the resolve is still going once its subtree
+    is resolved, its pin is stable (see IncrementalReducer.stable_pin) and its dependencies have been started, e.g. for
+    exact pins in a manifest. Nothing is installed at a version that could still change, the rest waits for the final
+    plan, so the result is the same as installing the plan afterwards.
+    """
+
+    def __init__(self, wheel_dir: str, python: str = sys.executable, max_workers: int = 4):
+        self.wheel_dir = wheel_dir
+        self.python = python
+        self.max_workers = max_workers
+
+    def command(self, name: str, version: str) -> List[str]:
+        return [self.python, '-m', 'pip', 'install', '--no-deps', '--no-index', '--find-links', self.wheel_dir,
+                f"{name}=={version}"]
+
+    def install(self, plan: InstallPlan) -> Dict[str, str]:
+        """Install every step of the plan. Returns the installed versions by name."""
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='snek-install') as executor:
+            futures: Dict[str, Future] = {}
+            for step in plan.order():
+                futures[step.name] = self._submit(executor, step.name, step.version,
+                                                  [futures[name] for name in step.dependencies if name in futures])
+            return self._results(plan, futures)
+
+    def run(self, events: Iterable[ResolveEvent]) -> Dict[str, str]:
+        """Install while resolving, from Resolver.stream(...). Returns the installed versions by name."""
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='snek-install') as executor:
+            futures: Dict[str, Future] = {}
+            # Pins are worked out as nodes arrive, so there's little left to do once the resolve finishes
+            reducer = IncrementalReducer()
+            # Resolved nodes of packages that haven't been started yet
+            waiting: Dict[str, List[Requirement]] = {}
+            graph = None
+            for event in events:
+                if event.kind == FINISHED:
+                    graph = event.graph
+                elif event.kind == RESOLVED:
+                    reducer.add_requirement(event.requirement)
+                    if event.requirement.name not in futures and self._is_installable(event.requirement):
+                        waiting.setdefault(event.requirement.name, []).append(event.requirement)
+                        self._start_stable(executor, reducer, waiting, futures)
+            if graph is None:
+                raise InstallError("The resolve finished without a graph")
+
+            plan = InstallPlan.from_graph(graph, reducer.reduce())
+            for step in plan.order():
+                if step.name not in futures:
+                    dependencies = [futures[name] for name in step.dependencies if name in futures]
+                    futures[step.name] = self._submit(executor, step.name, step.version, dependencies)
+            return self._results(plan, futures)
+
+    def _start_stable(self, executor: ThreadPoolExecutor, reducer: IncrementalReducer,
+                      waiting: Dict[str, List[Requirement]], futures: Dict[str, Future]):
+        # Starting a package can make its dependents startable, so keep going until nothing changes
+        started = True
+        while started:
+            started = False
+            for name, requirements in list(waiting.items()):
+                dependencies = {child.name for requirement in requirements for child in requirement.children()
+                                if child.name != name and Reducer.is_compatible(child)}
+                if not dependencies.issubset(futures):
+                    continue
+                version = reducer.stable_pin(name)
+                if version is None:
+                    continue
+                log.debug(f"Installing {name}=={version} while resolving, its pin can't change")
+                futures[name] = self._submit(executor, name, str(version),
+                                             [futures[dependency] for dependency in dependencies])
+                del waiting[name]
+                started = True
+
+    @staticmethod
+    def _is_installable(requirement: Optional[Requirement]) -> bool:
+        while requirement is not None:
+            if requirement.best_candidate_version is None or not Reducer.is_compatible(requirement):
+                return False
+            requirement = requirement.parent()
+        return True
+
+    def _submit(self, executor: ThreadPoolExecutor, name: str, version: str, dependencies: List[Future]) -> Future:
+        # Dependencies are always submitted first, so they've started by the time this waits for them
+        return executor.submit(self._install_after, name, version, dependencies)
+
+    def _install_after(self, name: str, version: str, dependencies: List[Future]) -> str:
+        wait(dependencies)
+        if any(dependency.exception() is not None for dependency in dependencies):
+            raise InstallError(f"Skipped {name}=={version}, a dependency failed to install")
+        log.info(f"Installing {name}=={version}")
+        process = subprocess.run(self.command(name, version), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        if process.returncode != 0:
+            raise InstallError(f"pip couldn't install {name}=={version}:\n{process.stderr.strip()}")
+        return version
+
+    @staticmethod
+    def _results(plan: InstallPlan, futures: Dict[str, Future]) -> Dict[str, str]:
+        wait(futures.values())
+        errors = [str(future.exception()) for future in futures.values() if future.exception() is not None]
+        if errors:
+            raise InstallError('\n'.join(errors))
+        return {name: futures[name].result() for name in plan.steps}
+
+
+if __name__ == '__main__':
+    from snek.offline import read_manifest
+    from snek.resolver import Resolver
+
+    parser = argparse.ArgumentParser(description='Resolve a manifest and install it from a wheel directory.')
+    parser.add_argument('manifest', help='requirements file, one requirement per line')
+    parser.add_argument('wheel_dir', help='directory of wheels to install from')
+    parser.add_argument('--workers', type=int, default=4, help='parallel pip processes')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    installed = InstallExecutor(args.wheel_dir, max_workers=args.workers).run(
+        Resolver().stream(set(read_manifest(args.manifest))))
+    for installed_name, installed_version in sorted(installed.items()):
+        print(f"{installed_name}=={installed_version}")
@@ -0,0 +1,176 @@
+import logging
+import os
+import re
+import sys
+import threading
+from email.parser import HeaderParser
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from packaging.specifiers import SpecifierSet
+from packaging.version import Version, LegacyVersion
+
+from snek import tracing, utils
+from snek.requirement import Requirement
+
+log = logging.getLogger(__name__)
+
+_NORMALIZE = re.compile(r'[-_.]+')
+
+
+def normalize_name(name: str) -> str:
+    return _NORMALIZE.sub('-', name).lower()
+
+
+class InstalledDistribution(NamedTuple):
+    name: str
+    version: str
+    requires_dist: Optional[List[str]]
+    path: str
+
+
+class InstalledIndex:
+    """
+    The distributions installed in one or more site-packages directories, read from their .dist-info and .egg-info
+    metadata. Only the metadata headers are read. Each directory is rescanned only when its mtime changes, which is
+    whenever something is installed into or removed from it.
+
+    Where a project is installed in several directories, the first directory wins, like it does on sys.path.
+    """
+
+    def __init__(self, paths: Optional[Iterable[str]] = None):
+        if paths is None:
+            paths = [path for path in sys.path if path.endswith(('site-packages', 'dist-packages'))]
+        self.paths = [path for path in paths if os.path.isdir(path)]
+        self._scans: Dict[str, Tuple[int, Dict[str, InstalledDistribution]]] = {}
+        self._distributions: Dict[str, InstalledDistribution] = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def get(self, name: str) -> Optional[InstalledDistribution]:
+        return self._distributions.get(normalize_name(name))
+
+    def __contains__(self, name: str) -> bool:
+        return normalize_name(name) in self._distributions
+
+    def __len__(self) -> int:
+        return len(self._distributions)
+
+    def refresh(self):
+        """Rescan the directories that have changed since they were last scanned."""
+        with self._lock:
+            changed = False
+            for path in self.paths:
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    mtime = -1
+                scan = self._scans.get(path)
+                if scan is None or scan[0] != mtime:
+                    self._scans[path] = (mtime, self._scan(path) if mtime != -1 else {})
+                    changed = True
+            if changed:
+                distributions: Dict[str, InstalledDistribution] = {}
+                for path in reversed(self.paths):
+                    distributions.update(self._scans[path][1])
+                self._distributions = distributions
+
+    def satisfies(self, name: str, specifier: SpecifierSet) -> bool:
+        """Whether a project is installed at a version the specifier allows."""
+        return self._matching(name, specifier) is not None
+
+    def populate_requirement(self, requirement: Requirement) -> bool:
+        """
+        Fill in a requirement from the installed distribution if that satisfies it, the same way
+        Repository.populate_requirement would from the index. Returns False if it isn't installed or doesn't match.
+        """
+        matching = self._matching(requirement.name, requirement.specifier)
+        if matching is None:
+            return False
+        distribution, version = matching
+        tracing.current_tracer().count('installed.hits')
+        requirement.compatible_versions = [version]
+        requirement.best_candidate_version = version
+        requirement.project_metadata = {'info': {'version': distribution.version,
+                                                 'requires_dist': distribution.requires_dist},
+                                        'releases': {distribution.version: []}}
+        return True
+
+    def _matching(self, name: str,
+                  specifier: SpecifierSet) -> Optional[Tuple[InstalledDistribution, Union[Version, LegacyVersion]]]:
+        distribution = self.get(name)
+        if distribution is None:
+            return None
+        version = utils.convert_to_version(distribution.version)
+        if not specifier.contains(version, prereleases=True):
+            return None
+        return distribution, version
+
+    @staticmethod
+    def _scan(path: str) -> Dict[str, InstalledDistribution]:
+        distributions: Dict[str, InstalledDistribution] = {}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.name.endswith('.dist-info'):
+                        distribution = InstalledIndex._read_dist_info(entry.path)
+                    elif entry.name.endswith('.egg-info'):
+                        distribution = InstalledIndex._read_egg_info(entry.path, entry.is_dir())
+                    else:
+                        continue
+                except (OSError, ValueError) as e:
+                    log.debug(f"Skipping unreadable metadata in {entry.path}: {e}")
+                    continue
+                if distribution is not None:
+                    distributions.setdefault(normalize_name(distribution.name), distribution)
+        return distributions
+
+    @staticmethod
+    def _read_dist_info(path: str) -> Optional[InstalledDistribution]:
+        headers = InstalledIndex._read_headers(os.path.join(path, 'METADATA'))
+        if not headers['Name'] or not headers['Version']:
+            return None
+        return InstalledDistribution(headers['Name'], headers['Version'], headers.get_all('Requires-Dist'), path)
+
+    @staticmethod
+    def _read_egg_info(path: str, is_dir: bool) -> Optional[InstalledDistribution]:
+        headers = InstalledIndex._read_headers(os.path.join(path, 'PKG-INFO') if is_dir else path)
+        if not headers['Name'] or not headers['Version']:
+            return None
+        requires_dist = None
+        requires_path = os.path.join(path, 'requires.txt')
+        if is_dir and os.path.exists(requires_path):
+            with open(requires_path, 'r', encoding='utf-8') as f:
+                requires_dist = _convert_requires_txt(f) or None
+        return InstalledDistribution(headers['Name'], headers['Version'], requires_dist, path)
+
+    @staticmethod
+    def _read_headers(path: str):
+        # The long description after the headers can be huge, and we don't need it
+        lines = []
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.strip():
+                    break
+                lines.append(line)
+        return HeaderParser().parsestr(''.join(lines))
+
+
+def _convert_requires_txt(lines: Iterable[str]) -> List[str]:
+    """Turn setuptools' requires.txt, with its [extra:marker] sections, into Requires-Dist strings."""
+    requires_dist = []
+    marker = ''
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            extra, _, condition = line[1:-1].partition(':')
+            conditions = []
+            if condition:
+                conditions.append(f"({condition})" if extra else condition)
+            if extra:
+                conditions.append(f'extra == "{extra}"')
+            marker = ' and '.join(conditions)
+            continue
+        requires_dist.append(f"{line}; {marker}" if marker else line)
+    return requires_dist
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Optional, Union, Iterable, List
+
+from packaging.version import Version, LegacyVersion
+
+from snek import utils, parsing
+from snek.reducer import Reducer
+from snek.requirement import Requirement
+from snek.versions import VersionIndex
+
+
+class LockFileError(RuntimeError):
+    pass
+
+
+class LockFile:
+    """
+    Resolved dependency graphs and pinned versions, stored as JSON. Each root requirement is stored with a hash of its
+    locked graph and the releases that graph was resolved from, so a root is only reused as long as neither has been
+    edited since it was locked. Every node of every graph is recorded, including ones
+    whose markers don't match the current environment, along with the release list of each project so compatible
+    versions can be recomputed without going back to the index.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, roots: Optional[Dict[str, dict]] = None, releases: Optional[Dict[str, List[str]]] = None,
+                 pins: Optional[Dict[str, str]] = None):
+        self.roots: Dict[str, dict] = roots or {}
+        self.releases: Dict[str, List[str]] = releases or {}
+        self.pins: Dict[str, str] = pins or {}
+        self._indexes: Dict[str, VersionIndex] = {}
+
+    def hash_root(self, graph: dict) -> str:
+        """Hash a root's locked graph along with the release lists of every project in it."""
+        digest = hashlib.sha256()
+        names = set()
+        # Node by node in pre-order, since serializing the nested graph in one go is recursive
+        stack = [graph]
+        while stack:
+            node = stack.pop()
+            names.add(parsing.parse(node['requirement']).name.lower())
+            digest.update(json.dumps([node['requirement'], node['version'], node['compatible'],
+                                      len(node['requires'])]).encode('utf-8'))
+            stack.extend(reversed(node['requires']))
+        releases = {name: self.releases.get(name) for name in names}
+        digest.update(json.dumps(releases, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_manifest(requirements: Iterable[Requirement]) -> str:
+        return hashlib.sha256('\n'.join(sorted(map(str, requirements))).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_graph(cls, dependencies: Dict[Requirement, Dict],
+                   pins: Dict[str, Union[Version, LegacyVersion]]) -> 'LockFile':
+        lock_file = cls(pins={name: str(version) for name, version in pins.items()})
+        for root in dependencies:
+            graph = lock_file._dump_graph(root)
+            lock_file.roots[str(root)] = {'hash': lock_file.hash_root(graph), 'graph': graph}
+        return lock_file
+
+    @property
+    def manifest_hash(self) -> str:
+        return hashlib.sha256('\n'.join(sorted(self.roots)).encode('utf-8')).hexdigest()
+
+    def is_locked(self, requirement: Requirement) -> bool:
+        root = self.roots.get(str(requirement))
+        return root is not None and root['hash'] == self.hash_root(root['graph'])
+
+    def load_requirement(self, requirement: Requirement) -> Optional[Requirement]:
+        """Rebuild the locked graph for a root requirement, or return None if it isn't locked or has changed."""
+        if not self.is_locked(requirement):
+            return None
+        self._load_graph(self.roots[str(requirement)]['graph'], requirement)
+        return requirement
+
+    def hints(self) -> Dict[str, List[str]]:
+        """The locked requirements of every project in the lock file by lowercase name, as FetchScheduler hints."""
+        hints: Dict[str, List[str]] = {}
+        stack = [root['graph'] for root in self.roots.values()]
+        while stack:
+            node = stack.pop()
+            hints.setdefault(parsing.parse(node['requirement']).name.lower(),
+                             [child['requirement'] for child in node['requires']])
+            stack.extend(node['requires'])
+        return hints
+
+    def dump(self, path: str):
+        data = {
+            'version': self.FORMAT_VERSION,
+            'manifest_hash': self.manifest_hash,
+            'roots': self.roots,
+            'releases': self.releases,
+            'pins': self.pins,
+        }
+        # Write a temporary file next to the lock file and rename it into place, so concurrent writers can't interleave
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> 'LockFile':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != cls.FORMAT_VERSION:
+            raise LockFileError(f"Unsupported lock file version: {data.get('version')}")
+        return cls(data['roots'], data['releases'], data['pins'])
+
+    def _dump_graph(self, root: Requirement) -> dict:
+        # Walked with an explicit stack like Requirement.descendants, so deep graphs don't hit the recursion limit
+        graph = self._dump_node(root)
+        stack = [(root, graph)]
+        while stack:
+            requirement, node = stack.pop()
+            for child in sorted(requirement.children(), key=str):
+                child_node = self._dump_node(child)
+                node['requires'].append(child_node)
+                stack.append((child, child_node))
+        return graph
+
+    def _dump_node(self, requirement: Requirement) -> dict:
+        name = requirement.name.lower()
+        if name not in self.releases:
+            index = requirement.version_index
+            self.releases[name] = list(map(str, index.versions)) if index else \
+                list(map(str, sorted(requirement.compatible_versions)))
+        return {
+            'requirement': str(requirement),
+            'version': str(requirement.best_candidate_version),
+            'compatible': Reducer.is_compatible(requirement),
+            'requires': [],
+        }
+
+    def _load_graph(self, graph: dict, root: Requirement):
+        stack = [(graph, root)]
+        while stack:
+            node, requirement = stack.pop()
+            self._load_node(node, requirement)
+            for child_node in node['requires']:
+                child = Requirement.parse(child_node['requirement'], parent=requirement)
+                requirement.add_sub_requirement(child)
+                stack.append((child_node, child))
+
+    def _load_node(self, node: dict, requirement: Requirement):
+        name = requirement.name.lower()
+        index = self._indexes.get(name)
+        if index is None:
+            index = self._indexes.setdefault(name, VersionIndex(self.releases.get(name, [])))
+        requirement.version_index = index
+        requirement.compatible_versions = index.filter(requirement.specifier)
+        requirement.best_candidate_version = utils.convert_to_version(node['version'])
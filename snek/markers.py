@@ -0,0 +1,122 @@
+import functools
+from typing import Dict, FrozenSet, Iterator, Optional, Tuple, Union
+
+from packaging.markers import Marker, default_environment
+# Private to packaging, only used through the parse tree helpers below
+from packaging.markers import Op, Value, Variable
+
+# Marker variables that differ between the platforms we build for
+PLATFORMS: Dict[str, Dict[str, str]] = {
+    'linux': {'sys_platform': 'linux', 'platform_system': 'Linux', 'os_name': 'posix', 'platform_machine': 'x86_64'},
+    'macos': {'sys_platform': 'darwin', 'platform_system': 'Darwin', 'os_name': 'posix', 'platform_machine': 'x86_64'},
+    'windows': {'sys_platform': 'win32', 'platform_system': 'Windows', 'os_name': 'nt', 'platform_machine': 'AMD64'},
+}
+
+
+class MarkerPredicate:
+    """
+    A marker compiled down to the variables it reads, with its result memoized per combination of their values. Most
+    markers only look at one or two variables, so a whole matrix of environments usually costs a couple of evaluations.
+    """
+
+    __slots__ = ('marker', 'variables', 'extras', '_results')
+
+    def __init__(self, marker: Marker):
+        self.marker = marker
+        comparisons = list(_comparisons(_parse_tree(marker)))
+        self.variables: Tuple[str, ...] = tuple(sorted({node.value for comparison in comparisons
+                                                        for node in comparison if isinstance(node, Variable)}))
+        # The extras the marker compares 'extra' against, e.g. {'dev'} for 'extra == "dev"'
+        self.extras: FrozenSet[str] = frozenset(
+            right.value if isinstance(left, Variable) else left.value for left, _, right in comparisons
+            if _is_extra(left) and isinstance(right, Value) or _is_extra(right) and isinstance(left, Value))
+        self._results: Dict[Tuple[Optional[str], ...], bool] = {}
+
+    def __call__(self, environment: Dict[str, str]) -> bool:
+        key = tuple(environment.get(variable) for variable in self.variables)
+        result = self._results.get(key)
+        if result is None:
+            # Variables the environment doesn't set fall back to the running interpreter's, like Marker.evaluate
+            result = self._results[key] = self.marker.evaluate(
+                {variable: value for variable, value in zip(self.variables, key) if value is not None})
+        return result
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_marker(marker: str) -> MarkerPredicate:
+    return MarkerPredicate(Marker(marker))
+
+
+def _is_extra(node) -> bool:
+    return isinstance(node, Variable) and node.value == 'extra'
+
+
+def _comparisons(markers: list) -> Iterator[tuple]:
+    for item in markers:
+        if isinstance(item, list):
+            yield from _comparisons(item)
+        elif isinstance(item, tuple):
+            yield item
+
+
+# packaging has no public API for a marker's parse tree, so these two are the only places that touch Marker._markers.
+# The tree's shape and its Op / Value / Variable nodes are private to packaging and may change with it, which is why
+# parsing.py only reuses cached trees with the packaging version that wrote them.
+_NODE_TYPES = {'variable': Variable, 'value': Value, 'op': Op}
+
+
+def _parse_tree(marker: Marker) -> list:
+    """Nested lists of (left, op, right) comparisons joined by 'and' / 'or'."""
+    return marker._markers
+
+
+def _from_parse_tree(tree: list) -> Marker:
+    marker = Marker.__new__(Marker)
+    marker._markers = tree
+    return marker
+
+
+def marker_to_json(marker: Marker) -> list:
+    """A marker's parsed form as JSON, which marker_from_json turns back into a Marker without parsing it again."""
+    def encode(item) -> Union[str, list, dict]:
+        if isinstance(item, list):
+            return list(map(encode, item))
+        if isinstance(item, tuple):
+            return {'compare': list(map(encode, item))}
+        if isinstance(item, str):
+            # 'and' / 'or'
+            return item
+        return {type(item).__name__.lower(): item.value}
+
+    return encode(_parse_tree(marker))
+
+
+def marker_from_json(data: list) -> Marker:
+    def decode(item):
+        if isinstance(item, list):
+            return list(map(decode, item))
+        if isinstance(item, str):
+            return item
+        if 'compare' in item:
+            return tuple(map(decode, item['compare']))
+        (node_type, value), = item.items()
+        return _NODE_TYPES[node_type](value)
+
+    return _from_parse_tree(decode(data))
+
+
+def target_environment(python_version: str, platform: str = 'linux', implementation: str = 'cpython') -> Dict[str, str]:
+    """A marker environment for another interpreter and platform, e.g. target_environment('3.8', 'windows')."""
+    if platform not in PLATFORMS:
+        raise ValueError(f"Unknown platform '{platform}', expected one of {', '.join(PLATFORMS)}")
+    full_version = python_version if python_version.count('.') >= 2 else f"{python_version}.0"
+    environment = dict(default_environment())
+    environment.update(PLATFORMS[platform])
+    environment.update({
+        'python_version': '.'.join(python_version.split('.')[:2]),
+        'python_full_version': full_version,
+        'implementation_name': implementation,
+        'implementation_version': full_version,
+        'platform_python_implementation': {'cpython': 'CPython', 'pypy': 'PyPy'}.get(implementation, implementation),
+    })
+    return environment
@@ -0,0 +1,276 @@
+import codecs
+import hashlib
+import itertools
+import json
+import re
+from email.parser import HeaderParser
+from typing import Iterable, Iterator, Union, Optional, Dict, List, Tuple
+
+from snek import utils
+
+# Everything up to the next bracket, stepping over whole strings so brackets inside them don't count
+_SKIP = re.compile(r'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR = re.compile(r'[^,:{}\[\]\s"]+')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+INFO_FIELDS = ('version', 'requires_dist')
+
+# Documents up to this size are decoded in one go by the C json parser, which is a few times faster than scanning them
+# in Python. Only bigger ones are streamed, where keeping just a chunk in memory at a time is worth the CPU.
+STREAMING_THRESHOLD = 1024 * 1024
+
+
+class MetadataParseError(ValueError):
+    pass
+
+
+def parse_package_info(chunks: Iterable[Union[bytes, str]]) -> dict:
+    """
+    Pull the fields the resolver needs out of a PyPI JSON API document as it streams in: info.version,
+    info.requires_dist and the names of the releases. Everything else, in particular the file listings of every
+    release, is skipped over without being decoded, so only a chunk or two of the document is in memory at a time.
+
+    The result has the same shape as the original document, minus the fields that were skipped.
+    """
+    document, chunks = _read_small(chunks)
+    if document is not None:
+        info = _get(document, 'info', dict)
+        return {'info': {field: info.get(field) for field in INFO_FIELDS},
+                'releases': {release: [] for release in _get(document, 'releases', dict)}}
+
+    stream = _JSONStream(chunks)
+    info = {field: None for field in INFO_FIELDS}
+    releases = {}
+    for key in stream.object_keys():
+        if key == 'info':
+            for field in stream.object_keys():
+                if field in INFO_FIELDS:
+                    info[field] = stream.read_value()
+                else:
+                    stream.skip_value()
+        elif key == 'releases':
+            for release in stream.object_keys():
+                releases[release] = []
+                stream.skip_value()
+        else:
+            stream.skip_value()
+    return {'info': info, 'releases': releases}
+
+
+def parse_project_index(chunks: Iterable[Union[bytes, str]]) -> dict:
+    """
+    Pull the release list and the PEP 658 metadata files out of a Simple API (PEP 691) project page as it streams in.
+
+    'versions' is the project's release list (PEP 700), or None for indexes that don't provide it. 'metadata' maps each
+    normalized version to the URL and hashes of a wheel whose core metadata can be downloaded on its own, preferring
+    pure Python wheels.
+    """
+    document, chunks = _read_small(chunks)
+    if document is not None:
+        files = _get(document, 'files', list)
+        return {'versions': document.get('versions'), 'metadata': _metadata_files(files)}
+
+    stream = _JSONStream(chunks)
+    versions = None
+    files: List[dict] = []
+    for key in stream.object_keys():
+        if key == 'versions':
+            versions = stream.read_value()
+        elif key == 'files':
+            for _ in stream.array_items():
+                file = stream.read_value()
+                # Only the few files with core metadata are kept
+                if file.get('core-metadata', file.get('data-dist-info-metadata')):
+                    files.append(file)
+        else:
+            stream.skip_value()
+    return {'versions': versions, 'metadata': _metadata_files(files)}
+
+
+def _metadata_files(files: Iterable[dict]) -> Dict[str, dict]:
+    metadata: Dict[str, dict] = {}
+    for file in files:
+        filename: str = file.get('filename', '')
+        # data-dist-info-metadata is the name PEP 658 originally used, before PEP 714 renamed it
+        hashes = file.get('core-metadata', file.get('data-dist-info-metadata'))
+        if not hashes or not filename.endswith('.whl'):
+            continue
+        version = str(utils.convert_to_version(filename.split('-')[1]))
+        if version not in metadata or filename.endswith('-none-any.whl'):
+            metadata[version] = {'url': file['url'], 'hashes': hashes if isinstance(hashes, dict) else {}}
+    return metadata
+
+
+def _read_small(chunks: Iterable[Union[bytes, str]]) -> Tuple[Optional[dict], Iterator[Union[bytes, str]]]:
+    """
+    Decode the document if it ends within STREAMING_THRESHOLD bytes. Otherwise return None, and the chunks read so far
+    followed by the rest to stream.
+    """
+    chunks = iter(chunks)
+    head: List[Union[bytes, str]] = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size > STREAMING_THRESHOLD:
+            return None, itertools.chain(head, chunks)
+    try:
+        document = json.loads(b''.join(head) if head and isinstance(head[0], bytes) else ''.join(head))
+    except ValueError as e:
+        raise MetadataParseError(str(e)) from e
+    if not isinstance(document, dict):
+        raise MetadataParseError('Expected an object')
+    return document, iter(())
+
+
+def _get(document: dict, key: str, kind: type):
+    value = document.get(key)
+    if value is None:
+        return kind()
+    if not isinstance(value, kind):
+        raise MetadataParseError(f"Unexpected value for '{key}'")
+    return value
+
+
+def parse_core_metadata(content: bytes, hashes: Optional[Dict[str, str]] = None) -> dict:
+    """
+    Parse a core metadata file (a wheel's METADATA, as served by PEP 658) into the same shape parse_package_info
+    returns, after checking it against the hashes the index gave for it. Release names aren't part of core metadata.
+    """
+    for algorithm, expected in (hashes or {}).items():
+        if algorithm in hashlib.algorithms_guaranteed and hashlib.new(algorithm, content).hexdigest() != expected:
+            raise MetadataParseError(f"Core metadata doesn't match its {algorithm} hash")
+    message = HeaderParser().parsestr(content.decode('utf-8', errors='replace'))
+    # Match the JSON API, which has null rather than an empty list for projects without dependencies
+    return {'info': {'version': message['Version'], 'requires_dist': message.get_all('Requires-Dist')},
+            'releases': {}}
+
+
+class _JSONStream:
+    def __init__(self, chunks: Iterable[Union[bytes, str]]):
+        self._chunks: Iterator[Union[bytes, str]] = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        # Start of a value being read, which has to stay in the buffer until it's complete
+        self._mark: Optional[int] = None
+        self._eof = False
+
+    def object_keys(self) -> Iterator[str]:
+        """Yield the keys of the object at the current position. The caller must consume each key's value."""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            if self._peek() != '"':
+                self._error('Expected a key')
+            key = json.loads(self._match(_STRING))
+            self._expect(':')
+            yield key
+            separator = self._next()
+            if separator == '}':
+                return
+            if separator != ',':
+                self._error("Expected ',' or '}'")
+
+    def array_items(self) -> Iterator[None]:
+        """Yield once for each item of the array at the current position. The caller must consume each item."""
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield
+            separator = self._next()
+            if separator == ']':
+                return
+            if separator != ',':
+                self._error("Expected ',' or ']'")
+
+    def read_value(self):
+        self._peek()
+        self._mark = self._pos
+        try:
+            self.skip_value()
+            return json.loads(self._buffer[self._mark:self._pos])
+        finally:
+            self._mark = None
+
+    def skip_value(self):
+        char = self._peek()
+        if char == '"':
+            self._match(_STRING)
+        elif char in '{[':
+            self._skip_container()
+        else:
+            self._match(_SCALAR)
+
+    def _skip_container(self):
+        depth = 0
+        while True:
+            match = _SKIP.match(self._buffer, self._pos)
+            self._pos = match.end()
+            if self._pos >= len(self._buffer) or self._buffer[self._pos] == '"':
+                # Ran out of buffer, possibly in the middle of a string
+                if not self._fill():
+                    self._error('Unexpected end of document')
+                continue
+            char = self._buffer[self._pos]
+            self._pos += 1
+            if char in '{[':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _match(self, pattern) -> str:
+        while True:
+            match = pattern.match(self._buffer, self._pos)
+            # A match running up to the end of the buffer might continue in the next chunk
+            if match and (match.end() < len(self._buffer) or self._eof):
+                self._pos = match.end()
+                return match.group()
+            if not self._fill():
+                if match:
+                    continue
+                self._error('Unexpected end of document')
+
+    def _peek(self) -> str:
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                self._error('Unexpected end of document')
+
+    def _next(self) -> str:
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _expect(self, expected: str):
+        if self._next() != expected:
+            self._error(f"Expected '{expected}'")
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        keep = self._pos if self._mark is None else self._mark
+        self._buffer = self._buffer[keep:]
+        self._pos -= keep
+        if self._mark is not None:
+            self._mark = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                self._buffer += text
+                return True
+        self._buffer += self._decoder.decode(b'', final=True)
+        self._eof = True
+        return True
+
+    def _error(self, message: str):
+        raise MetadataParseError(f"{message} at '{self._buffer[self._pos:self._pos + 20]}'")
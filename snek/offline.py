@@ -0,0 +1,196 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, Optional, Iterable, List
+
+from packaging.version import Version
+
+from snek import utils
+from snek.repository import Repository, PackageNotFoundError
+from snek.resolver import Resolver
+from snek.requirement import Requirement
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotError(RuntimeError):
+    pass
+
+
+class LocalRepository(Repository):
+    """
+    A repository that never touches the network, serving metadata recorded on disk instead.
+
+    Each project is a JSON record of its release list and the metadata of some of its releases:
+    {"releases": ["1.0", ...], "metadata": {"1.0": {"version": "1.0", "requires_dist": [...]}}}. PyPI JSON API documents
+    are accepted too, in which case only the latest release's metadata is known.
+    """
+
+    def __init__(self):
+        super().__init__(url='', simple_url='')
+        self._projects: Dict[str, dict] = {}
+
+    def get_package_info(self, package_name: str, package_version: Optional[Version] = None) -> dict:
+        project = self._get_project(package_name)
+        metadata = project['metadata']
+        if package_version is None:
+            version = max(metadata, key=utils.convert_to_version, default=None)
+        else:
+            version = str(utils.convert_to_version(str(package_version)))
+        if version not in metadata:
+            raise PackageNotFoundError(package_name, package_version)
+        return {'info': metadata[version], 'releases': {release: [] for release in project['releases']}}
+
+    def get_package_releases(self, package_name: str) -> Dict[str, list]:
+        return {release: [] for release in self._get_project(package_name)['releases']}
+
+    def _get_project(self, package_name: str) -> dict:
+        name = package_name.lower()
+        project = self._projects.get(name)
+        if project is None:
+            data = self._read(name)
+            if data is None:
+                raise PackageNotFoundError(package_name)
+            project = self._projects.setdefault(name, self._parse_project(json.loads(data)))
+        return project
+
+    @staticmethod
+    def _parse_project(document: dict) -> dict:
+        if 'info' in document:
+            # A PyPI JSON API document
+            return {'releases': list(document['releases']),
+                    'metadata': {str(utils.convert_to_version(document['info']['version'])): document['info']}}
+        return {'releases': document['releases'],
+                'metadata': {str(utils.convert_to_version(version)): info
+                             for version, info in document['metadata'].items()}}
+
+    def _read(self, name: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+
+class DirectoryRepository(LocalRepository):
+    """Serves one JSON file per project from a directory, named after the (lowercased) project by pattern."""
+
+    def __init__(self, directory: str, pattern: str = '{name}.json'):
+        super().__init__()
+        self.directory = directory
+        self.pattern = pattern
+
+    def _read(self, name: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.directory, self.pattern.format(name=name)), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class SnapshotRepository(LocalRepository):
+    """
+    Serves projects from a single packed snapshot file. The file is memory-mapped and only the offset index at its end
+    is read up front, so opening a snapshot is cheap however large it is, and each project is decoded the first time
+    it's asked for.
+
+    Layout: a fixed-size header (magic, format version, index offset and length), the JSON record of every project
+    back to back, then a JSON index mapping each project name to the offset and length of its record.
+    """
+
+    MAGIC = b'SNEKSNAP'
+    FORMAT_VERSION = 1
+    HEADER = struct.Struct('<8sIQQ')
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < self.HEADER.size:
+            raise SnapshotError(f"{path} is not a snapshot")
+        magic, version, index_offset, index_length = self.HEADER.unpack_from(self._mmap)
+        if magic != self.MAGIC:
+            raise SnapshotError(f"{path} is not a snapshot")
+        if version != self.FORMAT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version: {version}")
+        self._index: Dict[str, List[int]] = json.loads(self._mmap[index_offset:index_offset + index_length])
+
+    def projects(self) -> List[str]:
+        return sorted(self._index)
+
+    def close(self):
+        self._mmap.close()
+
+    def _read(self, name: str) -> Optional[bytes]:
+        entry = self._index.get(name)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self._mmap[offset:offset + length]
+
+    @classmethod
+    def write(cls, path: str, projects: Dict[str, dict]):
+        """Pack project records (see LocalRepository) into a snapshot file."""
+        index = {}
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b'\0' * cls.HEADER.size)
+                for name in sorted(projects):
+                    data = json.dumps(projects[name], sort_keys=True, separators=(',', ':')).encode('utf-8')
+                    index[name.lower()] = [f.tell(), len(data)]
+                    f.write(data)
+                index_offset = f.tell()
+                index_data = json.dumps(index, sort_keys=True, separators=(',', ':')).encode('utf-8')
+                f.write(index_data)
+                f.seek(0)
+                f.write(cls.HEADER.pack(cls.MAGIC, cls.FORMAT_VERSION, index_offset, len(index_data)))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def snapshot(requirements: Iterable[Requirement], path: str, repository: Optional[Repository] = None) -> int:
+    """
+    Resolve requirements against a live repository and write everything the resolve needed (each project's release
+    list and the metadata of the versions that were picked) to a snapshot file. Returns the number of projects.
+    """
+    roots = Resolver(repository).resolve_many(set(requirements))
+    projects: Dict[str, dict] = {}
+    stack = list(roots)
+    seen = set()
+    while stack:
+        requirement = stack.pop()
+        name = requirement.name.lower()
+        version = str(requirement.best_candidate_version)
+        # Extras decide which dependencies a node has, so nodes that only differ by them are walked separately
+        key = (name, version, frozenset(requirement.extras))
+        if key in seen:
+            continue
+        seen.add(key)
+        project = projects.setdefault(name, {'releases': list(map(str, requirement.version_index.versions)),
+                                             'metadata': {}})
+        project['metadata'][version] = requirement.project_metadata['info']
+        stack.extend(requirement.children())
+    SnapshotRepository.write(path, projects)
+    return len(projects)
+
+
+def read_manifest(path: str) -> List[Requirement]:
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = (line.split('#', 1)[0].strip() for line in f)
+        return [Requirement(line) for line in lines if line]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Snapshot the metadata a manifest needs for offline resolves.')
+    parser.add_argument('manifest', help='requirements file, one requirement per line')
+    parser.add_argument('output', help='snapshot file to write')
+    parser.add_argument('--index-url', default=Repository.DEFAULT_URL, help='JSON API of the index to snapshot')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = snapshot(read_manifest(args.manifest), args.output, Repository(args.index_url))
+    log.info(f"Wrote {count} projects to {args.output}")
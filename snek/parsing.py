@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, FrozenSet, Iterator, NamedTuple, Optional
+
+import packaging
+from packaging import requirements
+from packaging.markers import Marker
+from packaging.specifiers import SpecifierSet
+
+from snek import markers
+from snek.markers import MarkerPredicate
+
+log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+class ParsedRequirement(NamedTuple):
+    # The canonical string form, which is what Requirements compare and hash by
+    key: str
+    name: str
+    url: Optional[str]
+    extras: FrozenSet[str]
+    specifier: SpecifierSet
+    marker: Optional[Marker]
+    predicate: Optional[MarkerPredicate]
+
+
+class RequirementCache:
+    """
+    Interned requirement strings. Each distinct string is parsed by packaging's grammar once, and requirements with the
+    same marker share one compiled MarkerPredicate.
+
+    The table can be saved as JSON and loaded back without running the grammar parser: specifiers are stored as
+    strings, which SpecifierSet reads with a regular expression, and markers as their parse trees.
+    """
+
+    def __init__(self):
+        self._parsed: Dict[str, ParsedRequirement] = {}
+        self._predicates: Dict[str, MarkerPredicate] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._parsed)
+
+    def parse(self, string: str) -> ParsedRequirement:
+        parsed = self._parsed.get(string)
+        if parsed is None:
+            requirement = requirements.Requirement(string)
+            with self._lock:
+                parsed = self._parsed.setdefault(string, self._intern(
+                    str(requirement), requirement.name, requirement.url, frozenset(requirement.extras),
+                    requirement.specifier, requirement.marker))
+                self._dirty = True
+        return parsed
+
+    def _intern(self, key: str, name: str, url: Optional[str], extras: FrozenSet[str], specifier: SpecifierSet,
+                marker: Optional[Marker]) -> ParsedRequirement:
+        predicate = None
+        if marker is not None:
+            marker_key = str(marker)
+            predicate = self._predicates.get(marker_key)
+            if predicate is None:
+                predicate = self._predicates[marker_key] = MarkerPredicate(marker)
+            marker = predicate.marker
+        return ParsedRequirement(key, name, url, extras, specifier, marker, predicate)
+
+    def load(self, path: str) -> int:
+        """Add the requirements saved in path, returning how many there were. A missing or unusable file is skipped."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError):
+            log.warning(f"Discarding unreadable requirement cache {path}")
+            return 0
+        # Marker parse trees are packaging's internal representation, so they're only reused with the same version
+        if data.get('format') != FORMAT_VERSION or data.get('packaging') != packaging.__version__:
+            return 0
+        try:
+            loaded = {string: self._intern(entry['key'], entry['name'], entry['url'], frozenset(entry['extras']),
+                                           SpecifierSet(entry['specifier']),
+                                           markers.marker_from_json(entry['marker']) if entry['marker'] else None)
+                      for string, entry in data['requirements'].items()}
+        except (KeyError, TypeError, ValueError) as e:
+            log.warning(f"Discarding invalid requirement cache {path}: {e!r}")
+            return 0
+        with self._lock:
+            for string, parsed in loaded.items():
+                self._parsed.setdefault(string, parsed)
+        return len(loaded)
+
+    def save(self, path: str):
+        """Write the table to path if anything has been parsed since it was last saved."""
+        with self._lock:
+            if not self._dirty:
+                return
+            parsed = dict(self._parsed)
+            self._dirty = False
+        data = {'format': FORMAT_VERSION, 'packaging': packaging.__version__, 'requirements': {
+            string: {'key': entry.key, 'name': entry.name, 'url': entry.url, 'extras': sorted(entry.extras),
+                     'specifier': str(entry.specifier),
+                     'marker': markers.marker_to_json(entry.marker) if entry.marker is not None else None}
+            for string, entry in parsed.items()}}
+        # Several processes can share a cache directory, so write a temporary file and rename it into place
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+# Shared by every resolve in the process, like markers.compile_marker's cache
+REQUIREMENTS = RequirementCache()
+_loaded_paths = set()
+
+
+def parse(string: str) -> ParsedRequirement:
+    return REQUIREMENTS.parse(string)
+
+
+@contextmanager
+def persisted(path: Optional[str]) -> Iterator[RequirementCache]:
+    """Load the requirements saved at path the first time it's seen, and save any new ones afterwards."""
+    if path is None:
+        yield REQUIREMENTS
+        return
+    if path not in _loaded_paths:
+        _loaded_paths.add(path)
+        count = REQUIREMENTS.load(path)
+        log.debug(f"Loaded {count} parsed requirement(s) from {path}")
+    try:
+        yield REQUIREMENTS
+    finally:
+        REQUIREMENTS.save(path)
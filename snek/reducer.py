@@ -1,12 +1,16 @@
 import functools
+import itertools
 import logging
 from collections import defaultdict
-from typing import Dict, Set, Union
+from typing import Dict, Set, Union, List, Tuple, FrozenSet, Iterable, Optional
 
 from packaging.specifiers import SpecifierSet
 from packaging.version import Version, LegacyVersion
 
+from snek import tracing
+from snek.graph import DependencyGraph, NO_PARENT
 from snek.requirement import Requirement
+from snek.versions import VersionIndex
 
 log = logging.getLogger(__name__)
 
@@ -15,60 +19,303 @@ class ReductionError(RuntimeError):
     pass
 
 
+class IncrementalReducer:
+    """
+    Pins versions for the requirements installed in the current environment as nodes are added to it, rather than
+    from a finished graph. Like Reducer.reduce_matrix, a node is only installed if its marker and those of all the
+    nodes above it match. Each package keeps the intersection of its specifiers, the union of its compatible versions
+    and the ancestry of each of its requirements, so adding a node is a constant amount of work and reduce() only
+    repicks the packages that gained requirements since it was last called.
+
+    Nodes are read from the resolver's DependencyGraph directly. Each add_tree only looks at the nodes created in the
+    graph since the last one, plus the ones it skipped then for not being in the tree yet, so adding a tree again after
+    it has grown only costs the new nodes.
+    """
+
+    def __init__(self):
+        # The ancestry of every node added so far, as requirement strings from the root down, by graph and node id
+        self._paths: Dict[DependencyGraph, Dict[int, Tuple[str, ...]]] = {}
+        # How many nodes of each graph add_tree has looked at, and which of those weren't in the tree it was adding
+        self._walked: Dict[DependencyGraph, int] = {}
+        self._skipped: Dict[DependencyGraph, Set[int]] = {}
+        # Whether each node added so far is installed, by graph and node id
+        self._installed: Dict[DependencyGraph, Dict[int, bool]] = {}
+        # The requirements of each package, each with the ancestry it was first seen with
+        self._groups: Dict[str, Dict[Requirement, Tuple[str, ...]]] = {}
+        self._specifiers: Dict[str, SpecifierSet] = {}
+        self._versions: Dict[str, Set[Union[Version, LegacyVersion]]] = {}
+        self._indexes: Dict[str, VersionIndex] = {}
+        self._pins: Dict[str, Union[Version, LegacyVersion]] = {}
+        self._dirty: Set[str] = set()
+
+    def add(self, dependencies: Dict[Requirement, Dict]):
+        """Add every node of a resolved graph, like the ones Resolver.resolve_many returns."""
+        for root in dependencies:
+            self.add_tree(root)
+
+    def add_tree(self, root: Requirement):
+        graph = root.graph
+        paths = self._paths.setdefault(graph, {})
+        installed = self._installed.setdefault(graph, {})
+        skipped = self._skipped.setdefault(graph, set())
+        new = range(self._walked.get(graph, 0), len(graph))
+        candidates = sorted(skipped.union(new)) if skipped else new
+        self._walked[graph] = len(graph)
+        skipped = self._skipped[graph] = set()
+        inside = {root.node_id: True}
+        # Parents are created before their children, so in id order a node's parent has usually just been handled
+        for node_id in candidates:
+            if node_id in paths:
+                continue
+            node = graph.node(node_id)
+            if node_id == root.node_id:
+                path = self._path(root)
+                is_installed = self._is_installed(root)
+            else:
+                # Nodes that were never attached, like requirements for extras nobody asked for, are rejected cheaply
+                if not graph.is_attached(node_id):
+                    skipped.add(node_id)
+                    continue
+                parent = graph.parent(node_id)
+                is_inside = inside.get(parent)
+                if is_inside is None:
+                    is_inside = self._inside(graph, parent, inside)
+                inside[node_id] = is_inside
+                if not is_inside:
+                    skipped.add(node_id)
+                    continue
+                parent_path = paths.get(parent)
+                path = parent_path + (str(graph.node(parent)),) if parent_path is not None else self._path(node)
+                parent_installed = installed.get(parent)
+                if parent_installed is None:
+                    is_installed = self._is_installed(node)
+                else:
+                    is_installed = installed[node_id] = parent_installed and Reducer.is_compatible(node)
+            paths[node_id] = path
+            if is_installed:
+                self._add(node, path)
+
+    def add_requirement(self, requirement: Requirement):
+        """Add a single node, e.g. from a RESOLVED event of Resolver.stream."""
+        paths = self._paths.setdefault(requirement.graph, {})
+        if requirement.node_id not in paths:
+            paths[requirement.node_id] = path = self._path(requirement)
+            if self._is_installed(requirement):
+                self._add(requirement, path)
+
+    @staticmethod
+    def _inside(graph: DependencyGraph, node_id: int, inside: Dict[int, bool]) -> bool:
+        """Whether a node is in the attached subtree of the root inside was seeded with, memoizing along the way."""
+        chain = []
+        while node_id not in inside:
+            chain.append(node_id)
+            if not graph.is_attached(node_id):
+                inside[node_id] = False
+                break
+            node_id = graph.parent(node_id)
+        result = inside[node_id]
+        for walked in chain:
+            inside[walked] = result
+        return result
+
+    def _path(self, requirement: Requirement) -> Tuple[str, ...]:
+        # Walk up until we reach a node whose path we already know, or the root
+        paths = self._paths.get(requirement.graph, {})
+        known = paths.get(requirement.node_id)
+        if known is not None:
+            return known
+        names: List[str] = []
+        node = requirement.parent()
+        while node is not None:
+            known = paths.get(node.node_id)
+            if known is not None:
+                return known + (str(node),) + tuple(reversed(names))
+            names.append(str(node))
+            node = node.parent()
+        return tuple(reversed(names))
+
+    def _is_installed(self, requirement: Requirement) -> bool:
+        # Walk up until we reach a node we've already decided on, usually the parent, then decide from the top down
+        graph = requirement.graph
+        installed = self._installed.setdefault(graph, {})
+        chain = []
+        node_id = requirement.node_id
+        while node_id != NO_PARENT and node_id not in installed:
+            chain.append(node_id)
+            node_id = graph.parent(node_id)
+        result = installed.get(node_id, True)
+        for node_id in reversed(chain):
+            result = result and Reducer.is_compatible(graph.node(node_id))
+            installed[node_id] = result
+        return result
+
+    def _add(self, requirement: Requirement, path: Tuple[str, ...]):
+        name = requirement.name
+        group = self._groups.setdefault(name, {})
+        if requirement in group:
+            # An equal requirement has the same specifier and versions, only its ancestry could be different
+            return
+        group[requirement] = path
+        specifier = self._specifiers.get(name)
+        self._specifiers[name] = requirement.specifier if specifier is None else specifier & requirement.specifier
+        self._versions.setdefault(name, set()).update(requirement.compatible_versions)
+        # Reuse the repository's index (and its memoized results) when the requirements were populated from one
+        if name not in self._indexes and requirement.version_index is not None:
+            self._indexes[name] = requirement.version_index
+        self._dirty.add(name)
+
+    def reduce(self) -> Dict[str, Union[Version, LegacyVersion]]:
+        for name in sorted(self._dirty):
+            version = Reducer.select(name, self._specifiers[name], self._versions[name], self._indexes.get(name))
+            if version is None:
+                raise Reducer.conflict(name, [path + (str(requirement),)
+                                              for requirement, path in self._groups[name].items()])
+            self._pins[name] = version
+            self._dirty.discard(name)
+        return dict(self._pins)
+
+    def stable_pin(self, name: str) -> Optional[Union[Version, LegacyVersion]]:
+        """
+        The pin of a package if adding more requirements can't change it, short of making it a conflict: when only one
+        release, prereleases included, matches all of its specifiers so far. Otherwise None.
+        """
+        specifier = self._specifiers.get(name)
+        if specifier is None:
+            return None
+        index = self._indexes.get(name) or VersionIndex(self._versions[name])
+        low, high = index.bounds(specifier)
+        matches = (version for version in index.versions[low:high] if specifier.contains(version, prereleases=True))
+        if len(list(itertools.islice(matches, 2))) != 1:
+            return None
+        return Reducer.select(name, specifier, self._versions[name], index)
+
+    def ancestry(self, name: str) -> List[Tuple[str, ...]]:
+        """Every distinct requirement for a package, each with the chain of requirements that led to it."""
+        return [path + (str(requirement),) for requirement, path in self._groups.get(name, {}).items()]
+
+
 class Reducer:
     @staticmethod
     def reduce(dependencies: Dict[Requirement, Dict]):
-        # Flatten the tree and pick only the requirements compatible with the current environment
-        flattened_dependencies: Set[Requirement] = set(filter(Reducer.is_compatible, Reducer.flatten(dependencies)))
-        # Group all versions of requirements by name
-        # TODO: Tried to use itertools.groupby here, but it ended up losing a bunch of the requirements somehow :(
-        grouped_dependencies = defaultdict(lambda: [])
-        [grouped_dependencies[dep.name].append(dep) for dep in flattened_dependencies]
-
-        # Combine the version specifiers for all the groups, then take the highest matching version
-        versions: dict = {}
-        for name, group in grouped_dependencies.items():
-            group = list(group)
-            specifier = functools.reduce(SpecifierSet.__and__, map(lambda r: r.specifier, group))
-            possible_versions: Set[Union[Version, LegacyVersion]] = set()
-            [possible_versions.add(version) for requirement in group for version in requirement.compatible_versions]
-            log.debug(f"{name}: specifier '{specifier}', possible versions: {possible_versions}")
-            filtered_versions = list(specifier.filter(possible_versions))
-            if filtered_versions:
-                versions[name] = max(filtered_versions)
-            else:
-                msg = f"Couldn't find a version for {name}. A dependency map is shown below:"
-                for requirement in group:
-                    chain = list(reversed(list(map(str, requirement.ancestors()))))
-                    if len(chain) > 0:
-                        msg += f"\n  {' -> '.join(chain)} -> {requirement}"
-                    else:
-                        msg += f"\n  {requirement}"
-                raise ReductionError(msg)
-        return versions
+        with tracing.current_tracer().span('reduce'):
+            reducer = IncrementalReducer()
+            reducer.add(dependencies)
+            return reducer.reduce()
+
+    @staticmethod
+    def reduce_matrix(dependencies: Dict[Requirement, Dict],
+                      environments: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, Union[Version, LegacyVersion]]]:
+        """
+        Pin versions for several marker environments at once from a single resolved graph, which has every dependency
+        whatever its marker. Returns the pins of each environment by name.
+
+        The tree is walked once, working out for each node the set of environments it's installed in (as a bitmask):
+        the environments its parent is installed in whose markers it matches. Groups of requirements that end up the
+        same in several environments are only reduced once.
+        """
+        names = list(environments)
+        with tracing.current_tracer().span('reduce', environments=len(names)):
+            masks: Dict[Requirement, int] = {}
+            Reducer._mask_tree(dependencies, (1 << len(names)) - 1, [environments[name] for name in names], masks)
+
+            picks: Dict[Tuple[str, FrozenSet[Requirement]], Union[Version, LegacyVersion]] = {}
+            result: Dict[str, Dict[str, Union[Version, LegacyVersion]]] = {}
+            for bit, environment_name in enumerate(names):
+                grouped_dependencies = defaultdict(list)
+                for requirement, mask in masks.items():
+                    if mask >> bit & 1:
+                        grouped_dependencies[requirement.name].append(requirement)
+                versions = result[environment_name] = {}
+                for name, group in grouped_dependencies.items():
+                    key = (name, frozenset(group))
+                    if key not in picks:
+                        try:
+                            picks[key] = Reducer._pick(name, group)
+                        except ReductionError as e:
+                            raise ReductionError(f"[{environment_name}] {e}") from e
+                    versions[name] = picks[key]
+            return result
+
+    @staticmethod
+    def _mask_tree(dependencies: Dict[Requirement, Dict], root_mask: int, environments: List[Dict[str, str]],
+                   masks: Dict[Requirement, int]):
+        for root in dependencies:
+            graph = root.graph
+            # Parents come before their children, and a node's children are never installed where it isn't
+            node_masks = {NO_PARENT: root_mask}
+            for node_id in graph.subtree(root.node_id):
+                parent_id = graph.parent(node_id) if node_id != root.node_id else NO_PARENT
+                mask = node_masks[parent_id]
+                if mask:
+                    requirement = graph.node(node_id)
+                    mask &= Reducer.environment_mask(requirement, environments)
+                    if mask:
+                        masks[requirement] = masks.get(requirement, 0) | mask
+                node_masks[node_id] = mask
+
+    @staticmethod
+    def environment_mask(requirement: Requirement, environments: List[Dict[str, str]]) -> int:
+        """
+        Bitmask of the environments requirement's marker matches, taking the extras its parent asked for into account.
+        """
+        if requirement.marker is None:
+            return (1 << len(environments)) - 1
+        predicate = requirement.predicate
+        extras = Reducer._extras(requirement)
+        mask = 0
+        for bit, environment in enumerate(environments):
+            if any(predicate({**environment, 'extra': extra}) for extra in extras):
+                mask |= 1 << bit
+        return mask
+
+    @staticmethod
+    def _pick(name: str, group: List[Requirement]) -> Union[Version, LegacyVersion]:
+        specifier = functools.reduce(SpecifierSet.__and__, map(lambda r: r.specifier, group))
+        possible_versions = {version for requirement in group for version in requirement.compatible_versions}
+        index = next((r.version_index for r in group if r.version_index is not None), None)
+        version = Reducer.select(name, specifier, possible_versions, index)
+        if version is None:
+            raise Reducer.conflict(name, [tuple(map(str, reversed(requirement.ancestors()))) + (str(requirement),)
+                                          for requirement in group])
+        return version
+
+    @staticmethod
+    def select(name: str, specifier: SpecifierSet, possible_versions: Set[Union[Version, LegacyVersion]],
+               index: Optional[VersionIndex]) -> Optional[Union[Version, LegacyVersion]]:
+        """The highest of possible_versions matching specifier, or None."""
+        log.debug(f"{name}: specifier '{specifier}', possible versions: {possible_versions}")
+        if index is None:
+            index = VersionIndex(possible_versions)
+        filtered_versions = [version for version in index.filter(specifier) if version in possible_versions]
+        return filtered_versions[-1] if filtered_versions else None
+
+    @staticmethod
+    def conflict(name: str, chains: Iterable[Tuple[str, ...]]) -> ReductionError:
+        msg = f"Couldn't find a version for {name}. A dependency map is shown below:"
+        for chain in chains:
+            msg += f"\n  {' -> '.join(chain)}"
+        return ReductionError(msg)
 
     @staticmethod
     def flatten(dependencies: Dict[Requirement, Dict]) -> Set[Requirement]:
         result: Set[Requirement] = set()
-        for key in dependencies.keys():
-            result.add(key)
-        for value in dependencies.values():
-            [result.add(dep) for dep in Reducer.flatten(value)]
+        for root in dependencies:
+            graph = root.graph
+            result.update(map(graph.node, graph.subtree(root.node_id)))
         return result
 
     @staticmethod
     def is_compatible(requirement: Requirement) -> bool:
         if requirement.marker is None:
             return True
+        predicate = requirement.predicate
+        return any(predicate({'extra': extra}) for extra in Reducer._extras(requirement))
 
-        if requirement.parent():
-            extras = requirement.parent().extras
-            for extra in extras:
-                if requirement.marker.evaluate({'extra': extra}):
-                    return True
-            return False
-        else:
-            return requirement.marker.evaluate({'extra': ''})
+    @staticmethod
+    def _extras(requirement: Requirement) -> Iterable[str]:
+        # Markers are evaluated once per extra the parent asked for, or with no extra if it didn't ask for any
+        parent = requirement.parent()
+        return (parent.extras if parent else None) or ('',)
 
 
 if __name__ == '__main__':
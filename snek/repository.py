@@ -1,12 +1,21 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures.thread import ThreadPoolExecutor
 from functools import reduce
-from typing import Optional, Set, Dict, List, Union
+from typing import Optional, Set, Dict, List, Union, Iterable, Callable, NamedTuple, Tuple
 
 import requests
 from packaging.specifiers import SpecifierSet
 from packaging.version import Version, LegacyVersion
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from snek import utils
+from snek import utils, metadata, tracing
+from snek.cache import Cache, CacheEntry, MemoryCache, CacheKey
 from snek.requirement import Requirement
+from snek.versions import VersionIndex
 
 
 class PackageNotFoundError(RuntimeError):
@@ -17,24 +26,218 @@ class InvalidRequirementError(RuntimeError):
     pass
 
 
+class _IndexedReleases(NamedTuple):
+    index: VersionIndex
+    # The release list the index was built from, and when that was last checked against the cache or the index
+    releases: Tuple[str, ...]
+    checked_at: float
+
+
 class Repository:
     DEFAULT_URL = 'https://pypi.org/pypi'
+    DEFAULT_SIMPLE_URL = 'https://pypi.org/simple'
+    SIMPLE_JSON_TYPE = 'application/vnd.pypi.simple.v1+json'
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    CHUNK_SIZE = 64 * 1024
 
-    def __init__(self, url=DEFAULT_URL):
+    def __init__(self, url=DEFAULT_URL, cache: Optional[Cache] = None, pool_size: int = 16,
+                 max_concurrent_requests: int = 16, max_retries: int = 5, backoff_factor: float = 0.5,
+                 request_timeout: float = 30, simple_url: Optional[str] = None):
         self.url = url
+        # The Simple API (PEP 691) is used for release lists and PEP 658 metadata when available. It defaults to
+        # PyPI's for the default index, pass an empty string to always use the JSON API instead.
+        if simple_url is None and url == self.DEFAULT_URL:
+            simple_url = self.DEFAULT_SIMPLE_URL
+        self.simple_url = simple_url or None
+        # Turned off the first time the index answers with something other than PEP 691 JSON
+        self._simple_api_available = True
+        self.request_timeout = request_timeout
+        self.cache = cache if cache is not None else MemoryCache()
+        # One keep-alive session per repository, so connections are reused across the whole resolve
+        self.session = requests.Session()
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=self.RETRY_STATUSES,
+                      raise_on_status=False, respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Caps the number of requests in flight no matter how many resolver threads are waiting on metadata
+        self._request_slots = threading.BoundedSemaphore(max_concurrent_requests)
+        self._waiting = 0
+        self._waiting_lock = threading.Lock()
+        self._in_flight = utils.SingleFlight()
+        self._version_indexes: Dict[str, _IndexedReleases] = {}
 
     def get_package_info(self, package_name: str, package_version: Optional[Version] = None) -> dict:
+        # Callers asking for the same document at the same time share a single request
+        key = ('info', package_name.lower(), str(package_version) if package_version else None)
+        return self._in_flight.do(key, self._fetch_package_info, package_name, package_version)
+
+    def get_project_index(self, package_name: str) -> Optional[dict]:
+        """Get a project's versions and PEP 658 metadata files from the Simple API, or None if it isn't available."""
+        if not self.simple_url or not self._simple_api_available:
+            return None
+        return self._in_flight.do(('index', package_name.lower()), self._fetch_project_index, package_name)
+
+    def get_package_releases(self, package_name: str) -> Dict[str, list]:
+        project_index = self.get_project_index(package_name)
+        if project_index is not None and project_index['versions'] is not None:
+            return {version: [] for version in project_index['versions']}
+        return self.get_package_info(package_name)['releases']
+
+    def cached_requires_dist(self, package_name: str) -> Optional[List[str]]:
+        """
+        The requirements of the newest release of a project we have cached metadata for, stale or not, without touching
+        the network. None if there isn't any.
+        """
+        name = package_name.lower()
+        entry = self.cache.get((self.url, name, None))
+        if entry is None:
+            indexed = self._version_indexes.get(name)
+            index = indexed.index if indexed is not None else None
+            if index is None and self.simple_url:
+                project_index = self.cache.get((self.simple_url, name, None))
+                if project_index is not None and project_index.document['versions']:
+                    index = VersionIndex(project_index.document['versions'])
+            if index is None or not index.versions:
+                return None
+            latest = str(index.versions[-1])
+            entry = self.cache.get((self.simple_url, name, latest)) if self.simple_url else None
+            if entry is None:
+                entry = self.cache.get((self.url, name, latest))
+            if entry is None:
+                return None
+        return entry.document['info']['requires_dist'] or []
+
+    def _fetch_package_info(self, package_name: str, package_version: Optional[Version] = None) -> dict:
+        name = package_name.lower()
         if package_version:
-            response = requests.get(f"{self.url}/{package_name.lower()}/{package_version}/json")
-        else:
-            response = requests.get(f"{self.url}/{package_name.lower()}/json")
-        if response:
-            return response.json()
+            # A release's core metadata file is a few kilobytes, its JSON document can be much larger
+            document = self._fetch_core_metadata(name, package_version)
+            if document is not None:
+                return document
+            # The project document describes the latest release too, so if we already have it that's enough
+            entry = self.cache.get((self.url, name, None))
+            if entry and utils.convert_to_version(str(entry.document['info']['version'])) == \
+                    utils.convert_to_version(str(package_version)):
+                return entry.document
+            url = f"{self.url}/{name}/{package_version}/json"
         else:
+            url = f"{self.url}/{name}/json"
+
+        key = (self.url, name, str(package_version) if package_version else None)
+        # Only keep the handful of fields we use, the full document can be many megabytes
+        document = self._fetch(key, url, lambda response: metadata.parse_package_info(
+            response.iter_content(self.CHUNK_SIZE)), pinned=package_version is not None)
+        if document is None:
             raise PackageNotFoundError(package_name, package_version)
+        return document
 
-    def get_package_releases(self, package_name: str) -> Dict[str, list]:
-        return self.get_package_info(package_name)['releases']
+    def _fetch_project_index(self, package_name: str) -> Optional[dict]:
+        name = package_name.lower()
+        return self._fetch((self.simple_url, name, None), f"{self.simple_url}/{name}/", self._parse_project_index,
+                           accept=self.SIMPLE_JSON_TYPE)
+
+    def _parse_project_index(self, response: requests.Response) -> Optional[dict]:
+        # Indexes that don't speak PEP 691 answer with HTML instead, there's no point asking them again
+        if not response.headers.get('Content-Type', '').startswith(self.SIMPLE_JSON_TYPE):
+            self._simple_api_available = False
+            return None
+        return metadata.parse_project_index(response.iter_content(self.CHUNK_SIZE))
+
+    def _fetch_core_metadata(self, name: str, version: Version) -> Optional[dict]:
+        project_index = self.get_project_index(name)
+        if project_index is None:
+            return None
+        core_metadata = project_index['metadata'].get(str(version))
+        if core_metadata is None:
+            return None
+        return self._fetch((self.simple_url, name, str(version)), f"{core_metadata['url']}.metadata",
+                           lambda response: metadata.parse_core_metadata(response.content, core_metadata['hashes']),
+                           pinned=True)
+
+    def _fetch(self, key: CacheKey, url: str, parse: Callable[[requests.Response], Optional[dict]],
+               accept: Optional[str] = None, pinned: bool = False) -> Optional[dict]:
+        """Get a document from the cache or the network, returning None if the index doesn't have it."""
+        tracer = tracing.current_tracer()
+        entry = self.cache.get(key)
+        # Version-pinned documents never change, so they don't need to be revalidated
+        if entry and (pinned or self.cache.is_fresh(entry)):
+            tracer.count('cache.hits')
+            return entry.document
+        tracer.count('cache.stale' if entry else 'cache.misses')
+
+        headers = {}
+        if accept:
+            headers['Accept'] = accept
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+        self._acquire_request_slot()
+        try:
+            with tracer.span('fetch', url=url):
+                # Never wait on the network past the current deadline. Timed out requests are retried like failed ones.
+                response = self.session.get(url, headers=headers, timeout=utils.remaining_time(self.request_timeout),
+                                            stream=True)
+                tracer.count('http.requests')
+                try:
+                    if entry and response.status_code == 304:
+                        tracer.count('cache.revalidated')
+                        self.cache.set(key, entry._replace(fetched_at=time.time()))
+                        return entry.document
+                    if not response:
+                        return None
+                    received = self._count_received(response) if tracer.enabled else None
+                    # Parsing streams the body, so this includes reading whatever hasn't arrived yet
+                    with tracer.span('parse', url=url):
+                        try:
+                            document = parse(response)
+                        finally:
+                            if received is not None:
+                                tracer.count('http.bytes', sum(received))
+                finally:
+                    response.close()
+        finally:
+            self._request_slots.release()
+        if document is not None:
+            self.cache.set(key, CacheEntry(document, response.headers.get('ETag'),
+                                           response.headers.get('Last-Modified'), time.time()))
+        return document
+
+    @staticmethod
+    def _count_received(response: requests.Response) -> List[int]:
+        """
+        Record the size of every chunk of the body as it's read. Content-Length is missing from chunked responses, and
+        is the compressed size of compressed ones. Response.content reads through iter_content too.
+        """
+        received: List[int] = []
+        iter_content = response.iter_content
+
+        def counted(*args, **kwargs):
+            for chunk in iter_content(*args, **kwargs):
+                received.append(len(chunk))
+                yield chunk
+
+        response.iter_content = counted
+        return received
+
+    def _acquire_request_slot(self):
+        if self._request_slots.acquire(blocking=False):
+            return
+        tracer = tracing.current_tracer()
+        with self._waiting_lock:
+            self._waiting += 1
+            tracer.gauge('requests.queued', self._waiting)
+        try:
+            with tracer.span('queue'):
+                # Keep checking for cancellation while queued, work that's been abandoned shouldn't take up a slot
+                while not self._request_slots.acquire(timeout=utils.remaining_time(0.1)):
+                    pass
+        finally:
+            with self._waiting_lock:
+                self._waiting -= 1
+                tracer.gauge('requests.queued', self._waiting)
 
     # Assumption: first requirement should have metadata or else I'll go and get it myself
     def get_compatible_versions(self, *requirements: Requirement) -> List[Union[LegacyVersion, Version]]:
@@ -45,14 +248,98 @@ class Repository:
             raise InvalidRequirementError(f"Requirements must have the same package name. Names provided: {names}")
 
         name = names.pop()
-        if requirements[0].project_metadata:
-            all_versions = map(utils.convert_to_version, requirements[0].project_metadata['releases'].keys())
-        else:
-            all_versions = map(utils.convert_to_version, self.get_package_releases(name).keys())
+        releases = requirements[0].project_metadata.get('releases')
+        index = self.get_version_index(name, releases.keys() if releases else None)
         final_specifier = reduce(SpecifierSet.__and__, map(lambda r: r.specifier, requirements))
-        return list(final_specifier.filter(all_versions))
+        return index.filter(final_specifier)
+
+    def get_version_index(self, package_name: str, releases: Optional[Iterable[str]] = None) -> VersionIndex:
+        """
+        Get the parsed, sorted releases of a project. Once the cache's TTL has passed since the release list was last
+        checked, it's fetched again (revalidating the cached copy), and the index is rebuilt if the list has changed.
+        """
+        name = package_name.lower()
+        checked_at = time.time()
+        indexed = self._version_indexes.get(name)
+        if indexed is not None and checked_at - indexed.checked_at < self.cache.ttl:
+            return indexed.index
+        if releases is None:
+            releases = self.get_package_releases(name).keys()
+        releases = tuple(releases)
+        # Comparing the strings is much cheaper than parsing them all again
+        index = indexed.index if indexed is not None and indexed.releases == releases else VersionIndex(releases)
+        self._version_indexes[name] = _IndexedReleases(index, releases, checked_at)
+        return index
 
     def populate_requirement(self, requirement: Requirement):
-        requirement.project_metadata = self.get_package_info(requirement.name)
-        requirement.compatible_versions = self.get_compatible_versions(requirement)
+        # Pick the version from the release list first, so the only metadata fetched is that version's
+        requirement.version_index = self.get_version_index(requirement.name)
+        with tracing.current_tracer().span('filter', requirement=requirement):
+            requirement.compatible_versions = requirement.version_index.filter(requirement.specifier)
         requirement.best_candidate_version = max(requirement.compatible_versions)
+        requirement.project_metadata = self.get_package_info(requirement.name, requirement.best_candidate_version)
+
+
+class AsyncRepository:
+    """
+    Asyncio front end for a Repository. Coroutines wait on metadata without holding a thread; the blocking HTTP calls
+    (including cache revalidation and retries) run on a small fixed pool shared by the whole event loop.
+    """
+
+    def __init__(self, repository: Optional[Repository] = None, max_concurrent_requests: int = 64,
+                 max_workers: int = 8):
+        if repository is None:
+            repository = Repository(pool_size=max_workers, max_concurrent_requests=max_workers)
+        self.repository = repository
+        self.max_concurrent_requests = max_concurrent_requests
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='snek-fetch')
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight: Dict[tuple, asyncio.Task] = {}
+
+    async def get_package_info(self, package_name: str, package_version: Optional[Version] = None) -> dict:
+        # Coroutines asking for the same document share one task instead of each tying up an executor thread
+        key = (package_name.lower(), str(package_version) if package_version else None)
+        while True:
+            task = self._in_flight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._fetch_package_info(package_name, package_version))
+                self._in_flight[key] = task
+                task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            try:
+                return await asyncio.shield(task)
+            except utils.OperationCancelled:
+                # The task may have been started by another resolve that was cancelled since, which is no reason for
+                # this one to fail, unless it's been cancelled too
+                utils.check_cancelled()
+
+    async def _fetch_package_info(self, package_name: str, package_version: Optional[Version] = None) -> dict:
+        return await self._run(self.repository.get_package_info, package_name, package_version)
+
+    async def get_package_releases(self, package_name: str) -> Dict[str, list]:
+        return await self._run(self.repository.get_package_releases, package_name)
+
+    async def populate_requirement(self, requirement: Requirement):
+        # The release list is shared by every requirement on the project, the sync repository coalesces fetching it
+        requirement.version_index = await self._run(self.repository.get_version_index, requirement.name)
+        with tracing.current_tracer().span('filter', requirement=requirement):
+            requirement.compatible_versions = requirement.version_index.filter(requirement.specifier)
+        requirement.best_candidate_version = max(requirement.compatible_versions)
+        requirement.project_metadata = await self.get_package_info(requirement.name,
+                                                                   requirement.best_candidate_version)
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        async with self._get_semaphore(loop):
+            # Executor threads don't inherit the caller's context, so pass it along for the tracer and cancel scope
+            return await loop.run_in_executor(self._executor, contextvars.copy_context().run, function, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _get_semaphore(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        # Semaphores are bound to the loop they're first used on, so make a new one if we're reused with another loop
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+            self._loop = loop
+        return self._semaphore
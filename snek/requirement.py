@@ -1,67 +1,161 @@
 # For PEP 563 https://www.python.org/dev/peps/pep-0563/, remove for Python 4.0+
 from __future__ import annotations
 
+import functools
 import threading
 from typing import Set, Union, List, Dict, Optional
 
 from packaging import requirements
 from packaging.version import Version, LegacyVersion
 
+from snek import markers, parsing
+from snek.graph import DependencyGraph, NO_PARENT
+from snek.markers import MarkerPredicate
+from snek.versions import VersionIndex
+
 
 class Requirement(requirements.Requirement):
+    """
+    A parsed requirement and a view over its node in a DependencyGraph. Requirements created with a parent share the
+    parent's graph; everything else starts a graph of its own.
+    """
+
     def __init__(self, *args, parent: Optional[Requirement] = None, **kwargs):
         super().__init__(*args, **kwargs)
+        self._init_node(parent)
+
+    @staticmethod
+    def parse(requirement: str, parent: Optional[Requirement] = None) -> Requirement:
+        """Same as Requirement(requirement, parent=parent), but each distinct string is only ever parsed once."""
+        parsed = parsing.parse(requirement)
+        instance = Requirement.__new__(Requirement)
+        instance.name = parsed.name
+        instance.url = parsed.url
+        instance.extras = set(parsed.extras)
+        instance.specifier = parsed.specifier
+        instance.marker = parsed.marker
+        instance.predicate = parsed.predicate
+        instance._init_node(parent, parsed.key)
+        return instance
 
-        self.lock = threading.RLock()
-        self.project_metadata = dict()
-        self.compatible_versions: List[Union[LegacyVersion, Version]] = []
-        self.best_candidate_version: Optional[Union[LegacyVersion, Version]] = None
-        self._parent: Optional[Requirement] = parent
-        self._children: Set[Requirement] = set()
+    def _init_node(self, parent: Optional[Requirement], key: Optional[str] = None):
+        # Requirements are never modified after parsing, so the string form and hash only need computing once
+        self._key = key if key is not None else super().__str__()
+        self._hash = hash(self._key)
+        if parent is None:
+            graph = DependencyGraph()
+            self._bind(graph, graph.add_node(self, self._key))
+        else:
+            self._bind(parent._graph, parent._graph.add_node(self, self._key, parent._node_id))
 
-    def __eq__(self, other: Requirement) -> bool:
-        return self.__hash__() == other.__hash__()
+    def _bind(self, graph: DependencyGraph, node_id: int):
+        self._graph = graph
+        self._node_id = node_id
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Requirement):
+            return NotImplemented
+        return self._hash == other._hash and self._key == other._key
 
     def __hash__(self) -> int:
-        return str(self).__hash__()
+        return self._hash
+
+    def __str__(self) -> str:
+        return self._key
 
     def __repr__(self) -> str:
         return f"<Requirement '{self}'>"
 
+    @property
+    def graph(self) -> DependencyGraph:
+        return self._graph
+
+    @functools.cached_property
+    def predicate(self) -> Optional[MarkerPredicate]:
+        return markers.compile_marker(str(self.marker)) if self.marker is not None else None
+
+    @property
+    def node_id(self) -> int:
+        return self._node_id
+
+    @property
+    def lock(self) -> threading.RLock:
+        return self._graph.lock
+
+    @property
+    def project_metadata(self) -> dict:
+        return self._graph.get_metadata(self._node_id)
+
+    @project_metadata.setter
+    def project_metadata(self, metadata: dict):
+        self._graph.set_metadata(self._node_id, metadata)
+
+    @property
+    def compatible_versions(self) -> List[Union[LegacyVersion, Version]]:
+        return self._graph.get_compatible_versions(self._node_id)
+
+    @compatible_versions.setter
+    def compatible_versions(self, versions: List[Union[LegacyVersion, Version]]):
+        self._graph.set_compatible_versions(self._node_id, versions)
+
+    @property
+    def best_candidate_version(self) -> Optional[Union[LegacyVersion, Version]]:
+        return self._graph.get_best_version(self._node_id)
+
+    @best_candidate_version.setter
+    def best_candidate_version(self, version: Optional[Union[LegacyVersion, Version]]):
+        self._graph.set_best_version(self._node_id, version)
+
+    @property
+    def version_index(self) -> Optional[VersionIndex]:
+        return self._graph.get_version_index(self._node_id)
+
+    @version_index.setter
+    def version_index(self, index: VersionIndex):
+        self._graph.set_version_index(self._node_id, index)
+
+    def copy(self, parent: Optional[Requirement] = None) -> Requirement:
+        """Copy the parsed requirement without its resolved metadata or children, and without parsing it again."""
+        clone = Requirement.__new__(Requirement)
+        clone.name = self.name
+        clone.url = self.url
+        clone.extras = self.extras
+        clone.specifier = self.specifier
+        clone.marker = self.marker
+        clone._init_node(parent)
+        return clone
+
     # TODO: This changes the requirement passed in
     def add_sub_requirement(self, req: Requirement):
         with self.lock:
-            req._parent = self
-            self._children.add(req)
+            if req._graph is not self._graph:
+                self._graph.adopt(req._graph, req._node_id)
+            self._graph.attach(self._node_id, req._node_id)
 
     def has_descendant(self, req: Requirement) -> bool:
         with self.lock:
-            if req in self._children:
-                return True
-            for child in self._children:
-                if child.has_descendant(req):
-                    return True
-        return False
+            return self._graph.has_descendant(self._node_id, req._key)
 
     def parent(self) -> Optional[Requirement]:
-        return self._parent
+        parent = self._graph.parent(self._node_id)
+        return self._graph.node(parent) if parent != NO_PARENT else None
 
     def children(self) -> Set[Requirement]:
-        return self._children
+        return set(map(self._graph.node, self._graph.children(self._node_id)))
 
     def ancestors(self) -> List[Requirement]:
-        ancestors: List[Requirement] = []
-        node = self
-        while node._parent:
-            ancestors.append(node._parent)
-            node = node._parent
-        return ancestors
+        return list(map(self._graph.node, self._graph.ancestors(self._node_id)))
 
     def descendants(self, stringify_keys: bool = False) -> Dict[Union[Requirement, str], Dict]:
-        descendants = {}
-        for child in self._children:
-            if stringify_keys:
-                descendants[str(child)] = child.descendants(stringify_keys=True)
-            else:
-                descendants[child] = child.descendants()
+        graph = self._graph
+        descendants: Dict[Union[Requirement, str], Dict] = {}
+        # Build the nested dicts with an explicit stack so deep graphs don't hit the recursion limit
+        stack = [(self._node_id, descendants)]
+        while stack:
+            node_id, result = stack.pop()
+            for child_id in graph.children(node_id):
+                child = graph.node(child_id)
+                child_result: Dict[Union[Requirement, str], Dict] = {}
+                result[str(child) if stringify_keys else child] = child_result
+                stack.append((child_id, child_result))
         return descendants
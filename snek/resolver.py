@@ -1,30 +1,123 @@
+import asyncio
+import contextvars
 import logging
-from typing import Optional, Set, Dict, Union, List
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Set, Dict, Union, List, Tuple, FrozenSet, NamedTuple, Callable, Iterator, AsyncIterator
 
-from snek import utils
-from snek.repository import Repository
+from packaging.version import Version, LegacyVersion
+
+from snek import utils, tracing, parsing
+from snek.installed import InstalledIndex
+from snek.lockfile import LockFile
+from snek.reducer import Reducer
+from snek.repository import Repository, AsyncRepository
 from snek.requirement import Requirement
+from snek.scheduler import FetchScheduler
+from snek.solver import Solver
 from snek.utils import parallel_map
 
 REPOSITORY_URL = 'https://pypi.org'
 
 log = logging.getLogger(__name__)
 
+# (project name, specifier, extras) - everything that determines the shape of a requirement's subtree
+SubtreeKey = Tuple[str, str, FrozenSet[str]]
+
 
 class CircularDependencyError(RuntimeError):
     pass
 
 
-# TODO: Add a timeout when resolving dependencies to retry a parallel job, sometimes it just hangs
+class ResolveEvent(NamedTuple):
+    # POPULATED once a node's version is picked, RESOLVED once its whole subtree is, FINISHED with the full graph
+    kind: str
+    requirement: Optional[Requirement] = None
+    graph: Optional[Dict[Requirement, Dict]] = None
+
+
+POPULATED = 'populated'
+RESOLVED = 'resolved'
+FINISHED = 'finished'
+
+# Where the current resolve reports its progress, if anywhere. Like cancel scopes, it's inherited by worker threads.
+_event_sink: contextvars.ContextVar = contextvars.ContextVar('snek_event_sink', default=None)
+
+
+class SubtreeMemo:
+    """
+    Fully resolved subtrees by SubtreeKey, for reuse wherever the same requirement shows up again in this or a later
+    resolve. A subtree is only as fresh as the metadata it was built from, so everything is dropped once the oldest
+    entry was started longer than the cache TTL ago, and the least recently used entries beyond max_entries go too.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # When the oldest entry started resolving, None while there aren't any
+        self._since: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: SubtreeKey) -> Optional[Requirement]:
+        with self._lock:
+            self._expire()
+            requirement = self._entries.get(key)
+            if requirement is not None:
+                self._entries.move_to_end(key)
+            return requirement
+
+    def set(self, key: SubtreeKey, requirement: Requirement, started_at: float):
+        """Remember a subtree whose metadata was all fetched after started_at."""
+        with self._lock:
+            self._expire()
+            if key not in self._entries:
+                self._since = started_at if self._since is None else min(self._since, started_at)
+                self._entries[key] = requirement
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _expire(self):
+        if self._since is not None and time.time() - self._since >= self.ttl:
+            self._entries.clear()
+            self._since = None
+
+
+def _emit(kind: str, requirement: Requirement):
+    sink: Optional[Callable[[ResolveEvent], None]] = _event_sink.get()
+    if sink is not None:
+        sink(ResolveEvent(kind, requirement))
+
+
+def _emit_subtree(requirement: Requirement):
+    # A reused subtree appears all at once, report its nodes children first like a fresh resolve would
+    if _event_sink.get() is None:
+        return
+    stack = [(requirement, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            _emit(RESOLVED, node)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children())
+
+
 # TODO: 'Actions' to perform install/uninstall/update/other tasks
-# TODO: Lock file so we don't need to resolve every time. Put a hash in the lockfile of the requirements
-#       manifest so we know when to expire it
-# TODO: Record dependencies in lock file even if they're not compatible with current environment
-# TODO: Check installed package versions (from pip freeze) so you can skip them if needed
 class Resolver:
     """
-    TODO: Everything described here.
-    This is a process that requires several phases:
+    Resolving requires the phases below. Resolver.resolve builds the tree of phases 1 and 2, with the compatible
+    versions of every node, but doesn't backtrack (phase 3) or merge circular dependencies (phases 4 and 5): it raises
+    CircularDependencyError, and conflicts are left to snek.reducer.Reducer. Phases 2-5 are implemented by
+    snek.solver.Solver (see Resolver.solve), which pins versions directly instead of building the tree. Phase 6 is
+    snek.install.InstallExecutor, which can start installing from Resolver.stream before the tree is finished.
 
     1. Find compatible versions for the root requirement.
 
@@ -64,45 +157,165 @@ class Resolver:
     the error from pip.
     """
 
-    def __init__(self, repository: Optional[Repository] = None):
+    def __init__(self, repository: Optional[Repository] = None, timeout: Optional[float] = None,
+                 tracer: Optional[tracing.Tracer] = None, installed: Optional[InstalledIndex] = None,
+                 scheduler: Optional[FetchScheduler] = None):
         if repository is None:
             repository = Repository()
         self._repository = repository
+        # Every metadata fetch goes through one priority queue, which also prefetches likely dependencies
+        self.scheduler = scheduler if scheduler is not None else FetchScheduler(repository, installed=installed)
+        self.timeout = timeout
+        # Spans and counters from resolves go here, and to whatever tracer is current when there isn't one
+        self.tracer = tracer
+        # Requirements an installed distribution satisfies are resolved from its metadata, without the network
+        self.installed = installed
+        self._subtrees = SubtreeMemo(repository.cache.ttl)
+        # Parsed requires_dist strings are saved next to the metadata when that's cached on disk
+        self._requirements_path = repository.cache.requirements_path()
 
     def resolve_many(self, requirements: Set[Requirement], stringify_keys=False) -> Dict[Union[Requirement, str], Dict]:
-        graphs = parallel_map(lambda req: self.resolve(req, stringify_keys=stringify_keys), requirements)
+        self._refresh_installed()
+        with tracing.tracing(self.tracer), utils.cancel_scope(self.timeout), \
+                parsing.persisted(self._requirements_path), self.scheduler.session():
+            graphs = parallel_map(lambda req: self._resolve(req, stringify_keys=stringify_keys), requirements)
         result: Dict[Union[Requirement, str], Dict] = {}
         [result.update(graph) for graph in graphs]
         return result
 
     def resolve(self, requirement: Requirement, stringify_keys=False) -> Dict[Union[Requirement, str], Dict]:
+        self._refresh_installed()
+        # The whole resolve shares one deadline. If any branch fails, parallel_map cancels its siblings.
+        with tracing.tracing(self.tracer), utils.cancel_scope(self.timeout), \
+                parsing.persisted(self._requirements_path), self.scheduler.session():
+            return self._resolve(requirement, stringify_keys=stringify_keys)
+
+    def _resolve(self, requirement: Requirement, stringify_keys=False) -> Dict[Union[Requirement, str], Dict]:
+        utils.check_cancelled()
+        key = Resolver.subtree_key(requirement)
+        resolved = self._subtrees.get(key)
+        if resolved is not None:
+            log.debug(f"Reusing resolved subtree for {requirement}")
+            tracing.current_tracer().count('subtrees.reused')
+            Resolver.graft(resolved, requirement)
+            _emit_subtree(requirement)
+            return Resolver.to_graph(requirement, stringify_keys)
+
         log.debug(f"Populating {requirement}")
+        started_at = time.time()
 
-        # Grab metadata, list of compatible versions, and determine largest compatible version for the requirement
-        self._repository.populate_requirement(requirement)
+        # The span covers the whole subtree, so it includes the time children spend waiting for a thread
+        with tracing.current_tracer().span('recurse', requirement=requirement):
+            # Determine the compatible versions and the largest of them, and grab the metadata of that version
+            if not (self.installed and self.installed.populate_requirement(requirement)):
+                self.scheduler.populate(requirement)
+            _emit(POPULATED, requirement)
 
-        current_version = utils.convert_to_version(requirement.project_metadata['info']['version'])
+            # Grab sub-dependencies of the requirement from its metadata
+            requires_dist: Optional[List[str]] = requirement.project_metadata['info']['requires_dist']
 
-        # If the metadata's current version is not the same as the largest compatible version, replace the metadata with
-        # that of the largest compatible version's metadata.
-        if current_version != requirement.best_candidate_version:
-            requirement.project_metadata = self._repository.get_package_info(requirement.name,
-                                                                             requirement.best_candidate_version)
+            if requires_dist and len(requires_dist) > 0:
+                sub_requirements = [Requirement.parse(sub_req, parent=requirement) for sub_req in requires_dist]
+                parallel_map(self.resolve_sub_requirement, sub_requirements)
 
-        # Grab sub-dependencies of the requirement from its metadata
-        requires_dist: Optional[List[str]] = requirement.project_metadata['info']['requires_dist']
+        self._subtrees.set(key, requirement, started_at)
+        _emit(RESOLVED, requirement)
+        return Resolver.to_graph(requirement, stringify_keys)
 
-        if requires_dist and len(requires_dist) > 0:
-            sub_requirements = [Requirement(sub_req, parent=requirement) for sub_req in requires_dist]
-            # TODO: Catch errors thrown by resolving sub-dependencies here. Make sure to cancel other threads that are
-            #       still resolving sub-dependencies in the same subtree.
-            parallel_map(self.resolve_sub_requirement, sub_requirements)
+    def stream(self, requirements: Set[Requirement]) -> Iterator[ResolveEvent]:
+        """
+        Resolve in the background, yielding an event as each node is populated and as each subtree is completed, then a
+        FINISHED event with the graph resolve_many would have returned. Closing the generator early cancels the resolve.
+        """
+        events: queue.Queue = queue.Queue()
+        done = object()
+        with utils.cancel_scope() as scope:
+            context = contextvars.copy_context()
+        context.run(_event_sink.set, events.put)
 
-        # TODO: Extract to a utility method?
-        if stringify_keys:
-            return {str(requirement): requirement.descendants(stringify_keys=True)}
-        else:
-            return {requirement: requirement.descendants()}
+        def run():
+            try:
+                events.put(ResolveEvent(FINISHED, graph=self.resolve_many(requirements)))
+            except BaseException as e:
+                events.put(e)
+            finally:
+                events.put(done)
+
+        thread = threading.Thread(target=context.run, args=(run,), name='snek-stream', daemon=True)
+        thread.start()
+        try:
+            while True:
+                event = events.get()
+                if event is done:
+                    return
+                if isinstance(event, BaseException):
+                    raise event
+                yield event
+        finally:
+            scope.cancel()
+            thread.join()
+
+    def _refresh_installed(self):
+        # Installing or removing anything changes a directory's mtime, so this is a stat per directory most of the time
+        if self.installed is not None:
+            self.installed.refresh()
+
+    def resolve_matrix(self, requirements: Set[Requirement],
+                       environments: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, Union[Version, LegacyVersion]]]:
+        """
+        Resolve once and pin versions for each of several marker environments (see markers.target_environment). The
+        resolved graph already has every dependency whatever its marker, so only the reduction is per environment.
+        """
+        graph = self.resolve_many(requirements)
+        with tracing.tracing(self.tracer):
+            return Reducer.reduce_matrix(graph, environments)
+
+    def resolve_locked(self, requirements: Set[Requirement], lock_file: Optional[LockFile] = None,
+                       stringify_keys=False) -> Dict[Union[Requirement, str], Dict]:
+        """Load unchanged roots from the lock file, and only resolve the roots that were added or changed."""
+        result: Dict[Union[Requirement, str], Dict] = {}
+        stale: Set[Requirement] = set()
+        for requirement in requirements:
+            locked = lock_file.load_requirement(requirement) if lock_file else None
+            if locked is None:
+                stale.add(requirement)
+                continue
+            # Subtrees shared with the changed roots don't need resolving again either
+            self.remember(locked)
+            result.update(Resolver.to_graph(locked, stringify_keys))
+        if stale:
+            log.debug(f"Resolving {len(stale)} changed requirement(s): {', '.join(map(str, stale))}")
+            if lock_file:
+                # What the unchanged parts of the graph depended on last time is a good guess at what they still do
+                self.scheduler.add_hints(lock_file.hints())
+            result.update(self.resolve_many(stale, stringify_keys=stringify_keys))
+        return result
+
+    def lock(self, requirements: Set[Requirement], path: str) -> LockFile:
+        """Bring the lock file at path up to date with the given requirements."""
+        lock_file = LockFile.load(path) if os.path.exists(path) else None
+        if lock_file and lock_file.manifest_hash == LockFile.hash_manifest(requirements) \
+                and all(map(lock_file.is_locked, requirements)):
+            return lock_file
+        graph = self.resolve_locked(requirements, lock_file)
+        lock_file = LockFile.from_graph(graph, Reducer.reduce(graph))
+        lock_file.dump(path)
+        return lock_file
+
+    def remember(self, requirement: Requirement):
+        """Make a resolved subtree, and every subtree inside it, available for reuse."""
+        # The caller vouches for these, usually because they're pinned in a lock file, so they count as fresh from now
+        now = time.time()
+        stack = [requirement]
+        while stack:
+            node = stack.pop()
+            self._subtrees.set(Resolver.subtree_key(node), node, now)
+            self.scheduler.mark_known(node)
+            stack.extend(node.children())
+
+    def solve(self, requirements: Set[Requirement],
+              environment: Optional[Dict[str, str]] = None) -> Dict[str, Union[Version, LegacyVersion]]:
+        return Solver(self._repository, environment).solve(requirements)
 
     def resolve_sub_requirement(self, sub_requirement: Requirement):
         # Check extras on the sub-requirement in case we don't need it after all
@@ -110,6 +323,38 @@ class Resolver:
             log.debug(f"Ignoring {sub_requirement}.")
             return
 
+        Resolver.check_circular_dependency(sub_requirement)
+        self._resolve(sub_requirement)
+        # Finalize the sub-requirement by adding it to the parent requirement
+        sub_requirement.parent().add_sub_requirement(sub_requirement)
+
+    @staticmethod
+    def subtree_key(requirement: Requirement) -> SubtreeKey:
+        return requirement.name.lower(), str(requirement.specifier), frozenset(requirement.extras)
+
+    @staticmethod
+    def graft(source: Requirement, target: Requirement):
+        """Copy the resolved subtree rooted at source onto target, which has the same subtree key."""
+        target.project_metadata = source.project_metadata
+        target.compatible_versions = source.compatible_versions
+        target.best_candidate_version = source.best_candidate_version
+        target.version_index = source.version_index
+        for child in source.children():
+            clone = child.copy(parent=target)
+            # The subtree may close a loop with the target's ancestors even if it didn't where it was first resolved
+            Resolver.check_circular_dependency(clone)
+            Resolver.graft(child, clone)
+            target.add_sub_requirement(clone)
+
+    @staticmethod
+    def to_graph(requirement: Requirement, stringify_keys=False) -> Dict[Union[Requirement, str], Dict]:
+        if stringify_keys:
+            return {str(requirement): requirement.descendants(stringify_keys=True)}
+        else:
+            return {requirement: requirement.descendants()}
+
+    @staticmethod
+    def check_circular_dependency(sub_requirement: Requirement):
         # Check for a circular dependency >:(
         if sub_requirement.name in map(lambda r: r.name, sub_requirement.ancestors()):
             chain = reversed(list(map(str, sub_requirement.ancestors())))
@@ -117,19 +362,117 @@ class Resolver:
                 f"Circular dependency detected: {' -> '.join(chain)} -> {sub_requirement}")
             raise CircularDependencyError
 
-        self.resolve(sub_requirement)
-        # Finalize the sub-requirement by adding it to the parent requirement
-        sub_requirement.parent().add_sub_requirement(sub_requirement)
-
     @staticmethod
     def should_ignore(sub_requirement: Requirement):
-        if 'extra' not in str(sub_requirement.marker):
+        # Only requirements for extras the parent didn't ask for are ignored
+        predicate = sub_requirement.predicate
+        if predicate is None or not predicate.extras:
             return False
+        return predicate.extras.isdisjoint(sub_requirement.parent().extras)
+
+
+class AsyncResolver:
+    """
+    Same algorithm as Resolver, but every node is a coroutine on a single event loop instead of a thread blocked on its
+    children, so the number of OS threads stays fixed no matter how wide or deep the tree is.
+    """
+
+    def __init__(self, repository: Optional[AsyncRepository] = None, timeout: Optional[float] = None,
+                 tracer: Optional[tracing.Tracer] = None, installed: Optional[InstalledIndex] = None):
+        if repository is None:
+            repository = AsyncRepository()
+        self._repository = repository
+        self.timeout = timeout
+        self.tracer = tracer
+        self.installed = installed
+        self._subtrees = SubtreeMemo(repository.repository.cache.ttl)
+        self._requirements_path = repository.repository.cache.requirements_path()
 
-        for extra in sub_requirement.parent().extras:
-            if f"extra==\"{extra}\"" in str(sub_requirement.marker).replace(' ', ''):
-                return False
-        return True
+    async def resolve_many(self, requirements: Set[Requirement],
+                           stringify_keys=False) -> Dict[Union[Requirement, str], Dict]:
+        graphs = await self._with_deadline(utils.gather_or_cancel(
+            *(self._resolve(req, stringify_keys=stringify_keys) for req in requirements)))
+        result: Dict[Union[Requirement, str], Dict] = {}
+        [result.update(graph) for graph in graphs]
+        return result
+
+    async def resolve(self, requirement: Requirement, stringify_keys=False) -> Dict[Union[Requirement, str], Dict]:
+        return await self._with_deadline(self._resolve(requirement, stringify_keys=stringify_keys))
+
+    async def _with_deadline(self, awaitable):
+        if self.installed is not None:
+            self.installed.refresh()
+        # Tasks copy the current context when they're created, so the tracer and the cancel scope have to be set before
+        # wait_for makes one. Fetches on the repository's executor get the scope too, so cancelling it stops them.
+        with tracing.tracing(self.tracer), parsing.persisted(self._requirements_path), \
+                utils.cancel_scope(self.timeout) as scope:
+            try:
+                return await asyncio.wait_for(awaitable, self.timeout)
+            except asyncio.TimeoutError as e:
+                scope.cancel()
+                raise utils.DeadlineExceeded from e
+            except BaseException:
+                scope.cancel()
+                raise
+
+    async def _resolve(self, requirement: Requirement, stringify_keys=False) -> Dict[Union[Requirement, str], Dict]:
+        key = Resolver.subtree_key(requirement)
+        resolved = self._subtrees.get(key)
+        if resolved is not None:
+            log.debug(f"Reusing resolved subtree for {requirement}")
+            tracing.current_tracer().count('subtrees.reused')
+            Resolver.graft(resolved, requirement)
+            _emit_subtree(requirement)
+            return Resolver.to_graph(requirement, stringify_keys)
+
+        log.debug(f"Populating {requirement}")
+        started_at = time.time()
+
+        with tracing.current_tracer().span('recurse', requirement=requirement):
+            if not (self.installed and self.installed.populate_requirement(requirement)):
+                await self._repository.populate_requirement(requirement)
+            _emit(POPULATED, requirement)
+
+            requires_dist: Optional[List[str]] = requirement.project_metadata['info']['requires_dist']
+
+            if requires_dist and len(requires_dist) > 0:
+                sub_requirements = [Requirement.parse(sub_req, parent=requirement) for sub_req in requires_dist]
+                await utils.gather_or_cancel(*map(self.resolve_sub_requirement, sub_requirements))
+
+        self._subtrees.set(key, requirement, started_at)
+        _emit(RESOLVED, requirement)
+        return Resolver.to_graph(requirement, stringify_keys)
+
+    async def stream(self, requirements: Set[Requirement]) -> AsyncIterator[ResolveEvent]:
+        """Same as Resolver.stream, as an async iterator. Leaving the loop early cancels the resolve."""
+        events: asyncio.Queue = asyncio.Queue()
+        # The task takes a copy of the context, so the sink only has to be set while it's created
+        token = _event_sink.set(events.put_nowait)
+        try:
+            task = asyncio.ensure_future(self.resolve_many(requirements))
+        finally:
+            _event_sink.reset(token)
+        try:
+            while not task.done() or not events.empty():
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            yield ResolveEvent(FINISHED, graph=task.result())
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def resolve_sub_requirement(self, sub_requirement: Requirement):
+        if Resolver.should_ignore(sub_requirement):
+            log.debug(f"Ignoring {sub_requirement}.")
+            return
+
+        Resolver.check_circular_dependency(sub_requirement)
+        await self._resolve(sub_requirement)
+        sub_requirement.parent().add_sub_requirement(sub_requirement)
 
 
 if __name__ == '__main__':
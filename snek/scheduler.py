@@ -0,0 +1,348 @@
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from packaging.specifiers import SpecifierSet
+
+from snek import parsing, tracing, utils
+from snek.installed import InstalledIndex
+from snek.repository import Repository
+from snek.requirement import Requirement
+
+log = logging.getLogger(__name__)
+
+# (lowercase project name, specifier) - everything populate_requirement looks at
+FetchKey = Tuple[str, str]
+
+# ASSIGNED fetches have been given a slot and are waiting for one of their waiters to pick them up
+PENDING, ASSIGNED, RUNNING, DONE, DROPPED = range(5)
+
+
+class _Fetch:
+    __slots__ = ('key', 'requirement', 'future', 'state', 'speculative', 'waiters', 'owners', 'height', 'order',
+                 'priority', 'speculated', 'tracer')
+
+    def __init__(self, key: FetchKey, requirement: Requirement, speculative: bool, order: int, height: int,
+                 tracer: tracing.Tracer):
+        self.key = key
+        # A detached copy that the fetch populates, for every node with the same key to copy from
+        self.requirement = requirement
+        self.future: Future = Future()
+        self.state = PENDING
+        self.speculative = speculative
+        # Resolver threads waiting on this fetch, and speculative fetches that expect to need it
+        self.waiters = 0
+        self.owners = 0
+        self.height = height
+        self.order = order
+        self.priority: tuple = ()
+        # Keys of the fetches this one started speculatively, None until it has
+        self.speculated: Optional[Set[FetchKey]] = None
+        self.tracer = tracer
+
+
+class FetchScheduler:
+    """
+    Runs the metadata fetches of a resolve from one priority queue, instead of in whatever order resolver threads get
+    to them.
+
+    Confirmed fetches, the ones a resolver thread is waiting on, go first: deepest remaining chain of dependencies
+    first, then the packages the most nodes are waiting on. While a fetch is queued, the requirements its package is
+    likely to have - its requires_dist from a hint source such as stale cache entries or a lock file - are queued as
+    speculative fetches, and their requirements in turn, down to speculation_depth. So the grandchildren of a node are
+    on their way before its children are confirmed, and a resolve costs about as long as its longest chain of
+    dependent fetches rather than the number of levels in the tree times the latency.
+
+    At most `workers` fetches run at once. A confirmed fetch runs on one of the resolver threads waiting for it, so the
+    scheduler only starts threads of its own for speculative work.
+
+    When a fetch finishes, the speculative fetches it started for requirements its package doesn't actually have are
+    dropped if nothing else wants them. When the last resolve using the scheduler finishes, whatever speculative work
+    is still queued is dropped too, and finished fetches are forgotten, so the next resolve goes back to the
+    repository and its cache rather than reusing results that may have gone stale.
+
+    Hints are read, and heights worked out, without holding the scheduler's lock, since they may come from the disk.
+    """
+
+    def __init__(self, repository: Repository, workers: int = 16, speculative_workers: int = 4,
+                 speculation_depth: int = 2, installed: Optional[InstalledIndex] = None):
+        self.repository = repository
+        # Requirements an installed distribution satisfies are never fetched, so they aren't prefetched either
+        self.installed = installed
+        self.workers = workers
+        # Speculative fetches get threads of their own, so they're kept to a few slots
+        self.speculative_workers = speculative_workers
+        self.speculation_depth = speculation_depth
+        # Hints given explicitly, which take precedence over the repository's cache
+        self._hints_given: Dict[str, List[str]] = {}
+        # Requirements the resolver already has subtrees for, which are never worth prefetching
+        self._known: Set[FetchKey] = set()
+        self._heights: Dict[str, int] = {}
+        # Bumped whenever the hints change, so heights worked out from the old ones aren't kept
+        self._hints_version = 0
+        self._fetches: Dict[FetchKey, _Fetch] = {}
+        self._queue: List[Tuple[tuple, _Fetch]] = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._running = 0
+        self._speculating = 0
+        self._sessions = 0
+
+    def add_hints(self, hints: Dict[str, List[str]]):
+        """Also guess dependencies from a mapping of lowercase project names to requires_dist, e.g. LockFile.hints()."""
+        with self._condition:
+            self._hints_given.update(hints)
+            self._heights.clear()
+            self._hints_version += 1
+
+    def mark_known(self, requirement: Requirement):
+        """Don't prefetch requirement speculatively, e.g. because the resolver can reuse its subtree."""
+        with self._condition:
+            self._known.add((requirement.name.lower(), str(requirement.specifier)))
+
+    @contextmanager
+    def session(self) -> Iterator['FetchScheduler']:
+        """Wrap a resolve. Speculative work still queued when the last session ends is dropped."""
+        with self._condition:
+            self._sessions += 1
+        try:
+            yield self
+        finally:
+            with self._condition:
+                self._sessions -= 1
+                if self._sessions == 0:
+                    for fetch in list(self._fetches.values()):
+                        if fetch.state == PENDING and fetch.speculative:
+                            self._drop(fetch)
+                        elif fetch.state == DONE:
+                            del self._fetches[fetch.key]
+
+    def populate(self, requirement: Requirement):
+        """Populate requirement like Repository.populate_requirement, through the queue."""
+        while True:
+            fetch = self._submit(requirement.name, requirement.specifier, requirement.copy, speculative=False)
+            try:
+                if self._wait(fetch):
+                    self._run(fetch)
+            finally:
+                self._leave(fetch)
+            # Another resolve's thread may have run the fetch and been cancelled halfway through, which is no reason
+            # for this one to fail
+            if isinstance(fetch.future.exception(), utils.OperationCancelled):
+                utils.check_cancelled()
+                continue
+            break
+        source: Requirement = fetch.future.result()
+        requirement.version_index = source.version_index
+        requirement.compatible_versions = source.compatible_versions
+        requirement.best_candidate_version = source.best_candidate_version
+        requirement.project_metadata = source.project_metadata
+
+    def _leave(self, fetch: _Fetch):
+        with self._condition:
+            fetch.waiters -= 1
+            if fetch.state == ASSIGNED and fetch.waiters == 0:
+                # Everyone waiting gave up before they could run it. Its slot goes back, and the fetch is left to the
+                # speculative work that still wants it, if any, under the same limits as the rest of that.
+                fetch.state = PENDING
+                fetch.speculative = True
+                self._running -= 1
+                self._enqueue(fetch)
+
+    def _submit(self, name: str, specifier: SpecifierSet, make_requirement: Callable[[], Requirement],
+                speculative: bool) -> _Fetch:
+        key = (name.lower(), str(specifier))
+        height = self._height(key[0])
+        with self._condition:
+            fetch, speculate = self._add(key, make_requirement, speculative, height, 0)
+        if speculate:
+            self._speculate(fetch, 0, self._hints(key[0]))
+        return fetch
+
+    def _add(self, key: FetchKey, make_requirement: Callable[[], Requirement], speculative: bool, height: int,
+             depth: int) -> Tuple[_Fetch, bool]:
+        """Queue a fetch, or join the one already there. Also returns whether it's up to the caller to speculate."""
+        fetch = self._fetches.get(key)
+        # A failed fetch is tried again by the next node that needs it, the failure may have been temporary
+        if fetch is None or fetch.state == DROPPED or (fetch.future.done() and fetch.future.exception()):
+            fetch = self._fetches[key] = _Fetch(key, make_requirement(), speculative, next(self._order), height,
+                                                tracing.current_tracer())
+        if speculative:
+            fetch.owners += 1
+        else:
+            fetch.waiters += 1
+            if fetch.speculative:
+                fetch.speculative = False
+                fetch.tracer.count('prefetch.confirmed')
+        if fetch.state == PENDING:
+            self._enqueue(fetch)
+        speculate = fetch.speculated is None and depth < self.speculation_depth
+        if speculate:
+            fetch.speculated = set()
+        return fetch, speculate
+
+    def _speculate(self, fetch: _Fetch, depth: int, requirements: List[parsing.ParsedRequirement]):
+        for parsed in requirements:
+            key = (parsed.name.lower(), str(parsed.specifier))
+            if self.installed is not None and self.installed.satisfies(parsed.name, parsed.specifier):
+                continue
+            height = self._height(key[0])
+            with self._condition:
+                if fetch.speculated is None:
+                    fetch.speculated = set()
+                if key in fetch.speculated or key in self._known:
+                    continue
+                child, speculate = self._add(key, lambda: Requirement.parse(parsed.key), True, height, depth + 1)
+                fetch.speculated.add(key)
+            fetch.tracer.count('prefetch.speculated')
+            if speculate:
+                self._speculate(child, depth + 1, self._hints(key[0]))
+
+    def _hints(self, name: str) -> List[parsing.ParsedRequirement]:
+        with self._condition:
+            requires_dist = self._hints_given.get(name)
+        if requires_dist is None:
+            requires_dist = self.repository.cached_requires_dist(name) or []
+        return self._likely(requires_dist)
+
+    @staticmethod
+    def _likely(requires_dist: List[str]) -> List[parsing.ParsedRequirement]:
+        # Requirements that only come with an extra are usually not wanted
+        return [parsed for parsed in map(parsing.parse, requires_dist)
+                if parsed.predicate is None or not parsed.predicate.extras]
+
+    def _height(self, name: str) -> int:
+        """The longest chain of dependencies below a package according to the hints, counting the package itself."""
+        with self._condition:
+            height = self._heights.get(name)
+            if height is not None:
+                return height
+            heights = dict(self._heights)
+            version = self._hints_version
+        # Walked with an explicit stack, ignoring edges that would close a cycle
+        stack = [(name, False)]
+        on_path: Set[str] = set()
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                on_path.discard(node)
+                children = [parsed.name.lower() for parsed in self._hints(node)]
+                heights[node] = 1 + max((heights.get(child, 0) for child in children), default=0)
+            elif node not in heights and node not in on_path:
+                on_path.add(node)
+                stack.append((node, True))
+                stack.extend((parsed.name.lower(), False) for parsed in self._hints(node))
+        with self._condition:
+            if version == self._hints_version:
+                self._heights.update(heights)
+        return heights[name]
+
+    def _enqueue(self, fetch: _Fetch):
+        # Lower sorts first. An entry whose priority is out of date is skipped when it's popped.
+        fetch.priority = (fetch.speculative, -fetch.height, -(fetch.waiters + fetch.owners), fetch.order)
+        heapq.heappush(self._queue, (fetch.priority, fetch))
+        self._dispatch()
+
+    def _dispatch(self):
+        # Hand out free slots to the most important queued fetches
+        while self._running < self.workers:
+            fetch = self._next()
+            if fetch is None:
+                return
+            if not fetch.waiters and self._speculating >= self.speculative_workers:
+                # Confirmed fetches sort first, so everything still queued is speculative too
+                heapq.heappush(self._queue, (fetch.priority, fetch))
+                return
+            self._running += 1
+            if fetch.waiters:
+                fetch.state = ASSIGNED
+                self._condition.notify_all()
+            else:
+                self._start_worker(fetch)
+
+    def _next(self) -> Optional[_Fetch]:
+        while self._queue:
+            priority, fetch = heapq.heappop(self._queue)
+            if fetch.state != PENDING or priority != fetch.priority:
+                continue
+            if fetch.speculative and fetch.owners == 0:
+                self._drop(fetch)
+                continue
+            return fetch
+        return None
+
+    def _wait(self, fetch: _Fetch) -> bool:
+        """Wait until the fetch is done, or until it's given a slot, in which case this thread has to run it."""
+        with self._condition:
+            while True:
+                if fetch.state == ASSIGNED:
+                    fetch.state = RUNNING
+                    return True
+                if fetch.state == DONE:
+                    return False
+                self._condition.wait(utils.remaining_time(0.1))
+
+    def _start_worker(self, fetch: _Fetch):
+        fetch.state = RUNNING
+        self._speculating += 1
+        threading.Thread(target=self._work, args=(fetch,), name='snek-prefetch', daemon=True).start()
+
+    def _work(self, fetch: _Fetch):
+        with tracing.tracing(fetch.tracer):
+            try:
+                self._run(fetch)
+            finally:
+                with self._condition:
+                    self._speculating -= 1
+                    self._dispatch()
+
+    def _run(self, fetch: _Fetch):
+        try:
+            self.repository.populate_requirement(fetch.requirement)
+        except BaseException as e:
+            fetch.future.set_exception(e)
+            requirements = None
+        else:
+            fetch.future.set_result(fetch.requirement)
+            requires_dist = fetch.requirement.project_metadata.get('info', {}).get('requires_dist') or []
+            requirements = list(map(parsing.parse, requires_dist))
+        with self._condition:
+            fetch.state = DONE
+            self._running -= 1
+            if requirements is not None:
+                self._prune(fetch, requirements)
+            keep_going = requirements is not None and fetch.speculative and self._sessions
+            self._dispatch()
+            self._condition.notify_all()
+        if keep_going:
+            # The guess hasn't been confirmed yet, but its requirements are real, so keep going from them
+            self._speculate(fetch, self.speculation_depth - 1, self._likely(requires_dist))
+
+    def _prune(self, fetch: _Fetch, requirements: List[parsing.ParsedRequirement]):
+        # Now that the real requirements are known, let go of the guesses that were wrong
+        if not fetch.speculated:
+            return
+        actual = {(parsed.name.lower(), str(parsed.specifier)) for parsed in requirements}
+        for key in fetch.speculated - actual:
+            self._release(key)
+        fetch.speculated &= actual
+
+    def _release(self, key: FetchKey):
+        stack = [key]
+        while stack:
+            fetch = self._fetches.get(stack.pop())
+            if fetch is None or fetch.state != PENDING or not fetch.speculative:
+                continue
+            fetch.owners -= 1
+            if fetch.owners <= 0:
+                stack.extend(self._drop(fetch))
+
+    def _drop(self, fetch: _Fetch) -> Set[FetchKey]:
+        fetch.state = DROPPED
+        del self._fetches[fetch.key]
+        fetch.tracer.count('prefetch.dropped')
+        return fetch.speculated or set()
@@ -0,0 +1,210 @@
+import logging
+from concurrent.futures import Future
+from concurrent.futures.thread import ThreadPoolExecutor
+from functools import reduce
+from typing import Dict, List, Optional, Tuple, FrozenSet, Iterable, Set, Union
+
+from packaging.specifiers import SpecifierSet
+from packaging.version import Version, LegacyVersion
+
+from snek.repository import Repository, PackageNotFoundError
+from snek.requirement import Requirement
+
+log = logging.getLogger(__name__)
+
+AnyVersion = Union[Version, LegacyVersion]
+# A package key (a project name, or 'name[extra]' for the extra's dependencies) pinned to one version
+Term = Tuple[str, AnyVersion]
+# A set of terms that can't all hold at once
+Incompatibility = FrozenSet[Term]
+
+
+class SolverError(RuntimeError):
+    pass
+
+
+class Solver:
+    """
+    Conflict-driven backtracking solver over pinned versions, as opposed to the tree Resolver builds.
+
+    Packages are decided one at a time, most constrained first, newest compatible version first. When a package is
+    left with no candidates, the decisions responsible for that (the sources of its constraints, plus whatever ruled
+    out its remaining versions) are recorded as an incompatibility, and the solver jumps straight back to the most
+    recent of them instead of retrying every decision in between. Incompatibilities are kept for the rest of the solve
+    so the same doomed combination is never tried twice.
+
+    Extras are modelled as separate packages ('flask[dev]') that depend on their base package at the same version, and
+    circular dependencies need no special handling: a dependency on an already decided package is just a constraint
+    it must satisfy.
+    """
+
+    def __init__(self, repository: Optional[Repository] = None, environment: Optional[Dict[str, str]] = None,
+                 max_steps: int = 100000, prefetch: int = 2):
+        if repository is None:
+            repository = Repository()
+        self._repository = repository
+        self._environment = environment or {}
+        self.max_steps = max_steps
+        self.prefetch = prefetch
+        self.steps = 0
+
+        self._decisions: List[Term] = []
+        self._assignment: Dict[str, AnyVersion] = {}
+        self._constraints: Dict[str, List[Tuple[SpecifierSet, Optional[str]]]] = {}
+        self._incompatibilities: Dict[Term, List[Incompatibility]] = {}
+        self._display_names: Dict[str, str] = {}
+        self._dependencies: Dict[Term, List[Tuple[str, SpecifierSet]]] = {}
+        self._prefetched: Dict[Term, Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def solve(self, requirements: Iterable[Requirement]) -> Dict[str, AnyVersion]:
+        self._executor = ThreadPoolExecutor(max_workers=max(self.prefetch, 1), thread_name_prefix='snek-prefetch')
+        try:
+            for requirement in requirements:
+                if self._is_compatible(requirement, ''):
+                    for key, specifier in self._constraints_for(requirement):
+                        self._add_constraint(key, specifier, None)
+            return self._solve()
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def _solve(self) -> Dict[str, AnyVersion]:
+        while True:
+            self.steps += 1
+            if self.steps > self.max_steps:
+                raise SolverError(f"Gave up after {self.max_steps} steps")
+
+            pending = [key for key, constraints in self._constraints.items()
+                       if constraints and key not in self._assignment]
+            if not pending:
+                return {self._display_names[key]: version for key, version in self._assignment.items()
+                        if '[' not in key}
+
+            # Fail first: the package with the fewest candidates left is the most likely to conflict
+            key, candidates = min(((key, self._candidates(key)) for key in sorted(pending)),
+                                  key=lambda item: len(item[1]))
+            if not candidates:
+                self._backjump(key)
+                continue
+
+            for candidate in candidates[1:self.prefetch + 1]:
+                self._prefetch(key, candidate)
+            for version in candidates:
+                if self._decide(key, version):
+                    break
+
+    def _candidates(self, key: str) -> List[AnyVersion]:
+        specifier = reduce(SpecifierSet.__and__, (specifier for specifier, _ in self._constraints[key]))
+        versions = self._repository.get_version_index(self._base_name(key)).filter(specifier)
+        return [version for version in reversed(versions) if self._excluded_by(key, version) is None]
+
+    def _excluded_by(self, key: str, version: AnyVersion) -> Optional[Incompatibility]:
+        for incompatibility in self._incompatibilities.get((key, version), ()):
+            if all(self._assignment.get(other) == other_version for other, other_version in incompatibility
+                   if other != key):
+                return incompatibility
+        return None
+
+    def _decide(self, key: str, version: AnyVersion) -> bool:
+        try:
+            dependencies = self._get_dependencies(key, version)
+        except PackageNotFoundError:
+            log.debug(f"No metadata for {key} {version}, skipping it")
+            self._learn(frozenset({(key, version)}))
+            return False
+
+        # Don't pick a version whose dependencies rule out something we've already decided
+        for dependency, specifier in dependencies:
+            decided = self._assignment.get(dependency)
+            if decided is not None and not specifier.contains(decided, prereleases=True):
+                log.debug(f"{key} {version} requires {dependency}{specifier}, but {decided} was already chosen")
+                self._learn(frozenset({(key, version), (dependency, decided)}))
+                return False
+
+        log.debug(f"Trying {key} {version}")
+        self._decisions.append((key, version))
+        self._assignment[key] = version
+        for dependency, specifier in dependencies:
+            self._add_constraint(dependency, specifier, key)
+        return True
+
+    def _backjump(self, key: str):
+        # Everything that constrains this package or ruled out one of its versions shares the blame
+        cause: Set[Term] = {(source, self._assignment[source]) for _, source in self._constraints[key] if source}
+        specifier = reduce(SpecifierSet.__and__, (specifier for specifier, _ in self._constraints[key]))
+        for version in self._repository.get_version_index(self._base_name(key)).filter(specifier):
+            incompatibility = self._excluded_by(key, version)
+            if incompatibility is not None:
+                cause.update(term for term in incompatibility if term[0] != key)
+
+        if not cause:
+            constraints = ', '.join(f"{self._display_names[key]}{specifier or ''} (from {source or 'root'})"
+                                    for specifier, source in self._constraints[key])
+            raise SolverError(f"Couldn't find a version for {self._display_names[key]}: {constraints}")
+
+        self._learn(frozenset(cause))
+        # Undo decisions up to and including the most recent one involved in the conflict
+        latest = max(self._decisions.index(term) for term in cause)
+        log.debug(f"Conflict on {key}, backjumping past {self._decisions[latest]}")
+        while len(self._decisions) > latest:
+            undone, _ = self._decisions.pop()
+            del self._assignment[undone]
+            for constraints in self._constraints.values():
+                constraints[:] = [(spec, source) for spec, source in constraints if source != undone]
+
+    def _learn(self, incompatibility: Incompatibility):
+        for term in incompatibility:
+            self._incompatibilities.setdefault(term, []).append(incompatibility)
+
+    def _add_constraint(self, key: str, specifier: SpecifierSet, source: Optional[str]):
+        if key not in self._constraints:
+            self._constraints[key] = []
+            # Start fetching the release list now, it'll be needed as soon as this package is considered
+            self._executor.submit(self._repository.get_version_index, self._base_name(key))
+        self._constraints[key].append((specifier, source))
+
+    def _constraints_for(self, requirement: Requirement) -> List[Tuple[str, SpecifierSet]]:
+        name = requirement.name.lower()
+        self._display_names.setdefault(name, requirement.name)
+        constraints = [(name, requirement.specifier)]
+        for extra in sorted(requirement.extras):
+            self._display_names.setdefault(f"{name}[{extra}]", f"{requirement.name}[{extra}]")
+            constraints.append((f"{name}[{extra}]", requirement.specifier))
+        return constraints
+
+    def _prefetch(self, key: str, version: AnyVersion):
+        term = (self._base_name(key), version)
+        if term not in self._prefetched and term not in self._dependencies:
+            self._prefetched[term] = self._executor.submit(self._repository.get_package_info, *term)
+
+    def _get_dependencies(self, key: str, version: AnyVersion) -> List[Tuple[str, SpecifierSet]]:
+        name = self._base_name(key)
+        extra = key[len(name) + 1:-1] if key != name else ''
+        if (key, version) in self._dependencies:
+            return self._dependencies[(key, version)]
+
+        future = self._prefetched.pop((name, version), None)
+        package_info = future.result() if future else self._repository.get_package_info(name, version)
+        requires_dist = package_info['info']['requires_dist'] or []
+
+        dependencies: List[Tuple[str, SpecifierSet]] = []
+        if extra:
+            dependencies.append((name, SpecifierSet(f"=={version}")))
+        for requirement in map(Requirement.parse, requires_dist):
+            if not self._is_compatible(requirement, extra):
+                continue
+            # An extra only adds the dependencies that are specific to it, the rest come from the base package
+            if extra and requirement.marker is not None and self._is_compatible(requirement, ''):
+                continue
+            dependencies.extend(self._constraints_for(requirement))
+        self._dependencies[(key, version)] = dependencies
+        return dependencies
+
+    def _is_compatible(self, requirement: Requirement, extra: str) -> bool:
+        if requirement.predicate is None:
+            return extra == ''
+        return requirement.predicate({**self._environment, 'extra': extra})
+
+    @staticmethod
+    def _base_name(key: str) -> str:
+        return key.split('[', 1)[0]
@@ -0,0 +1,152 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Iterator, Tuple
+
+
+class _Span:
+    __slots__ = ('_tracer', '_phase', '_args', '_start')
+
+    def __init__(self, tracer: 'Tracer', phase: str, args: dict):
+        self._tracer = tracer
+        self._phase = phase
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._tracer._record(self._phase, self._start, time.perf_counter(), self._args)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Collects timed spans and counters from a resolve.
+
+    Spans are tagged with the phase they belong to (fetch, parse, filter, recurse, reduce, queue) plus whatever
+    arguments describe them, usually the project or requirement. Counters are running totals like cache hits and bytes
+    downloaded; gauges are sampled values like queue depth, of which the latest and highest are kept. Everything can be
+    exported as a Chrome trace (chrome://tracing, Perfetto) or summarized as a table.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._spans: List[Tuple[str, float, float, int, dict]] = []
+        self._samples: List[Tuple[str, float, float]] = []
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, float] = {}
+        self.peaks: Dict[str, float] = {}
+
+    def span(self, phase: str, **args):
+        return _Span(self, phase, args)
+
+    def count(self, counter: str, value: int = 1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+            self.peaks[name] = max(self.peaks.get(name, value), value)
+            self._samples.append((name, time.perf_counter(), value))
+
+    def _record(self, phase: str, start: float, end: float, args: dict):
+        span = (phase, start, end, threading.get_ident(), args)
+        with self._lock:
+            self._spans.append(span)
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self._spans)
+            samples = list(self._samples)
+            counters = dict(self.counters)
+        events = [{'name': phase, 'cat': phase, 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6,
+                   'args': {key: str(value) for key, value in args.items()}}
+                  for phase, start, end, tid, args in spans]
+        events.extend({'name': name, 'ph': 'C', 'pid': pid, 'ts': (timestamp - self._origin) * 1e6,
+                       'args': {name: value}} for name, timestamp, value in samples)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'counters': counters}}
+
+    def dump_chrome_trace(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def phases(self) -> Dict[str, Tuple[int, float, float]]:
+        """Number of spans, total and longest duration in seconds, per phase."""
+        result: Dict[str, Tuple[int, float, float]] = {}
+        with self._lock:
+            for phase, start, end, _, _ in self._spans:
+                count, total, longest = result.get(phase, (0, 0.0, 0.0))
+                result[phase] = (count + 1, total + end - start, max(longest, end - start))
+        return result
+
+    def summary(self) -> str:
+        lines = [f"{'phase':<10} {'spans':>8} {'total ms':>12} {'mean ms':>10} {'max ms':>10}"]
+        for phase, (count, total, longest) in sorted(self.phases().items(), key=lambda item: -item[1][1]):
+            lines.append(f"{phase:<10} {count:>8} {total * 1000:>12.1f} {total * 1000 / count:>10.2f} "
+                         f"{longest * 1000:>10.2f}")
+        for counter, value in sorted(self.counters.items()):
+            lines.append(f"{counter:<30} {value:>12}")
+        for name, peak in sorted(self.peaks.items()):
+            lines.append(f"{name + ' (peak)':<30} {peak:>12}")
+        return '\n'.join(lines)
+
+
+class NullTracer(Tracer):
+    """The default tracer, which records nothing. Spans are a shared no-op so untraced resolves pay almost nothing."""
+
+    enabled = False
+
+    def span(self, phase: str, **args):
+        return _NULL_SPAN
+
+    def count(self, counter: str, value: int = 1):
+        pass
+
+    def gauge(self, name: str, value: float):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+_current_tracer: contextvars.ContextVar = contextvars.ContextVar('snek_tracer', default=NULL_TRACER)
+
+
+def current_tracer() -> Tracer:
+    return _current_tracer.get()
+
+
+@contextmanager
+def tracing(tracer: Optional[Tracer]) -> Iterator[Tracer]:
+    """Report to tracer for the rest of this context, including the threads and tasks it starts."""
+    if tracer is None:
+        yield current_tracer()
+        return
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
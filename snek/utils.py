@@ -1,10 +1,18 @@
-from concurrent.futures import as_completed
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import as_completed, Future, TimeoutError
 from concurrent.futures.thread import ThreadPoolExecutor
-from typing import Union
+from contextlib import contextmanager
+from typing import Union, Dict, Hashable, Optional, Iterator
 
 from packaging.version import Version, LegacyVersion, InvalidVersion
 
 
+# Version objects are immutable, so the same few thousand version strings can share one parsed instance each
+@functools.lru_cache(maxsize=65536)
 def convert_to_version(version: str) -> Union[Version, LegacyVersion]:
     try:
         return Version(version)
@@ -12,13 +20,154 @@ def convert_to_version(version: str) -> Union[Version, LegacyVersion]:
         return LegacyVersion(version)
 
 
+class OperationCancelled(RuntimeError):
+    pass
+
+
+class DeadlineExceeded(OperationCancelled):
+    pass
+
+
+class CancelScope:
+    """
+    Cooperative cancellation for a subtree of work. Cancelling a scope cancels every scope nested inside it, and a
+    nested scope's deadline is never later than its parent's.
+    """
+
+    def __init__(self, parent: Optional['CancelScope'] = None, timeout: Optional[float] = None):
+        self._parent = parent
+        self._cancelled = threading.Event()
+        self.deadline: Optional[float] = time.monotonic() + timeout if timeout is not None else None
+        if parent is not None and parent.deadline is not None:
+            self.deadline = parent.deadline if self.deadline is None else min(self.deadline, parent.deadline)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or (self._parent is not None and self._parent.cancelled)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, or None if there isn't one."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def check(self):
+        if self.cancelled:
+            raise OperationCancelled
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise DeadlineExceeded
+
+
+_current_scope: contextvars.ContextVar = contextvars.ContextVar('snek_cancel_scope', default=None)
+
+
+def current_scope() -> Optional[CancelScope]:
+    return _current_scope.get()
+
+
+@contextmanager
+def cancel_scope(timeout: Optional[float] = None) -> Iterator[CancelScope]:
+    scope = CancelScope(current_scope(), timeout)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def check_cancelled():
+    scope = current_scope()
+    if scope is not None:
+        scope.check()
+
+
+def remaining_time(default: Optional[float] = None) -> Optional[float]:
+    """The smaller of default and the time left in the current scope, raising if there's no time left at all."""
+    check_cancelled()
+    scope = current_scope()
+    remaining = scope.remaining() if scope is not None else None
+    if remaining is None:
+        return default
+    return remaining if default is None else min(remaining, default)
+
+
+def wait_for(future: Future, poll_interval: float = 0.1):
+    """Wait for a future while checking the current scope, so cancelled work doesn't wait on someone else's call."""
+    while True:
+        try:
+            return future.result(timeout=remaining_time(poll_interval))
+        except TimeoutError:
+            check_cancelled()
+
+
 def parallel_map(function, iterable):
     results = []
-    with ThreadPoolExecutor() as executor:
-        futures = {executor.submit(function, item) for item in iterable}
-        for future in as_completed(futures):
-            if future.exception():
-                raise future.exception()
-            else:
-                results.append(future.result())
+    executor = ThreadPoolExecutor()
+    # Every job runs in its own copy of a scope shared by its siblings, so one failure can stop all of them
+    with cancel_scope() as scope:
+        futures = {executor.submit(contextvars.copy_context().run, function, item) for item in iterable}
+        try:
+            for future in as_completed(futures, timeout=scope.remaining()):
+                if future.exception():
+                    raise future.exception()
+                else:
+                    results.append(future.result())
+        except BaseException as e:
+            # Jobs that haven't started never will, and running ones bail out at their next check
+            scope.cancel()
+            [future.cancel() for future in futures]
+            executor.shutdown(wait=False)
+            if isinstance(e, TimeoutError):
+                raise DeadlineExceeded from e
+            raise
+    executor.shutdown()
     return results
+
+
+async def gather_or_cancel(*awaitables):
+    """Like asyncio.gather, but if one awaitable fails the rest are cancelled instead of left running."""
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        [task.cancel() for task in tasks]
+        raise
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one call whose result is shared by every caller."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, function, *args):
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._calls[key] = future
+            if leader:
+                break
+            try:
+                return wait_for(future)
+            except OperationCancelled:
+                # The leader's scope being cancelled is no reason for this caller to fail, unless its own is too
+                check_cancelled()
+
+        try:
+            result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,78 @@
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Tuple, Union, Optional
+
+from packaging.specifiers import SpecifierSet, Specifier
+from packaging.version import Version, LegacyVersion
+
+from snek import utils
+
+AnyVersion = Union[Version, LegacyVersion]
+
+
+class VersionIndex:
+    """
+    Sorted, parsed list of a project's releases. Specifier queries narrow the candidates down with binary searches on
+    the range operators, then apply the full specifier (for !=, wildcards, prereleases and so on) to what's left.
+    Results are memoized per specifier.
+    """
+
+    def __init__(self, versions: Iterable[Union[str, AnyVersion]]):
+        parsed = (v if isinstance(v, (Version, LegacyVersion)) else utils.convert_to_version(v) for v in versions)
+        self.versions: List[AnyVersion] = sorted(set(parsed))
+        self._results: Dict[Tuple[str, Optional[bool]], List[AnyVersion]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.versions)
+
+    def __contains__(self, version: AnyVersion) -> bool:
+        i = bisect_left(self.versions, version)
+        return i < len(self.versions) and self.versions[i] == version
+
+    def filter(self, specifier: SpecifierSet) -> List[AnyVersion]:
+        key = (str(specifier), specifier.prereleases)
+        with self._lock:
+            result = self._results.get(key)
+        if result is not None:
+            return result
+
+        if len(specifier) > 0:
+            low, high = self.bounds(specifier)
+            result = list(specifier.filter(self.versions[low:high]))
+        else:
+            # An empty specifier falls back to prereleases if there are no final releases, so it needs everything
+            result = list(specifier.filter(self.versions))
+        with self._lock:
+            self._results[key] = result
+        return result
+
+    def bounds(self, specifier: SpecifierSet) -> Tuple[int, int]:
+        """Find a slice of the index that contains every version the specifier could match."""
+        low, high = 0, len(self.versions)
+        for spec in specifier:
+            # Arbitrary equality (===) compares strings, which needn't be versions at all
+            if not isinstance(spec, Specifier) or spec.operator == '===' or spec.version.endswith('.*'):
+                continue
+            version = Version(spec.version)
+            if spec.operator in ('>=', '~='):
+                low = max(low, bisect_left(self.versions, version))
+            elif spec.operator == '>':
+                low = max(low, bisect_right(self.versions, version))
+            elif spec.operator == '<':
+                high = min(high, bisect_left(self.versions, version))
+            elif spec.operator == '<=':
+                high = min(high, self._end_of(version))
+            elif spec.operator == '==':
+                low = max(low, bisect_left(self.versions, version))
+                high = min(high, self._end_of(version))
+        return low, max(low, high)
+
+    def _end_of(self, version: Version) -> int:
+        # Local versions (1.0+local) sort right after their public version, and <= / == still match them
+        end = bisect_right(self.versions, version)
+        public = Version(version.public)
+        while end < len(self.versions) and isinstance(self.versions[end], Version) \
+                and self.versions[end].local is not None and Version(self.versions[end].public) == public:
+            end += 1
+        return end
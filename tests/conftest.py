@@ -1,12 +1,45 @@
 import json
 import os
 
+from packaging.version import Version
+
 
 def load_fixture(filename):
     with open(os.path.join(os.path.dirname(__file__), 'fixtures', filename), 'r') as f:
         return f.read()
 
 
+FLASK_GRAPH = json.loads(load_fixture('resolver/Flask_dependency_graph.json'))
+FLASK_ALL_EXTRAS_GRAPH = json.loads(load_fixture('resolver/Flask[dev, docs, test]_dependency_graph.json'))
+FLASK_VERSIONS = {'Flask': Version('1.1.1'), 'Werkzeug': Version('0.16.0'), 'Jinja2': Version('2.10.3'),
+                  'MarkupSafe': Version('1.1.1'), 'itsdangerous': Version('1.1.0'), 'click': Version('7.0')}
+
+
 def mock_repository_json(mocker):
     mocker.patch('snek.repository.Repository.get_package_info',
                  side_effect=lambda name, version=None: json.loads(load_fixture(f"pypi/pypi_{name.lower()}.json")))
+    mocker.patch('snek.repository.Repository.get_package_releases',
+                 side_effect=lambda name: json.loads(load_fixture(f"pypi/pypi_{name.lower()}.json"))['releases'])
+
+
+def mock_response(mocker, status_code=200, document=None, headers=None):
+    response = mocker.Mock(status_code=status_code, headers=headers or {})
+    response.__bool__ = lambda self: status_code < 400
+    response.iter_content.return_value = [json.dumps(document).encode('utf-8')]
+    return response
+
+
+def install(site_packages, name, version, requires=(), kind='dist-info'):
+    headers = f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+    if kind == 'dist-info':
+        headers += ''.join(f"Requires-Dist: {requirement}\n" for requirement in requires)
+        path = site_packages / f"{name}-{version}.dist-info"
+        path.mkdir()
+        (path / 'METADATA').write_text(headers + '\nA long description.\nRequires-Dist: not-a-header\n')
+    elif kind == 'egg-info':
+        path = site_packages / f"{name}-{version}-py3.8.egg-info"
+        path.mkdir()
+        (path / 'PKG-INFO').write_text(headers)
+        (path / 'requires.txt').write_text('\n'.join(requires) + '\n')
+    else:
+        (site_packages / f"{name}-{version}-py3.8.egg-info").write_text(headers)
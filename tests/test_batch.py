@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from snek.batch import BatchResolver, ManifestResult
+from snek.repository import Repository
+from snek.requirement import Requirement
+from tests.conftest import mock_repository_json, FLASK_VERSIONS
+
+FLASK_PINS = {name: str(version) for name, version in FLASK_VERSIONS.items()}
+
+
+class TestBatchResolver:
+    def test_shared_resolve(self, mocker):
+        mock_repository_json(mocker)
+        get_package_info = mocker.spy(Repository, 'get_package_info')
+        manifests = {f"service{i}": [Requirement('Flask'), Requirement('click')] for i in range(20)}
+        results = BatchResolver(processes=0).resolve(manifests)
+
+        assert results['service0'] == ManifestResult(FLASK_PINS)
+        assert results['service19'] == results['service0']
+        # Twenty copies of a manifest cost the same as one
+        calls = get_package_info.call_count
+        get_package_info.reset_mock()
+        BatchResolver(processes=0).resolve({'service': manifests['service0']})
+        assert get_package_info.call_count == calls
+
+    def test_process_pool(self, mocker):
+        mock_repository_json(mocker)
+        manifests = {'flask': [Requirement('Flask')], 'werkzeug': [Requirement('Werkzeug<0.16')],
+                     'both': [Requirement('Flask'), Requirement('Werkzeug<0.16')]}
+        results = BatchResolver(processes=2).resolve(manifests)
+        assert results['flask'].pins == FLASK_PINS
+        assert results['werkzeug'].pins['Werkzeug'].startswith('0.15')
+        assert results['both'].pins['Werkzeug'] == results['werkzeug'].pins['Werkzeug']
+
+    def test_failures_are_per_manifest(self, mocker):
+        mock_repository_json(mocker)
+        results = BatchResolver(processes=0).resolve({
+            'docs': [Requirement('Sphinx')],
+            'conflict': [Requirement('Flask'), Requirement('Werkzeug<0.15')],
+            'missing': [Requirement('Flask'), Requirement('not-a-project')],
+            'ok': [Requirement('Flask')],
+        })
+        assert results['conflict'].pins is None and 'ReductionError' in results['conflict'].error
+        assert results['missing'].pins is None and 'not-a-project' in results['missing'].error
+        assert results['ok'].pins == FLASK_PINS
+        assert results['docs'].pins['Sphinx'] == '2.2.1'
+
+    def test_write(self, tmp_path):
+        manifest = str(tmp_path / 'requirements.txt')
+        BatchResolver.write({manifest: ManifestResult({'Flask': '1.1.1'}),
+                             str(tmp_path / 'broken.txt'): ManifestResult(None, 'error')})
+        with open(f"{manifest}.pins.json") as f:
+            assert json.load(f) == {'Flask': '1.1.1'}
+        assert not (tmp_path / 'broken.txt.pins.json').exists()
+
+    def test_failed_write_leaves_nothing_behind(self, tmp_path):
+        with pytest.raises(TypeError):
+            BatchResolver.write({str(tmp_path / 'requirements.txt'): ManifestResult({'Flask': object()})})
+        assert not list(tmp_path.iterdir())
@@ -0,0 +1,105 @@
+import os
+import time
+
+from packaging.version import Version
+
+from snek.cache import DiskCache, CacheEntry, MemoryCache
+from snek.repository import Repository
+from tests.conftest import mock_response
+
+
+class TestDiskCache:
+    def test_round_trip(self, tmp_path):
+        cache = DiskCache(str(tmp_path))
+        key = ('https://pypi.org/pypi', 'flask', None)
+        assert cache.get(key) is None
+        cache.set(key, CacheEntry({'info': {}}, etag='"abc"', fetched_at=time.time()))
+        entry = cache.get(key)
+        assert entry.document == {'info': {}}
+        assert entry.etag == '"abc"'
+        assert cache.is_fresh(entry)
+        # Other processes see the same entry
+        assert DiskCache(str(tmp_path)).get(key) == entry
+
+    def test_ttl(self, tmp_path):
+        cache = DiskCache(str(tmp_path), ttl=60)
+        assert cache.is_fresh(CacheEntry({}, fetched_at=time.time()))
+        assert not cache.is_fresh(CacheEntry({}, fetched_at=time.time() - 120))
+
+    def test_corrupt_entry(self, tmp_path):
+        cache = DiskCache(str(tmp_path))
+        key = ('https://pypi.org/pypi', 'flask', None)
+        path = cache.path_for(key)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('{"document": ')
+        assert cache.get(key) is None
+        assert not os.path.exists(path)
+
+    def test_lru_eviction(self, tmp_path):
+        document = {'data': 'x' * 1000}
+        cache = DiskCache(str(tmp_path), max_size=3500)
+        keys = [('url', f"project{i}", None) for i in range(3)]
+        for i, key in enumerate(keys):
+            cache.set(key, CacheEntry(document))
+            os.utime(cache.path_for(key), (i, i))
+        # Touch the oldest entry so the second one becomes least recently used
+        cache.get(keys[0])
+        cache.set(('url', 'project3', None), CacheEntry(document))
+        assert cache.get(keys[0]) is not None
+        assert cache.get(keys[1]) is None
+        assert cache.size() <= 3500
+
+    def test_overwrite_keeps_size(self, mocker, tmp_path):
+        document = {'data': 'x' * 1000}
+        cache = DiskCache(str(tmp_path), max_size=3500)
+        keys = [('url', f"project{i}", None) for i in range(3)]
+        for key in keys:
+            cache.set(key, CacheEntry(document))
+        evict = mocker.spy(cache, 'evict')
+        for _ in range(5):
+            cache.set(keys[0], CacheEntry(document))
+        # Rewriting a key doesn't grow the cache, so it never went over the limit
+        assert evict.call_count == 0
+        assert all(cache.get(key) is not None for key in keys)
+
+
+class TestMemoryCache:
+    def test_lru_eviction(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set(('url', 'a', None), CacheEntry({}))
+        cache.set(('url', 'b', None), CacheEntry({}))
+        cache.get(('url', 'a', None))
+        cache.set(('url', 'c', None), CacheEntry({}))
+        assert cache.get(('url', 'a', None)) is not None
+        assert cache.get(('url', 'b', None)) is None
+
+
+class TestCachedRepository:
+    def test_revalidation(self, mocker, tmp_path):
+        repo = Repository(cache=DiskCache(str(tmp_path), ttl=0))
+        document = {'info': {'version': '1.0', 'requires_dist': None}, 'releases': {}}
+        get = mocker.patch.object(repo.session, 'get',
+                                  return_value=mock_response(mocker, document=document, headers={'ETag': '"v1"'}))
+        assert repo.get_package_info('Flask') == document
+
+        get.return_value = mock_response(mocker, status_code=304)
+        assert repo.get_package_info('Flask') == document
+        assert get.call_args.kwargs['headers'] == {'If-None-Match': '"v1"'}
+        assert get.call_count == 2
+
+    def test_fresh_entries_are_not_fetched(self, mocker, tmp_path):
+        repo = Repository(cache=DiskCache(str(tmp_path)))
+        document = {'info': {'version': '1.0', 'requires_dist': None}, 'releases': {}}
+        get = mocker.patch.object(repo.session, 'get', return_value=mock_response(mocker, document=document))
+        repo.get_package_info('Flask')
+        repo.get_package_info('flask')
+        assert get.call_count == 1
+
+    def test_pinned_versions_are_never_revalidated(self, mocker, tmp_path):
+        repo = Repository(cache=DiskCache(str(tmp_path), ttl=0), simple_url='')
+        document = {'info': {'version': '1.0', 'requires_dist': None}, 'releases': {}}
+        get = mocker.patch.object(repo.session, 'get', return_value=mock_response(mocker, document=document))
+        repo.get_package_info('Flask', Version('1.0'))
+        repo.get_package_info('Flask', Version('1.0'))
+        assert get.call_count == 1
@@ -0,0 +1,102 @@
+import subprocess
+import time
+
+import pytest
+
+from snek.install import InstallError, InstallExecutor, InstallPlan, InstallStep
+from snek.reducer import Reducer
+from snek.requirement import Requirement
+from snek.resolver import Resolver, FINISHED
+from tests.conftest import mock_repository_json, FLASK_VERSIONS
+
+
+def mock_pip(mocker, failing=()):
+    installs = []
+
+    def run(command, **kwargs):
+        name, version = command[-1].split('==')
+        installs.append((name, version))
+        return subprocess.CompletedProcess(command, 1 if name in failing else 0, '', f"No wheel for {name}")
+
+    mocker.patch('snek.install.subprocess.run', side_effect=run)
+    return installs
+
+
+def flask_plan(mocker) -> InstallPlan:
+    mock_repository_json(mocker)
+    graph = Resolver().resolve(Requirement('Flask'))
+    return InstallPlan.from_graph(graph, Reducer.reduce(graph))
+
+
+class TestInstallPlan:
+    def test_from_graph(self, mocker):
+        plan = flask_plan(mocker)
+        assert plan.steps['Flask'] == InstallStep('Flask', '1.1.1', frozenset({'Werkzeug', 'Jinja2', 'itsdangerous',
+                                                                               'click'}))
+        assert plan.steps['Jinja2'].dependencies == {'MarkupSafe'}
+        assert [[step.name for step in level] for level in plan.levels()] == [
+            ['MarkupSafe', 'Werkzeug', 'click', 'itsdangerous'], ['Jinja2'], ['Flask']]
+
+    def test_cycle(self):
+        plan = InstallPlan({'a': InstallStep('a', '1', frozenset({'b'})),
+                            'b': InstallStep('b', '1', frozenset({'a', 'c'})),
+                            'c': InstallStep('c', '1', frozenset())})
+        assert [step.name for step in plan.order()] == ['c', 'a', 'b']
+
+
+class TestInstallExecutor:
+    def test_command(self):
+        assert InstallExecutor('wheels', python='python').command('Flask', '1.1.1') == [
+            'python', '-m', 'pip', 'install', '--no-deps', '--no-index', '--find-links', 'wheels', 'Flask==1.1.1']
+
+    def test_install(self, mocker):
+        installs = mock_pip(mocker)
+        plan = flask_plan(mocker)
+        installed = InstallExecutor('wheels').install(plan)
+        assert installed == {name: str(version) for name, version in FLASK_VERSIONS.items()}
+        order = [name for name, _ in installs]
+        for step in plan.steps.values():
+            assert all(order.index(dependency) < order.index(step.name) for dependency in step.dependencies)
+
+    def test_failure_skips_dependents(self, mocker):
+        installs = mock_pip(mocker, failing={'MarkupSafe'})
+        with pytest.raises(InstallError, match='No wheel for MarkupSafe'):
+            InstallExecutor('wheels').install(flask_plan(mocker))
+        assert {name for name, _ in installs} == {'MarkupSafe', 'Werkzeug', 'click', 'itsdangerous'}
+
+    def test_run_while_resolving(self, mocker):
+        installs = mock_pip(mocker)
+        mock_repository_json(mocker)
+        installed = InstallExecutor('wheels').run(Resolver().stream({Requirement('Flask')}))
+        assert installed == {name: str(version) for name, version in FLASK_VERSIONS.items()}
+        # The best candidates were the pins, so nothing had to be installed twice
+        assert sorted(installs) == sorted(installed.items())
+
+    def test_run_waits_for_pins(self, mocker):
+        installs = mock_pip(mocker)
+        mock_repository_json(mocker)
+        installed = InstallExecutor('wheels').run(
+            Resolver().stream({Requirement('Flask'), Requirement('Werkzeug<0.16')}))
+        assert installed['Werkzeug'].startswith('0.15')
+        # Werkzeug's best candidate under Flask alone was 0.16, which was never installed
+        assert sorted(installs) == sorted(installed.items())
+
+    def test_run_installs_stable_pins_while_resolving(self, mocker):
+        installs = mock_pip(mocker)
+        mock_repository_json(mocker)
+        pinned = {'MarkupSafe', 'Jinja2', 'click'}
+        events = Resolver().stream({Requirement('Flask')} | {Requirement(f"{name}=={FLASK_VERSIONS[name]}")
+                                                             for name in pinned})
+
+        def until_finished():
+            for event in events:
+                if event.kind == FINISHED:
+                    # Let the installs started so far finish, then check which there were
+                    time.sleep(0.1)
+                    started.update(name for name, _ in installs)
+                yield event
+
+        started = set()
+        installed = InstallExecutor('wheels').run(until_finished())
+        assert started == pinned
+        assert sorted(installs) == sorted(installed.items())
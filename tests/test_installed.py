@@ -0,0 +1,77 @@
+import os
+
+from snek.installed import InstalledIndex, _convert_requires_txt
+from snek.repository import Repository
+from snek.requirement import Requirement
+from snek.resolver import Resolver
+from tests.conftest import mock_repository_json, install
+
+FLASK_CLOSURE = [
+    ('Flask', '1.1.1', ['Werkzeug>=0.15', 'Jinja2>=2.10.1', 'itsdangerous>=0.24', 'click>=5.1',
+                        'python-dotenv; extra == "dotenv"']),
+    ('Werkzeug', '0.16.0', []), ('Jinja2', '2.10.3', ['MarkupSafe>=0.23']), ('MarkupSafe', '1.1.1', []),
+    ('itsdangerous', '1.1.0', []), ('click', '7.0', []),
+]
+
+
+class TestInstalledIndex:
+    def test_scan(self, tmp_path):
+        install(tmp_path, 'Flask', '1.1.1', ['click>=5.1', 'Jinja2>=2.10.1'])
+        install(tmp_path, 'zope.interface', '5.0', ['setuptools', '[test]', 'coverage'], kind='egg-info')
+        install(tmp_path, 'six', '1.15.0', kind='egg-file')
+        (tmp_path / 'six.py').write_text('')
+        index = InstalledIndex([str(tmp_path)])
+        assert len(index) == 3
+        assert index.get('flask').version == '1.1.1'
+        assert index.get('flask').requires_dist == ['click>=5.1', 'Jinja2>=2.10.1']
+        assert index.get('Zope_Interface').requires_dist == ['setuptools', 'coverage; extra == "test"']
+        assert index.get('six').requires_dist is None
+        assert 'requests' not in index
+
+    def test_first_directory_wins(self, tmp_path):
+        first, second = tmp_path / 'first', tmp_path / 'second'
+        first.mkdir()
+        second.mkdir()
+        install(first, 'click', '7.0')
+        install(second, 'click', '6.0')
+        assert InstalledIndex([str(first), str(second)]).get('click').version == '7.0'
+
+    def test_refresh(self, tmp_path, mocker):
+        install(tmp_path, 'click', '7.0')
+        index = InstalledIndex([str(tmp_path)])
+        scan = mocker.spy(InstalledIndex, '_scan')
+        index.refresh()
+        assert scan.call_count == 0
+
+        install(tmp_path, 'six', '1.15.0')
+        os.utime(tmp_path, ns=(0, 0))
+        index.refresh()
+        assert scan.call_count == 1
+        assert 'six' in index
+
+    def test_requires_txt(self):
+        assert _convert_requires_txt(['requests', '', '[socks]', 'PySocks!=1.5.7', '[:sys_platform == "win32"]',
+                                      'colorama', '[docs:python_version < "3"]', 'sphinx<2']) == [
+            'requests', 'PySocks!=1.5.7; extra == "socks"', 'colorama; sys_platform == "win32"',
+            'sphinx<2; (python_version < "3") and extra == "docs"']
+
+
+class TestInstalledResolve:
+    def test_resolved_locally(self, mocker, tmp_path):
+        for name, version, requires in FLASK_CLOSURE:
+            install(tmp_path, name, version, requires)
+        get_package_info = mocker.patch('snek.repository.Repository.get_package_info')
+        resolver = Resolver(installed=InstalledIndex([str(tmp_path)]))
+        graph = resolver.resolve(Requirement('Flask>=1.0'), stringify_keys=True)
+        assert graph == {'Flask>=1.0': {'Werkzeug>=0.15': {}, 'Jinja2>=2.10.1': {'MarkupSafe>=0.23': {}},
+                                        'itsdangerous>=0.24': {}, 'click>=5.1': {}}}
+        assert get_package_info.call_count == 0
+
+    def test_unsatisfied_requirements_use_the_index(self, mocker, tmp_path):
+        mock_repository_json(mocker)
+        install(tmp_path, 'click', '6.0')
+        get_package_info = mocker.spy(Repository, 'get_package_info')
+        resolver = Resolver(installed=InstalledIndex([str(tmp_path)]))
+        graph = resolver.resolve(Requirement('click>=7'))
+        assert next(iter(graph)).best_candidate_version.public == '7.0'
+        assert get_package_info.call_count == 1
@@ -0,0 +1,97 @@
+import json
+import sys
+
+from snek.lockfile import LockFile
+from snek.reducer import Reducer
+from snek.repository import Repository
+from snek.requirement import Requirement
+from snek.resolver import Resolver
+from tests.conftest import mock_repository_json, load_fixture, FLASK_GRAPH
+
+FLASK_DEV_GRAPH = json.loads(load_fixture('resolver/Flask[dev]_dependency_graph.json'))
+
+
+class TestLockFile:
+    def test_round_trip(self, mocker, tmp_path):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve(Requirement('Flask'))
+        pins = Reducer.reduce(graph)
+        LockFile.from_graph(graph, pins).dump(str(tmp_path / 'snek.lock'))
+
+        lock_file = LockFile.load(str(tmp_path / 'snek.lock'))
+        assert lock_file.pins == {name: str(version) for name, version in pins.items()}
+        assert lock_file.is_locked(Requirement('Flask'))
+        assert not lock_file.is_locked(Requirement('Flask>=1.0'))
+
+        root = lock_file.load_requirement(Requirement('Flask'))
+        assert Resolver.to_graph(root, stringify_keys=True) == FLASK_GRAPH
+        assert Reducer.reduce(Resolver.to_graph(root)) == pins
+
+    def test_records_incompatible_dependencies(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve(Requirement('Flask[dev]'))
+        lock_file = LockFile.from_graph(graph, Reducer.reduce(graph))
+        nodes = [lock_file.roots['Flask[dev]']['graph']]
+        for node in nodes:
+            nodes.extend(node['requires'])
+        colorama = [node for node in nodes if node['requirement'].startswith('colorama')]
+        assert colorama
+        # Markers are evaluated against the current environment, but the dependency is recorded either way
+        assert all(node['compatible'] == (sys.platform == 'win32') for node in colorama)
+
+    def test_unchanged_roots_are_not_resolved(self, mocker, tmp_path):
+        mock_repository_json(mocker)
+        path = str(tmp_path / 'snek.lock')
+        Resolver().lock({Requirement('Flask')}, path)
+
+        get_package_info = mocker.spy(Repository, 'get_package_info')
+        lock_file = Resolver().lock({Requirement('Flask')}, path)
+        assert get_package_info.call_count == 0
+        assert 'Flask' in lock_file.pins
+
+        graph = Resolver().resolve_locked({Requirement('Flask')}, lock_file, stringify_keys=True)
+        assert graph == FLASK_GRAPH
+        assert get_package_info.call_count == 0
+
+    def test_changed_roots_reuse_locked_subtrees(self, mocker, tmp_path):
+        mock_repository_json(mocker)
+        path = str(tmp_path / 'snek.lock')
+        Resolver().lock({Requirement('Flask')}, path)
+
+        get_package_info = mocker.spy(Repository, 'get_package_info')
+        resolver = Resolver()
+        graph = resolver.resolve_locked({Requirement('Flask'), Requirement('Flask[dev]')}, LockFile.load(path),
+                                        stringify_keys=True)
+        assert graph == {**FLASK_GRAPH, **FLASK_DEV_GRAPH}
+        fetched = {call.args[0].lower() for call in get_package_info.call_args_list}
+        # Flask's own dependencies came from the lock file
+        assert fetched.isdisjoint({'werkzeug', 'markupsafe', 'itsdangerous', 'click'})
+        lock_file = resolver.lock({Requirement('Flask'), Requirement('Flask[dev]')}, path)
+        assert set(lock_file.roots) == {'Flask', 'Flask[dev]'}
+
+    def test_hints(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve(Requirement('Flask'))
+        hints = LockFile.from_graph(graph, Reducer.reduce(graph)).hints()
+        assert set(hints) == {'flask', 'werkzeug', 'jinja2', 'markupsafe', 'itsdangerous', 'click'}
+        assert hints['jinja2'] == ['MarkupSafe>=0.23']
+        assert hints['click'] == []
+
+    def test_edited_roots_are_not_locked(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve(Requirement('Flask'))
+        lock_file = LockFile.from_graph(graph, Reducer.reduce(graph))
+        assert lock_file.is_locked(Requirement('Flask'))
+        lock_file.roots['Flask']['graph']['requires'][0]['version'] = '0.1'
+        assert not lock_file.is_locked(Requirement('Flask'))
+        assert lock_file.load_requirement(Requirement('Flask')) is None
+
+    def test_deep_graph(self):
+        depth = sys.getrecursionlimit() + 100
+        root = node = Requirement('p0')
+        for i in range(1, depth):
+            child = Requirement.parse(f"p{i}", parent=node)
+            node.add_sub_requirement(child)
+            node = child
+        lock_file = LockFile.from_graph(Resolver.to_graph(root), {})
+        assert len(lock_file.load_requirement(Requirement('p0')).graph) == depth
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+from packaging.markers import Marker
+
+from snek.markers import compile_marker, target_environment, marker_to_json, marker_from_json
+
+
+class TestMarkerPredicate:
+    def test_variables(self):
+        predicate = compile_marker('os_name == "nt" and python_version < "3.8" or extra == "python_version"')
+        assert predicate.variables == ('extra', 'os_name', 'python_version')
+
+    def test_memoized_per_variable_values(self, mocker):
+        predicate = compile_marker('python_version < "3.8"')
+        evaluate = mocker.spy(predicate.marker, 'evaluate')
+        assert predicate(target_environment('3.7', 'linux'))
+        assert predicate(target_environment('3.7', 'windows'))
+        assert not predicate(target_environment('3.9', 'macos'))
+        assert evaluate.call_count <= 2
+
+    def test_compiled_once(self):
+        assert compile_marker('sys_platform == "win32"') is compile_marker('sys_platform == "win32"')
+
+    def test_extras(self):
+        assert compile_marker('extra == "dev" or \'docs\' == extra').extras == {'dev', 'docs'}
+        assert compile_marker('python_version < "3.8" and extra == "test"').extras == {'test'}
+        assert not compile_marker('python_version < "3.8"').extras
+
+    def test_json(self):
+        marker = Marker('python_version < "3.8" and (extra == "dev" or platform_system != "Windows")')
+        loaded = marker_from_json(json.loads(json.dumps(marker_to_json(marker))))
+        assert str(loaded) == str(marker)
+        environment = {'python_version': '3.7', 'extra': '', 'platform_system': 'Linux'}
+        assert loaded.evaluate(environment) == marker.evaluate(environment) is True
+
+
+class TestTargetEnvironment:
+    def test_platforms(self):
+        environment = target_environment('3.8', 'windows')
+        assert environment['python_version'] == '3.8'
+        assert environment['python_full_version'] == '3.8.0'
+        assert environment['sys_platform'] == 'win32'
+        assert target_environment('3.9.1', 'macos')['python_full_version'] == '3.9.1'
+
+    def test_unknown_platform(self):
+        with pytest.raises(ValueError):
+            target_environment('3.8', 'beos')
@@ -0,0 +1,109 @@
+import glob
+import hashlib
+import json
+import os
+
+import pytest
+
+from snek.metadata import parse_package_info, parse_project_index, parse_core_metadata, MetadataParseError, \
+    STREAMING_THRESHOLD
+
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'fixtures', 'pypi', '*.json')))
+
+
+def chunked(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestParsePackageInfo:
+    @pytest.mark.parametrize('path', FIXTURES, ids=os.path.basename)
+    @pytest.mark.parametrize('threshold', [0, STREAMING_THRESHOLD], ids=['streamed', 'decoded'])
+    def test_matches_full_parse(self, mocker, path, threshold):
+        mocker.patch('snek.metadata.STREAMING_THRESHOLD', threshold)
+        with open(path, 'rb') as f:
+            data = f.read()
+        document = json.loads(data)
+        expected = {'info': {'version': document['info']['version'],
+                             'requires_dist': document['info']['requires_dist']},
+                    'releases': {release: [] for release in document['releases']}}
+        for size in (61, 4096, len(data)):
+            assert parse_package_info(chunked(data, size)) == expected
+
+    def test_escapes_and_unicode_across_chunks(self, mocker):
+        mocker.patch('snek.metadata.STREAMING_THRESHOLD', 0)
+        document = {'urls': [{'comment_text': 'a "quoted" ]} \\ bracket'}],
+                    'info': {'summary': '{[', 'version': '1.0é', 'requires_dist': ['café ; extra == "x"']},
+                    'releases': {'0.1': [{'digests': {'md5': 'x'}}], '1.0é': []}}
+        data = json.dumps(document, ensure_ascii=False).encode('utf-8')
+        for size in range(1, 8):
+            assert parse_package_info(chunked(data, size)) == {
+                'info': {'version': '1.0é', 'requires_dist': ['café ; extra == "x"']},
+                'releases': {'0.1': [], '1.0é': []}}
+
+    @pytest.mark.parametrize('threshold', [0, STREAMING_THRESHOLD], ids=['streamed', 'decoded'])
+    def test_truncated_document(self, mocker, threshold):
+        mocker.patch('snek.metadata.STREAMING_THRESHOLD', threshold)
+        data = b'{"info": {"version": "1.0"}, "releases": {"1.0": [{"url": "http'
+        with pytest.raises(MetadataParseError):
+            parse_package_info(chunked(data, 10))
+
+
+PROJECT_INDEX = {
+    'meta': {'api-version': '1.1'},
+    'name': 'flask',
+    'files': [
+        {'filename': 'Flask-1.0.tar.gz', 'url': 'https://files/Flask-1.0.tar.gz', 'hashes': {}},
+        {'filename': 'Flask-1.0-cp38-cp38-manylinux1_x86_64.whl', 'url': 'https://files/platform.whl',
+         'hashes': {}, 'core-metadata': {'sha256': 'a'}},
+        {'filename': 'Flask-1.0-py2.py3-none-any.whl', 'url': 'https://files/any.whl', 'hashes': {},
+         'core-metadata': {'sha256': 'b'}},
+        {'filename': 'Flask-1.1.0-py3-none-any.whl', 'url': 'https://files/legacy.whl', 'hashes': {},
+         'data-dist-info-metadata': True},
+        {'filename': 'Flask-1.2-py3-none-any.whl', 'url': 'https://files/none.whl', 'hashes': {},
+         'core-metadata': False},
+    ],
+    'versions': ['1.0', '1.1.0', '1.2'],
+}
+
+
+class TestParseProjectIndex:
+    @pytest.mark.parametrize('threshold', [0, STREAMING_THRESHOLD], ids=['streamed', 'decoded'])
+    def test_versions_and_metadata_files(self, mocker, threshold):
+        mocker.patch('snek.metadata.STREAMING_THRESHOLD', threshold)
+        data = json.dumps(PROJECT_INDEX).encode('utf-8')
+        for size in (7, len(data)):
+            assert parse_project_index(chunked(data, size)) == {
+                'versions': ['1.0', '1.1.0', '1.2'],
+                'metadata': {'1.0': {'url': 'https://files/any.whl', 'hashes': {'sha256': 'b'}},
+                             '1.1.0': {'url': 'https://files/legacy.whl', 'hashes': {}}}}
+
+    def test_without_versions(self):
+        data = json.dumps({'meta': {'api-version': '1.0'}, 'files': []}).encode('utf-8')
+        assert parse_project_index([data]) == {'versions': None, 'metadata': {}}
+
+
+CORE_METADATA = b"""Metadata-Version: 2.1
+Name: Flask
+Version: 1.0
+Requires-Dist: Werkzeug (>=0.14)
+Requires-Dist: click>=5.1
+Requires-Dist: pytest>=3; extra == 'dev'
+
+Flask is a microframework.
+"""
+
+
+class TestParseCoreMetadata:
+    def test_fields(self):
+        assert parse_core_metadata(CORE_METADATA, {'sha256': hashlib.sha256(CORE_METADATA).hexdigest()}) == {
+            'info': {'version': '1.0',
+                     'requires_dist': ['Werkzeug (>=0.14)', 'click>=5.1', "pytest>=3; extra == 'dev'"]},
+            'releases': {}}
+
+    def test_no_dependencies(self):
+        assert parse_core_metadata(b'Metadata-Version: 2.1\nName: six\nVersion: 1.0\n')['info'] == \
+               {'version': '1.0', 'requires_dist': None}
+
+    def test_hash_mismatch(self):
+        with pytest.raises(MetadataParseError):
+            parse_core_metadata(CORE_METADATA, {'sha256': hashlib.sha256(b'other').hexdigest()})
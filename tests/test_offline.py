@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from snek.offline import DirectoryRepository, SnapshotRepository, SnapshotError, snapshot
+from snek.repository import Repository, PackageNotFoundError
+from snek.requirement import Requirement
+from snek.resolver import Resolver
+from tests.conftest import mock_repository_json, FLASK_GRAPH, FLASK_ALL_EXTRAS_GRAPH
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'pypi')
+
+
+class TestDirectoryRepository:
+    def test_resolve(self):
+        repository = DirectoryRepository(FIXTURES, pattern='pypi_{name}.json')
+        assert Resolver(repository).resolve(Requirement('Flask'), stringify_keys=True) == FLASK_GRAPH
+
+    def test_missing_project(self):
+        repository = DirectoryRepository(FIXTURES, pattern='pypi_{name}.json')
+        with pytest.raises(PackageNotFoundError):
+            repository.get_package_releases('not-a-project')
+
+    def test_missing_version(self):
+        repository = DirectoryRepository(FIXTURES, pattern='pypi_{name}.json')
+        assert repository.get_package_info('Flask')['info']['version'] == '1.1.1'
+        with pytest.raises(PackageNotFoundError):
+            repository.get_package_info('Flask', '0.1')
+
+
+class TestSnapshotRepository:
+    def test_round_trip(self, tmp_path):
+        path = str(tmp_path / 'index.snek')
+        projects = {'flask': {'releases': ['1.0', '1.1'],
+                              'metadata': {'1.0': {'version': '1.0', 'requires_dist': ['click']}}},
+                    'click': {'releases': ['7.0'], 'metadata': {'7.0': {'version': '7.0', 'requires_dist': None}}}}
+        SnapshotRepository.write(path, projects)
+        repository = SnapshotRepository(path)
+        assert repository.projects() == ['click', 'flask']
+        assert repository.get_package_releases('Flask') == {'1.0': [], '1.1': []}
+        assert repository.get_package_info('flask', '1.0')['info'] == {'version': '1.0', 'requires_dist': ['click']}
+        with pytest.raises(PackageNotFoundError):
+            repository.get_package_info('flask', '1.1')
+        repository.close()
+
+    def test_failed_write_leaves_nothing_behind(self, tmp_path):
+        with pytest.raises(TypeError):
+            SnapshotRepository.write(str(tmp_path / 'index.snek'), {'flask': {'releases': [object()], 'metadata': {}}})
+        assert not list(tmp_path.iterdir())
+
+    def test_not_a_snapshot(self, tmp_path):
+        path = tmp_path / 'index.snek'
+        path.write_bytes(b'{"releases": []}' * 4)
+        with pytest.raises(SnapshotError):
+            SnapshotRepository(str(path))
+
+    def test_snapshot_manifest(self, mocker, tmp_path):
+        path = str(tmp_path / 'index.snek')
+        mock_repository_json(mocker)
+        assert snapshot([Requirement('Flask[dev, docs, test]')], path, Repository()) > 0
+        mocker.stopall()
+
+        fetch = mocker.spy(Repository, '_fetch')
+        repository = SnapshotRepository(path)
+        graph = Resolver(repository).resolve(Requirement('Flask[dev, docs, test]'), stringify_keys=True)
+        assert graph == FLASK_ALL_EXTRAS_GRAPH
+        # Everything came from the snapshot
+        assert fetch.call_count == 0
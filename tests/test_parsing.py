@@ -0,0 +1,89 @@
+import json
+import os
+
+import packaging
+import pytest
+
+from snek.cache import DiskCache
+from snek.parsing import RequirementCache, FORMAT_VERSION
+from snek.repository import Repository
+from snek.requirement import Requirement
+from snek.resolver import Resolver
+from tests.conftest import mock_repository_json
+
+REQUIRES_DIST = ['Werkzeug (>=0.15)', 'Jinja2 (>=2.10.1)', "pytest ; extra == 'dev'", "coverage ; extra == 'dev'",
+                 'colorama; sys_platform == "win32"', 'requests[socks,security] (<3,>=2.22) ; python_version >= "3.5"']
+
+
+class TestRequirementCache:
+    def test_interned(self):
+        cache = RequirementCache()
+        assert cache.parse('Werkzeug (>=0.15)') is cache.parse('Werkzeug (>=0.15)')
+        # Requirements with the same marker share its predicate
+        assert cache.parse("pytest ; extra == 'dev'").predicate is cache.parse("coverage ; extra == 'dev'").predicate
+        assert cache.parse("pytest ; extra == 'dev'").predicate.extras == {'dev'}
+        assert cache.parse('Werkzeug (>=0.15)').predicate is None
+
+    @pytest.mark.parametrize('string', REQUIRES_DIST)
+    def test_matches_requirement(self, string):
+        parsed, requirement = Requirement.parse(string), Requirement(string)
+        assert parsed == requirement and hash(parsed) == hash(requirement)
+        assert (parsed.name, parsed.extras, parsed.specifier) == (requirement.name, requirement.extras,
+                                                                  requirement.specifier)
+        assert str(parsed.marker) == str(requirement.marker)
+
+    def test_save_and_load(self, tmp_path, mocker):
+        path = str(tmp_path / 'requirements.json')
+        cache = RequirementCache()
+        for string in REQUIRES_DIST:
+            cache.parse(string)
+        cache.save(path)
+
+        # Loading doesn't run the grammar parser
+        parser = mocker.patch('snek.parsing.requirements.Requirement')
+        loaded = RequirementCache()
+        assert loaded.load(path) == len(REQUIRES_DIST)
+        for string in REQUIRES_DIST:
+            original, restored = cache.parse(string), loaded.parse(string)
+            assert restored[:4] == original[:4] and restored.specifier == original.specifier
+            assert str(restored.marker) == str(original.marker)
+        assert loaded.parse('colorama; sys_platform == "win32"').predicate({'sys_platform': 'win32'})
+        assert loaded.parse("pytest ; extra == 'dev'").predicate.extras == {'dev'}
+        assert parser.call_count == 0
+
+    def test_save_only_when_changed(self, tmp_path):
+        path = str(tmp_path / 'requirements.json')
+        cache = RequirementCache()
+        cache.save(path)
+        assert not (tmp_path / 'requirements.json').exists()
+        cache.parse('click')
+        cache.save(path)
+        os.utime(path, ns=(0, 0))
+        cache.save(path)
+        assert os.stat(path).st_mtime_ns == 0
+        assert list(json.loads((tmp_path / 'requirements.json').read_text())['requirements']) == ['click']
+
+    @pytest.mark.parametrize('content', ['{"format": 1', json.dumps({'format': FORMAT_VERSION, 'packaging': '0.1',
+                                                                      'requirements': {'click': {}}}),
+                                         json.dumps({'format': FORMAT_VERSION + 1})])
+    def test_unusable_files_are_skipped(self, tmp_path, content):
+        path = tmp_path / 'requirements.json'
+        path.write_text(content)
+        assert RequirementCache().load(str(path)) == 0
+
+    def test_invalid_entries_are_skipped(self, tmp_path):
+        path = tmp_path / 'requirements.json'
+        path.write_text(json.dumps({'format': FORMAT_VERSION, 'packaging': packaging.__version__,
+                                    'requirements': {'click': {'name': 'click'}}}))
+        assert RequirementCache().load(str(path)) == 0
+
+
+class TestPersisted:
+    def test_saved_next_to_disk_cache(self, tmp_path, mocker):
+        mock_repository_json(mocker)
+        cache = DiskCache(str(tmp_path))
+        Resolver(Repository(cache=cache)).resolve(Requirement('Flask'))
+        with open(cache.requirements_path(), 'r', encoding='utf-8') as f:
+            saved = json.load(f)['requirements']
+        assert 'Werkzeug (>=0.15)' in saved
+        assert cache.size() == 0
@@ -1,7 +1,171 @@
+import sys
+
+import pytest
+from packaging.version import Version
+
+from snek.markers import target_environment
+from snek.reducer import Reducer, ReductionError, IncrementalReducer
+from snek.requirement import Requirement
+from snek.resolver import Resolver
+from tests.conftest import mock_repository_json, FLASK_VERSIONS
+
+
 class TestReducer:
-    pass
-    # TODO: Write this once we're able to get a compiled list from the reducer
-    # def test_reduce(self, mocker):
-    #     mock_repository_json(mocker)
-    #     resolver = Resolver()
-    #     reducer = Reducer()
+    def test_reduce(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve(Requirement('Flask'))
+        assert Reducer.reduce(graph) == FLASK_VERSIONS
+
+    def test_reduce_combines_specifiers(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve_many({Requirement('Flask'), Requirement('Werkzeug<0.16')})
+        versions = Reducer.reduce(graph)
+        assert versions['Werkzeug'] < Version('0.16') and versions['Werkzeug'] >= Version('0.15')
+        assert versions['Flask'] == Version('1.1.1')
+
+    def test_reduce_skips_extras(self, mocker):
+        mock_repository_json(mocker)
+        assert set(Reducer.reduce(Resolver().resolve(Requirement('Flask')))) == set(FLASK_VERSIONS)
+        assert 'pytest' in Reducer.reduce(Resolver().resolve(Requirement('Flask[dev]')))
+
+    def test_conflict(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve_many({Requirement('Flask'), Requirement('Werkzeug<0.15')})
+        with pytest.raises(ReductionError, match='Flask -> Werkzeug'):
+            Reducer.reduce(graph)
+
+    def test_flatten(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve(Requirement('Flask'))
+        assert {requirement.name for requirement in Reducer.flatten(graph)} == set(FLASK_VERSIONS)
+
+    def test_is_compatible(self):
+        parent = Requirement('Flask[dev]')
+        assert Reducer.is_compatible(Requirement('click', parent=parent))
+        assert Reducer.is_compatible(Requirement('pytest; extra == "dev"', parent=parent))
+        assert not Reducer.is_compatible(Requirement('sphinx; extra == "docs"', parent=parent))
+        assert not Reducer.is_compatible(Requirement('sphinx; extra == "docs"'))
+
+    def test_environment_marker_without_parent_extras(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve(Requirement('pytest'))
+        names = {requirement.name: requirement for requirement in Reducer.flatten(graph)}
+        assert not Reducer.is_compatible(names['colorama'])
+        assert Reducer.is_compatible(names['py'])
+
+    def test_children_of_excluded_nodes(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve(Requirement('pytest'))
+        pins = Reducer.reduce(graph)
+        # zipp has no marker, but it's only there for importlib-metadata, which isn't installed from Python 3.8
+        assert 'importlib-metadata' not in pins and 'zipp' not in pins
+        assert pins == Reducer.reduce_matrix(graph, {'current': {}})['current']
+
+
+class TestIncrementalReducer:
+    def test_matches_reduce(self, mocker):
+        mock_repository_json(mocker)
+        reducer = IncrementalReducer()
+        reducer.add(Resolver().resolve(Requirement('Flask[dev]')))
+        assert reducer.reduce() == Reducer.reduce(Resolver().resolve(Requirement('Flask[dev]')))
+
+    def test_only_changed_packages_are_repicked(self, mocker):
+        mock_repository_json(mocker)
+        resolver = Resolver()
+        reducer = IncrementalReducer()
+        reducer.add(resolver.resolve(Requirement('Flask')))
+        assert reducer.reduce() == FLASK_VERSIONS
+        select = mocker.spy(Reducer, 'select')
+        reducer.add(resolver.resolve(Requirement('Werkzeug<0.16')))
+        versions = reducer.reduce()
+        assert select.call_count == 1
+        assert versions['Werkzeug'] < Version('0.16')
+        assert reducer.reduce() == versions
+        assert select.call_count == 1
+
+    def test_grown_tree(self, mocker):
+        mock_repository_json(mocker)
+        root = Requirement('Flask')
+        graph = Resolver().resolve(root)
+        reducer = IncrementalReducer()
+        reducer.add_requirement(root)
+        assert reducer.reduce() == {'Flask': FLASK_VERSIONS['Flask']}
+        reducer.add(graph)
+        assert reducer.reduce() == FLASK_VERSIONS
+        # Nothing was created in the graph since, so adding it again doesn't look at any node
+        inside = mocker.spy(IncrementalReducer, '_inside')
+        reducer.add(graph)
+        assert inside.call_count == 0
+
+    def test_ancestry(self, mocker):
+        mock_repository_json(mocker)
+        reducer = IncrementalReducer()
+        reducer.add(Resolver().resolve_many({Requirement('Flask'), Requirement('Werkzeug<0.15')}))
+        assert sorted(reducer.ancestry('MarkupSafe')) == [('Flask', 'Jinja2>=2.10.1', 'MarkupSafe>=0.23')]
+        with pytest.raises(ReductionError, match='Flask -> Werkzeug>=0.15'):
+            reducer.reduce()
+
+    def test_stable_pin(self, mocker):
+        mock_repository_json(mocker)
+        resolver = Resolver()
+        reducer = IncrementalReducer()
+        reducer.add(resolver.resolve(Requirement('Flask')))
+        assert reducer.stable_pin('Werkzeug') is None
+        assert reducer.stable_pin('requests') is None
+        reducer.add(resolver.resolve(Requirement('Werkzeug<0.16')))
+        assert reducer.stable_pin('Werkzeug') is None
+        # 0.15.6 is the only release left that every requirement allows
+        reducer.add(resolver.resolve(Requirement('Werkzeug>0.15.5')))
+        assert reducer.stable_pin('Werkzeug') == Version('0.15.6')
+
+
+MATRIX = {
+    'py37-linux': target_environment('3.7', 'linux'),
+    'py38-windows': target_environment('3.8', 'windows'),
+    'py35-macos': target_environment('3.5', 'macos'),
+}
+
+
+class TestReduceMatrix:
+    def test_pins_per_environment(self, mocker):
+        mock_repository_json(mocker)
+        pins = Resolver().resolve_matrix({Requirement('pytest')}, MATRIX)
+        assert set(pins) == set(MATRIX)
+        assert {'importlib-metadata', 'zipp'} <= set(pins['py37-linux'])
+        assert 'colorama' not in pins['py37-linux']
+        assert {'colorama', 'atomicwrites'} <= set(pins['py38-windows'])
+        assert 'importlib-metadata' not in pins['py38-windows']
+        assert 'pathlib2' in pins['py35-macos']
+        # scandir is only needed by pathlib2 before Python 3.5
+        assert 'scandir' not in pins['py35-macos']
+        assert pins['py37-linux']['pytest'] == pins['py38-windows']['pytest'] == Version('5.3.0')
+
+    def test_children_of_excluded_nodes(self, mocker):
+        mock_repository_json(mocker)
+        pins = Resolver().resolve_matrix({Requirement('pytest')}, {'py38-linux': target_environment('3.8', 'linux')})
+        # zipp has no marker, but it's only there for importlib-metadata, which isn't installed on 3.8
+        assert 'zipp' not in pins['py38-linux']
+
+    def test_matches_reduce(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve(Requirement('Flask[dev]'))
+        assert Reducer.reduce_matrix(graph, {'current': {}})['current'] == Reducer.reduce(graph)
+
+    def test_deep_graph(self):
+        depth = sys.getrecursionlimit() + 100
+        root = node = Requirement('p0')
+        for i in range(1, depth):
+            child = Requirement.parse(f"p{i}", parent=node)
+            child.compatible_versions = [Version('1.0')]
+            node.add_sub_requirement(child)
+            node = child
+        root.compatible_versions = [Version('1.0')]
+        pins = Reducer.reduce_matrix(Resolver.to_graph(root), {'current': {}})['current']
+        assert len(pins) == depth
+
+    def test_conflict_names_environment(self, mocker):
+        mock_repository_json(mocker)
+        graph = Resolver().resolve_many({Requirement('Flask'), Requirement('Werkzeug<0.15; sys_platform == "win32"')})
+        assert 'Werkzeug' in Reducer.reduce_matrix(graph, {'linux': MATRIX['py37-linux']})['linux']
+        with pytest.raises(ReductionError, match=r'\[windows\]'):
+            Reducer.reduce_matrix(graph, {'windows': MATRIX['py38-windows']})
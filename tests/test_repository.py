@@ -1,6 +1,14 @@
+import hashlib
+import threading
+import time
+
+from packaging.version import Version
+
+from snek.cache import CacheEntry, MemoryCache
 from snek.repository import Repository
 from snek.requirement import Requirement
-from tests.conftest import mock_repository_json
+from snek.utils import parallel_map
+from tests.conftest import mock_repository_json, mock_response
 
 
 class TestRepository:
@@ -13,3 +21,115 @@ class TestRepository:
                                                 Requirement('Flask <= 1.1'))) == 5
         assert len(repo.get_compatible_versions(Requirement('Flask'), Requirement('Flask ~= 1.0'))) == 7
         assert len(repo.get_compatible_versions(Requirement('Flask > 1'), Requirement('Flask < 1'))) == 0
+
+    def test_session_pool(self):
+        repo = Repository(pool_size=4, max_retries=3)
+        adapter = repo.session.get_adapter(Repository.DEFAULT_URL)
+        assert adapter._pool_maxsize == 4
+        assert adapter.max_retries.total == 3
+        assert 429 in adapter.max_retries.status_forcelist
+
+    def test_concurrent_request_limit(self, mocker):
+        repo = Repository(max_concurrent_requests=2)
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        def get(url, **kwargs):
+            with lock:
+                in_flight.append(url)
+                peak.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.remove(url)
+            return mocker.Mock(status_code=200, iter_content=lambda size: [b'{"info": {}}'])
+
+        mocker.patch.object(repo.session, 'get', side_effect=get)
+        parallel_map(repo.get_package_info, [f"project{i}" for i in range(10)])
+        assert max(peak) <= 2
+
+
+CORE_METADATA = b'Metadata-Version: 2.1\nName: Flask\nVersion: 1.0\nRequires-Dist: click>=5.1\n'
+SIMPLE_INDEX = {
+    'files': [{'filename': 'Flask-1.0-py3-none-any.whl', 'url': 'https://files/Flask-1.0-py3-none-any.whl',
+               'hashes': {}, 'core-metadata': {'sha256': hashlib.sha256(CORE_METADATA).hexdigest()}}],
+    'versions': ['0.9', '1.0', '2.0'],
+}
+
+
+class TestFetchPlanner:
+    def serve(self, mocker, repo, pages):
+        def get(url, **kwargs):
+            content = pages.get(url)
+            if content is None:
+                return mock_response(mocker, status_code=404)
+            if isinstance(content, bytes):
+                response = mock_response(mocker)
+                response.content = content
+                return response
+            return mock_response(mocker, document=content,
+                                 headers={'Content-Type': Repository.SIMPLE_JSON_TYPE} if 'simple' in url else {})
+
+        return mocker.patch.object(repo.session, 'get', side_effect=get)
+
+    def test_simple_api_and_core_metadata(self, mocker):
+        repo = Repository()
+        get = self.serve(mocker, repo, {
+            'https://pypi.org/simple/flask/': SIMPLE_INDEX,
+            'https://files/Flask-1.0-py3-none-any.whl.metadata': CORE_METADATA,
+        })
+        requirement = Requirement('Flask<2')
+        repo.populate_requirement(requirement)
+        assert requirement.best_candidate_version == Version('1.0')
+        assert requirement.project_metadata['info']['requires_dist'] == ['click>=5.1']
+        assert [call.args[0] for call in get.call_args_list] == [
+            'https://pypi.org/simple/flask/', 'https://files/Flask-1.0-py3-none-any.whl.metadata']
+        assert get.call_args_list[0].kwargs['headers']['Accept'] == Repository.SIMPLE_JSON_TYPE
+
+    def test_falls_back_to_json_api(self, mocker):
+        repo = Repository()
+        get = self.serve(mocker, repo, {
+            'https://pypi.org/simple/flask/': SIMPLE_INDEX,
+            'https://pypi.org/pypi/flask/0.9/json': {'info': {'version': '0.9', 'requires_dist': None},
+                                                     'releases': {}},
+        })
+        requirement = Requirement('Flask<1')
+        repo.populate_requirement(requirement)
+        assert requirement.project_metadata['info']['version'] == '0.9'
+        assert get.call_count == 2
+
+    def test_without_simple_api(self, mocker):
+        repo = Repository(simple_url='')
+        document = {'info': {'version': '2.0', 'requires_dist': None}, 'releases': {'1.0': [], '2.0': []}}
+        get = self.serve(mocker, repo, {'https://pypi.org/pypi/flask/json': document})
+        requirement = Requirement('Flask')
+        repo.populate_requirement(requirement)
+        # The project document already describes the latest release
+        assert requirement.project_metadata == document
+        assert get.call_count == 1
+
+    def test_release_lists_expire(self, mocker):
+        repo = Repository(cache=MemoryCache(ttl=0), simple_url='')
+        pages = {'https://pypi.org/pypi/flask/json': {'info': {'version': '1.0', 'requires_dist': None},
+                                                      'releases': {'1.0': []}}}
+        get = self.serve(mocker, repo, pages)
+        first = Requirement('Flask')
+        repo.populate_requirement(first)
+        assert first.best_candidate_version == Version('1.0')
+        pages['https://pypi.org/pypi/flask/json'] = {'info': {'version': '2.0', 'requires_dist': None},
+                                                     'releases': {'1.0': [], '2.0': []}}
+        second = Requirement('Flask')
+        repo.populate_requirement(second)
+        assert second.best_candidate_version == Version('2.0')
+        assert get.call_count == 2
+
+    def test_cached_requires_dist(self):
+        cache = MemoryCache(ttl=0)
+        repo = Repository(cache=cache)
+        assert repo.cached_requires_dist('Flask') is None
+        cache.set((repo.simple_url, 'flask', None), CacheEntry({'versions': ['0.9', '1.0']}))
+        assert repo.cached_requires_dist('Flask') is None
+        # Stale entries are fine, they're only guesses
+        cache.set((repo.simple_url, 'flask', '1.0'), CacheEntry({'info': {'version': '1.0',
+                                                                          'requires_dist': ['click>=5.1']}}))
+        assert repo.cached_requires_dist('Flask') == ['click>=5.1']
@@ -20,6 +20,12 @@ class TestRequirement:
         assert r1 != r3
         assert len({r1, r2, r3}) == 2
 
+    def test_equality_with_other_types(self):
+        requirement = Requirement('Flask')
+        assert requirement != None  # noqa: E711
+        assert requirement != 'Flask'
+        assert requirement.parent() != requirement
+
     def test_add_sub_requirement(self):
         r1 = Requirement('Flask')
         r2 = Requirement('bidict')
@@ -36,4 +42,66 @@ class TestRequirement:
         r1.add_sub_requirement(r2)
         assert r1.has_descendant(r2)
 
-    # TODO: Test ancestors, descendants
+    def test_has_descendant_deep(self):
+        root = Requirement('project0')
+        node = root
+        for i in range(1, 10000):
+            child = Requirement(f"project{i}", parent=node)
+            node.add_sub_requirement(child)
+            node = child
+        assert root.has_descendant(Requirement('project9999'))
+        assert not node.has_descendant(Requirement('project0'))
+        assert len(node.ancestors()) == 9999
+
+    def test_ancestors(self):
+        r1 = Requirement('Flask')
+        r2 = Requirement('Jinja2', parent=r1)
+        r3 = Requirement('MarkupSafe', parent=r2)
+        assert r1.ancestors() == []
+        assert r3.ancestors() == [r2, r1]
+
+    def test_descendants(self):
+        r1 = Requirement('Flask')
+        r2 = Requirement('Jinja2', parent=r1)
+        r3 = Requirement('MarkupSafe', parent=r2)
+        r4 = Requirement('click', parent=r1)
+        [r.parent().add_sub_requirement(r) for r in [r2, r3, r4]]
+        assert r1.descendants() == {r2: {r3: {}}, r4: {}}
+        assert r1.descendants(stringify_keys=True) == {'Jinja2': {'MarkupSafe': {}}, 'click': {}}
+
+    def test_unattached_children(self):
+        # Creating a requirement with a parent doesn't make it a child until it's added
+        r1 = Requirement('Flask')
+        r2 = Requirement('Jinja2', parent=r1)
+        assert r2.parent() == r1
+        assert len(r1.children()) == 0
+        assert not r1.has_descendant(r2)
+
+    def test_add_subtree_from_another_graph(self):
+        r1 = Requirement('Flask')
+        r2 = Requirement('Jinja2')
+        r3 = Requirement('MarkupSafe', parent=r2)
+        r2.add_sub_requirement(r3)
+        r3.best_candidate_version = '1.1.1'
+        r1.add_sub_requirement(r2)
+        assert r1.graph is r2.graph is r3.graph
+        assert r1.has_descendant(r3)
+        assert r3.ancestors() == [r2, r1]
+        assert r3.best_candidate_version == '1.1.1'
+
+    def test_metadata_is_shared(self):
+        r1 = Requirement('Flask')
+        r2 = Requirement('Jinja2', parent=r1)
+        r3 = Requirement('Jinja2 >= 2.10', parent=r1)
+        r2.project_metadata = {'info': {'version': '2.11.2'}}
+        r3.project_metadata = {'info': {'version': '2.11.2'}}
+        assert r2.project_metadata is r3.project_metadata
+        assert r1.project_metadata == {}
+
+    def test_copy(self):
+        r1 = Requirement('Flask[dev] >= 1.0; python_version >= "3.6"')
+        r2 = Requirement('app')
+        clone = r1.copy(parent=r2)
+        assert clone == r1 and clone is not r1
+        assert clone.specifier is r1.specifier
+        assert clone.parent() == r2
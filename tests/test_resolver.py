@@ -1,16 +1,21 @@
+import asyncio
 import json
+import threading
+import time
 
 import pytest
 
+from snek.cache import MemoryCache
+from snek.repository import Repository, PackageNotFoundError
 from snek.requirement import Requirement
-from snek.resolver import Resolver, CircularDependencyError
-from tests.conftest import mock_repository_json, load_fixture
+from snek.resolver import Resolver, CircularDependencyError, AsyncResolver, SubtreeMemo, POPULATED, RESOLVED, FINISHED
+from snek.tracing import Tracer
+from snek.utils import DeadlineExceeded, OperationCancelled, check_cancelled
+from tests.conftest import mock_repository_json, load_fixture, FLASK_GRAPH, FLASK_ALL_EXTRAS_GRAPH
 
-FLASK_GRAPH = json.loads(load_fixture('resolver/Flask_dependency_graph.json'))
 FLASK_DEV_GRAPH = json.loads(load_fixture('resolver/Flask[dev]_dependency_graph.json'))
 FLASK_TEST_GRAPH = json.loads(load_fixture('resolver/Flask[test]_dependency_graph.json'))
 FLASK_DOCS_GRAPH = json.loads(load_fixture('resolver/Flask[docs]_dependency_graph.json'))
-FLASK_ALL_EXTRAS_GRAPH = json.loads(load_fixture('resolver/Flask[dev, docs, test]_dependency_graph.json'))
 
 
 class TestResolver:
@@ -37,6 +42,83 @@ class TestResolver:
         expected_graphs.update(FLASK_TEST_GRAPH)
         assert dep_graphs == expected_graphs
 
+    def test_subtrees_are_reused(self, mocker):
+        mock_repository_json(mocker)
+        get_package_info = mocker.spy(Repository, 'get_package_info')
+        resolver = Resolver()
+        resolver.resolve(Requirement('Flask'))
+        calls = get_package_info.call_count
+        assert resolver.resolve(Requirement('Flask'), stringify_keys=True) == FLASK_GRAPH
+        assert get_package_info.call_count == calls
+
+    def test_reused_subtrees_expire(self, mocker):
+        mock_repository_json(mocker)
+        tracer = Tracer()
+        resolver = Resolver(Repository(cache=MemoryCache(ttl=0)), tracer=tracer)
+        resolver.resolve(Requirement('Flask'))
+        # Subtrees are only reused while the metadata they were built from is fresh
+        assert resolver.resolve(Requirement('Flask'), stringify_keys=True) == FLASK_GRAPH
+        assert tracer.counters['subtrees.reused'] == 0
+
+    def test_subtree_memo_size(self):
+        memo = SubtreeMemo(ttl=600, max_entries=2)
+        for name in ['a', 'b', 'c']:
+            memo.set(Resolver.subtree_key(Requirement(name)), Requirement(name), time.time())
+        assert len(memo) == 2
+        assert memo.get(Resolver.subtree_key(Requirement('a'))) is None
+
+    def test_timeout(self, mocker):
+        mock_repository_json(mocker)
+        mocker.patch('snek.repository.Repository.get_package_info', side_effect=lambda *args: time.sleep(1))
+        resolver = Resolver(timeout=0.1)
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            resolver.resolve_many({Requirement('Flask'), Requirement('requests')})
+        assert time.monotonic() - start < 1
+
+    def test_stream(self, mocker):
+        mock_repository_json(mocker)
+        events = list(Resolver().stream({Requirement('Flask')}))
+        assert events[-1].kind == FINISHED
+        assert Resolver.to_graph(next(iter(events[-1].graph)), stringify_keys=True) == FLASK_GRAPH
+        resolved = [event.requirement for event in events if event.kind == RESOLVED]
+        assert len(resolved) == len([event for event in events if event.kind == POPULATED])
+        # Every node is reported after its whole subtree
+        for position, requirement in enumerate(resolved):
+            assert all(child in resolved[:position] for child in requirement.children())
+        assert str(resolved[-1]) == 'Flask'
+
+    def test_stream_reused_subtrees(self, mocker):
+        mock_repository_json(mocker)
+        resolver = Resolver()
+        resolver.resolve(Requirement('Flask'))
+        events = list(resolver.stream({Requirement('Flask')}))
+        assert [event.kind for event in events].count(RESOLVED) == 6
+        assert not any(event.kind == POPULATED for event in events)
+
+    def test_stream_close_cancels(self, mocker):
+        mock_repository_json(mocker)
+        get_package_info = mocker.patch('snek.repository.Repository.get_package_info')
+
+        def slow_dependencies(name, version=None):
+            if name != 'Flask':
+                time.sleep(0.5)
+            return json.loads(load_fixture(f"pypi/pypi_{name.lower()}.json"))
+
+        get_package_info.side_effect = slow_dependencies
+        events = Resolver().stream({Requirement('Flask')})
+        assert next(events).kind == POPULATED
+        start = time.monotonic()
+        events.close()
+        # Flask's dependencies are abandoned as soon as their fetches return
+        assert time.monotonic() - start < 1
+        assert get_package_info.call_count <= 6
+
+    def test_stream_raises(self, mocker):
+        mock_repository_json(mocker)
+        with pytest.raises(CircularDependencyError):
+            list(Resolver().stream({Requirement('snek_circular_test_1')}))
+
     def test_evaluate_extra(self):
         req_no_extras = Requirement('test')
         req_one_extra = Requirement('test[dev]')
@@ -69,3 +151,75 @@ class TestResolver:
     #         assert resolver.test_evaluate_marker(windows_marker)
     #     else:
     #         assert not resolver.test_evaluate_marker(windows_marker)
+
+
+class TestAsyncResolver:
+    @pytest.mark.parametrize('req_str, expected_graph',
+                             [('Flask', FLASK_GRAPH),
+                              ('Flask[dev]', FLASK_DEV_GRAPH),
+                              ('Flask[dev, docs, test]', FLASK_ALL_EXTRAS_GRAPH)])
+    def test_single_resolve(self, mocker, req_str, expected_graph):
+        mock_repository_json(mocker)
+        resolver = AsyncResolver()
+        dep_graph = asyncio.run(resolver.resolve(Requirement(req_str), stringify_keys=True))
+        assert dep_graph == expected_graph
+
+    def test_multi_resolve(self, mocker):
+        mock_repository_json(mocker)
+        requirements = {Requirement(req) for req in ['Flask', 'Flask[dev]', 'Flask[test]']}
+        resolver = AsyncResolver()
+        dep_graphs = asyncio.run(resolver.resolve_many(requirements, stringify_keys=True))
+        expected_graphs = {}
+        expected_graphs.update(FLASK_GRAPH)
+        expected_graphs.update(FLASK_DEV_GRAPH)
+        expected_graphs.update(FLASK_TEST_GRAPH)
+        assert dep_graphs == expected_graphs
+
+    def test_circular_dependency(self, mocker):
+        mock_repository_json(mocker)
+        resolver = AsyncResolver()
+        with pytest.raises(CircularDependencyError):
+            asyncio.run(resolver.resolve(Requirement('snek_circular_test_1')))
+
+    def test_timeout(self, mocker):
+        mock_repository_json(mocker)
+        mocker.patch('snek.repository.Repository.get_package_info', side_effect=lambda *args: time.sleep(0.5))
+        resolver = AsyncResolver(timeout=0.1)
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(resolver.resolve(Requirement('Flask')))
+
+    @pytest.mark.parametrize('timeout, requirements', [(0.1, {'Flask'}), (None, {'Flask', 'requests'})])
+    def test_failure_stops_running_fetches(self, mocker, timeout, requirements):
+        mock_repository_json(mocker)
+        stopped = threading.Event()
+
+        def slow_fetch(name, version=None):
+            if name == 'requests':
+                time.sleep(0.1)
+                raise PackageNotFoundError(name, version)
+            try:
+                for _ in range(100):
+                    time.sleep(0.01)
+                    check_cancelled()
+            except OperationCancelled:
+                stopped.set()
+                raise
+
+        mocker.patch('snek.repository.Repository.get_package_info', side_effect=slow_fetch)
+        with pytest.raises((DeadlineExceeded, PackageNotFoundError)):
+            asyncio.run(AsyncResolver(timeout=timeout).resolve_many(set(map(Requirement, requirements))))
+        # Flask's fetch on the executor gives up as soon as the resolve does, rather than running for a second
+        assert stopped.wait(0.5)
+
+    def test_stream(self, mocker):
+        mock_repository_json(mocker)
+
+        async def collect():
+            return [event async for event in AsyncResolver().stream({Requirement('Flask')})]
+
+        events = asyncio.run(collect())
+        assert events[-1].kind == FINISHED
+        assert Resolver.to_graph(next(iter(events[-1].graph)), stringify_keys=True) == FLASK_GRAPH
+        resolved = [str(event.requirement) for event in events if event.kind == RESOLVED]
+        assert len(resolved) == 6
+        assert resolved[-1] == 'Flask'
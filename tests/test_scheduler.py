@@ -0,0 +1,117 @@
+from snek import tracing
+from snek.installed import InstalledIndex
+from snek.repository import Repository
+from snek.requirement import Requirement
+from snek.scheduler import FetchScheduler, ASSIGNED, DONE, DROPPED, PENDING
+from tests.conftest import mock_repository_json, install
+
+
+class TestFetchScheduler:
+    def test_populate(self, mocker):
+        mock_repository_json(mocker)
+        requirement, expected = Requirement('Flask'), Requirement('Flask')
+        FetchScheduler(Repository()).populate(requirement)
+        Repository().populate_requirement(expected)
+        assert requirement.best_candidate_version == expected.best_candidate_version
+        assert requirement.compatible_versions == expected.compatible_versions
+        assert requirement.project_metadata == expected.project_metadata
+
+    def test_same_key_fetched_once(self, mocker):
+        mock_repository_json(mocker)
+        populate = mocker.spy(Repository, 'populate_requirement')
+        scheduler = FetchScheduler(Repository())
+        first, second = Requirement('Flask'), Requirement('flask')
+        scheduler.populate(first)
+        scheduler.populate(second)
+        assert populate.call_count == 1
+        assert second.best_candidate_version == first.best_candidate_version
+
+    def test_priority(self):
+        # Without workers nothing leaves the queue, so its order can be inspected
+        scheduler = FetchScheduler(Repository(), workers=0, speculation_depth=0)
+        scheduler.add_hints({'flask': ['Jinja2>=2.10.1', 'click>=5.1'], 'jinja2': ['MarkupSafe>=0.23']})
+        for name in ['click', 'Jinja2', 'Flask']:
+            scheduler._submit(name, Requirement(name).specifier, lambda: Requirement(name), speculative=False)
+        scheduler._submit('Werkzeug', Requirement('Werkzeug').specifier, lambda: Requirement('Werkzeug'),
+                          speculative=True)
+        order = []
+        while True:
+            fetch = scheduler._next()
+            if fetch is None:
+                break
+            order.append(fetch.key[0])
+        # Deepest chain of hinted dependencies first, speculative work last
+        assert order == ['flask', 'jinja2', 'click', 'werkzeug']
+
+    def test_speculates_from_hints(self, mocker):
+        mock_repository_json(mocker)
+        scheduler = FetchScheduler(Repository())
+        scheduler.add_hints({'flask': ['Jinja2>=2.10.1', "pytest ; extra == 'dev'"]})
+        tracer = tracing.Tracer()
+        with tracing.tracing(tracer), scheduler.session():
+            scheduler.populate(Requirement('Flask'))
+            scheduler.populate(Requirement('Jinja2>=2.10.1'))
+        # The extra was skipped
+        assert tracer.counters['prefetch.speculated'] >= 1
+        assert tracer.counters['prefetch.confirmed'] == 1
+        assert ('pytest', '') not in scheduler._fetches
+
+    def test_drops_wrong_and_leftover_guesses(self, mocker):
+        mock_repository_json(mocker)
+        # Speculative fetches never get a slot, so they stay queued
+        scheduler = FetchScheduler(Repository(), speculative_workers=0)
+        scheduler.add_hints({'flask': ['click>=5.1', 'requests']})
+        tracer = tracing.Tracer()
+        with tracing.tracing(tracer):
+            with scheduler.session():
+                scheduler.populate(Requirement('Flask'))
+                assert scheduler._fetches[('flask', '')].state == DONE
+                # Flask doesn't require requests
+                assert ('requests', '') not in scheduler._fetches
+                click = scheduler._fetches[('click', '>=5.1')]
+                assert click.state == PENDING
+                assert tracer.counters['prefetch.dropped'] == 1
+            assert click.state == DROPPED
+            assert tracer.counters['prefetch.dropped'] == 2
+
+    def test_mark_known(self, mocker):
+        mock_repository_json(mocker)
+        scheduler = FetchScheduler(Repository(), speculative_workers=0)
+        scheduler.add_hints({'flask': ['click>=5.1']})
+        scheduler.mark_known(Requirement('click>=5.1'))
+        with scheduler.session():
+            scheduler.populate(Requirement('Flask'))
+            assert ('click', '>=5.1') not in scheduler._fetches
+
+    def test_installed_requirements_are_not_prefetched(self, mocker, tmp_path):
+        mock_repository_json(mocker)
+        install(tmp_path, 'click', '7.0')
+        scheduler = FetchScheduler(Repository(), speculative_workers=0, installed=InstalledIndex([str(tmp_path)]))
+        scheduler.add_hints({'flask': ['click>=5.1', 'Jinja2>=2.10.1']})
+        with scheduler.session():
+            scheduler.populate(Requirement('Flask'))
+            assert ('click', '>=5.1') not in scheduler._fetches
+            assert ('jinja2', '>=2.10.1') in scheduler._fetches
+
+    def test_abandoned_fetch_gives_its_slot_back(self, mocker):
+        mock_repository_json(mocker)
+        scheduler = FetchScheduler(Repository(), workers=1, speculative_workers=0, speculation_depth=0)
+        specifier = Requirement('click').specifier
+        scheduler._submit('click', specifier, lambda: Requirement('click'), speculative=True)
+        fetch = scheduler._submit('click', specifier, lambda: Requirement('click'), speculative=False)
+        assert fetch.state == ASSIGNED
+        # The only waiter gives up, so the fetch goes back to being speculative work, for which there are no slots
+        scheduler._leave(fetch)
+        assert fetch.state == PENDING and fetch.speculative
+        assert scheduler._running == 0 and scheduler._speculating == 0
+
+    def test_finished_fetches_are_forgotten(self, mocker):
+        mock_repository_json(mocker)
+        populate = mocker.spy(Repository, 'populate_requirement')
+        scheduler = FetchScheduler(Repository(), speculation_depth=0)
+        for _ in range(2):
+            with scheduler.session():
+                scheduler.populate(Requirement('Flask'))
+                scheduler.populate(Requirement('flask'))
+        assert populate.call_count == 2
+        assert not scheduler._fetches
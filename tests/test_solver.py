@@ -0,0 +1,87 @@
+import pytest
+from packaging.version import Version
+
+from snek.requirement import Requirement
+from snek.solver import Solver, SolverError
+from tests.conftest import mock_repository_json
+
+
+def mock_index(mocker, projects):
+    """Serve a fake index where projects maps name -> {version: requires_dist}."""
+    calls = []
+
+    def get_package_info(name, version=None):
+        calls.append((name, version))
+        releases = projects[name.lower()]
+        version = str(version) if version else max(releases, key=Version)
+        return {'info': {'version': version, 'requires_dist': releases[version]},
+                'releases': {release: [] for release in releases}}
+
+    mocker.patch('snek.repository.Repository.get_package_info', side_effect=get_package_info)
+    mocker.patch('snek.repository.Repository.get_package_releases',
+                 side_effect=lambda name: {release: [] for release in projects[name.lower()]})
+    return calls
+
+
+class TestSolver:
+    def test_backtracks_to_older_version(self, mocker):
+        mock_index(mocker, {
+            'app': {'1.0': ['lib>=1'], '2.0': ['lib<1']},
+            'lib': {'0.5': None, '1.0': None, '1.5': None},
+        })
+        solution = Solver().solve([Requirement('app'), Requirement('lib>=1')])
+        assert solution == {'app': Version('1.0'), 'lib': Version('1.5')}
+
+    def test_transitive_conflict(self, mocker):
+        mock_index(mocker, {
+            'app': {'1.0': ['web', 'db'], '2.0': ['web', 'db']},
+            'web': {'1.0': ['util<2'], '2.0': ['util>=2']},
+            'db': {'1.0': ['util<2']},
+            'util': {'1.0': None, '2.0': None},
+        })
+        solution = Solver().solve([Requirement('app')])
+        assert solution == {'app': Version('2.0'), 'web': Version('1.0'), 'db': Version('1.0'),
+                            'util': Version('1.0')}
+
+    def test_extras(self, mocker):
+        mock_index(mocker, {
+            'app': {'1.0': ['lib', 'test-lib; extra == "test"']},
+            'lib': {'1.0': None},
+            'test-lib': {'1.0': None},
+        })
+        assert Solver().solve([Requirement('app')]) == {'app': Version('1.0'), 'lib': Version('1.0')}
+        assert Solver().solve([Requirement('app[test]')]) == {'app': Version('1.0'), 'lib': Version('1.0'),
+                                                              'test-lib': Version('1.0')}
+
+    def test_environment_markers(self, mocker):
+        mock_index(mocker, {
+            'app': {'1.0': ['colorama; sys_platform == "win32"']},
+            'colorama': {'1.0': None},
+        })
+        assert 'colorama' not in Solver(environment={'sys_platform': 'linux'}).solve([Requirement('app')])
+        assert 'colorama' in Solver(environment={'sys_platform': 'win32'}).solve([Requirement('app')])
+
+    def test_unsatisfiable_conflicts_are_learned(self, mocker):
+        # Naive backtracking would try all 30 * 30 combinations of a and b before giving up
+        projects = {
+            'a': {str(i): None for i in range(1, 31)},
+            'b': {str(i): None for i in range(1, 31)},
+            'conflict': {'1.0': ['x>=2', 'y']},
+            'y': {str(i): ['x<2'] for i in range(1, 11)},
+            'x': {'1': None, '2': None, '3': None},
+        }
+        mock_index(mocker, projects)
+        solver = Solver()
+        with pytest.raises(SolverError):
+            solver.solve([Requirement('a'), Requirement('b'), Requirement('conflict')])
+        assert solver.steps < 50
+
+    def test_circular_dependencies_are_merged(self, mocker):
+        mock_repository_json(mocker)
+        assert Solver().solve([Requirement('snek_circular_test_1')]) == {
+            'snek_circular_test_1': Version('1.0.0'), 'snek_circular_test_2': Version('1.0.0')}
+
+    def test_flask(self, mocker):
+        mock_repository_json(mocker)
+        solution = Solver().solve([Requirement('Flask')])
+        assert set(solution) == {'Flask', 'Werkzeug', 'Jinja2', 'itsdangerous', 'click', 'MarkupSafe'}
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+from snek.reducer import Reducer
+from snek.repository import Repository, AsyncRepository
+from snek.requirement import Requirement
+from snek.resolver import Resolver, AsyncResolver
+from snek.tracing import Tracer, NullTracer, NULL_TRACER, current_tracer, tracing
+from tests.conftest import mock_repository_json, mock_response
+
+
+class TestTracer:
+    def test_spans_and_counters(self, tmp_path):
+        tracer = Tracer()
+        with tracer.span('fetch', url='https://pypi.org/pypi/flask/json'):
+            pass
+        tracer.count('http.requests')
+        tracer.count('http.bytes', 100)
+        tracer.gauge('requests.queued', 3)
+        tracer.gauge('requests.queued', 1)
+        assert tracer.counters == {'http.requests': 1, 'http.bytes': 100}
+        assert tracer.gauges == {'requests.queued': 1}
+        assert tracer.peaks == {'requests.queued': 3}
+        assert tracer.phases()['fetch'][0] == 1
+
+        path = str(tmp_path / 'trace.json')
+        tracer.dump_chrome_trace(path)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        assert events[0]['ph'] == 'X' and events[0]['name'] == 'fetch'
+        assert events[0]['args'] == {'url': 'https://pypi.org/pypi/flask/json'}
+        assert [event['args'] for event in events if event['ph'] == 'C'] == [{'requests.queued': 3},
+                                                                               {'requests.queued': 1}]
+        summary = tracer.summary()
+        assert 'fetch' in summary and 'http.bytes' in summary and 'requests.queued (peak)' in summary
+
+    def test_disabled_by_default(self):
+        assert current_tracer() is NULL_TRACER
+        tracer = NullTracer()
+        with tracer.span('fetch'):
+            tracer.count('http.requests')
+        assert tracer.phases() == {} and tracer.counters == {}
+
+    def test_tracing_context(self):
+        tracer = Tracer()
+        with tracing(tracer):
+            assert current_tracer() is tracer
+            with tracing(None):
+                assert current_tracer() is tracer
+        assert current_tracer() is NULL_TRACER
+
+
+class TestInstrumentation:
+    def test_resolve_and_reduce(self, mocker):
+        mock_repository_json(mocker)
+        tracer = Tracer()
+        graph = Resolver(tracer=tracer).resolve(Requirement('Flask'))
+        with tracing(tracer):
+            Reducer.reduce(graph)
+        phases = tracer.phases()
+        assert phases['recurse'][0] == 6
+        assert phases['filter'][0] == 6
+        assert phases['reduce'][0] == 1
+        # Children are resolved on other threads, which still report to the same tracer
+        assert len({event['tid'] for event in tracer.chrome_trace()['traceEvents']}) > 1
+
+    def test_fetch_counters(self, mocker):
+        repo = Repository(simple_url='')
+        document = {'info': {'version': '1.0', 'requires_dist': None}, 'releases': {}}
+        # Chunked, so there's no Content-Length to go by
+        mocker.patch.object(repo.session, 'get', return_value=mock_response(mocker, document=document,
+                                                                            headers={'Transfer-Encoding': 'chunked'}))
+        tracer = Tracer()
+        with tracing(tracer):
+            repo.get_package_info('Flask')
+            repo.get_package_info('Flask')
+        assert tracer.counters == {'cache.misses': 1, 'cache.hits': 1, 'http.requests': 1,
+                                   'http.bytes': len(json.dumps(document))}
+        assert set(tracer.phases()) == {'fetch', 'parse'}
+
+    def test_async_resolve(self, mocker):
+        mock_repository_json(mocker)
+        tracer = Tracer()
+        resolver = AsyncResolver(AsyncRepository(Repository()), tracer=tracer)
+        asyncio.run(resolver.resolve(Requirement('Flask')))
+        assert tracer.phases()['recurse'][0] == 6
+        assert tracer.phases()['filter'][0] == 6
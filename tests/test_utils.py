@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from snek.utils import SingleFlight, parallel_map, cancel_scope, check_cancelled, DeadlineExceeded, \
+    OperationCancelled, gather_or_cancel, CancelScope
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_are_coalesced(self):
+        single_flight = SingleFlight()
+        calls = []
+        results = []
+        barrier = threading.Barrier(8)
+
+        def fetch(name):
+            calls.append(name)
+            time.sleep(0.05)
+            return name.upper()
+
+        def call():
+            barrier.wait()
+            results.append(single_flight.do('flask', fetch, 'flask'))
+
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        assert results == ['FLASK'] * 8
+        assert len(calls) == 1
+        # Finished calls aren't remembered
+        single_flight.do('flask', fetch, 'flask')
+        assert len(calls) == 2
+
+    def test_errors_are_shared(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            time.sleep(0.05)
+            raise ValueError('nope')
+
+        def call(wait):
+            if wait:
+                started.wait()
+            try:
+                single_flight.do('key', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call, args=(False,))
+        leader.start()
+        followers = [threading.Thread(target=call, args=(True,)) for _ in range(4)]
+        [thread.start() for thread in followers]
+        [thread.join() for thread in followers + [leader]]
+        assert len(errors) == 5
+        assert len(set(map(id, errors))) == 1
+
+    def test_followers_retry_when_the_leader_is_cancelled(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        calls = []
+        results = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            time.sleep(0.05)
+            check_cancelled()
+            return 'result'
+
+        def lead():
+            with cancel_scope() as scope:
+                scope.cancel()
+                with pytest.raises(OperationCancelled):
+                    single_flight.do('key', fetch)
+
+        def follow():
+            started.wait()
+            results.append(single_flight.do('key', fetch))
+
+        threads = [threading.Thread(target=lead), threading.Thread(target=follow)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        assert results == ['result']
+        assert len(calls) == 2
+
+
+class TestCancellation:
+    def test_nested_scopes(self):
+        parent = CancelScope(timeout=10)
+        child = CancelScope(parent, timeout=100)
+        assert child.deadline == parent.deadline
+        parent.cancel()
+        assert child.cancelled
+        with pytest.raises(OperationCancelled):
+            child.check()
+
+    def test_failure_cancels_siblings(self):
+        finished = []
+
+        def work(i):
+            if i == 0:
+                raise ValueError('boom')
+            for _ in range(100):
+                time.sleep(0.01)
+                check_cancelled()
+            finished.append(i)
+
+        start = time.monotonic()
+        with pytest.raises(ValueError):
+            parallel_map(work, range(4))
+        assert time.monotonic() - start < 0.5
+        time.sleep(0.05)
+        assert finished == []
+
+    def test_deadline(self):
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            with cancel_scope(timeout=0.1):
+                parallel_map(lambda _: time.sleep(0.5), range(2))
+        assert time.monotonic() - start < 0.4
+
+    def test_gather_or_cancel(self):
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def fail():
+            raise ValueError('boom')
+
+        with pytest.raises(ValueError):
+            asyncio.run(gather_or_cancel(slow(), fail()))
+        assert cancelled == [True]
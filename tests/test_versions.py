@@ -0,0 +1,32 @@
+import json
+
+import pytest
+from packaging.specifiers import SpecifierSet
+
+from snek import utils
+from snek.versions import VersionIndex
+from tests.conftest import load_fixture
+
+FLASK_RELEASES = list(json.loads(load_fixture('pypi/pypi_flask.json'))['releases'].keys())
+EXTRA_RELEASES = ['1.0+local', '1.0.post1', '1.1rc1', '2.0.dev3', 'not-a-version', '0.12.4+ubuntu1']
+
+
+class TestVersionIndex:
+    @pytest.mark.parametrize('specifier', ['', '>1.0', '>=1.0', '<1.0', '<=1.0', '==1.0', '==1.0.*', '~=0.12',
+                                           '!=1.0', '>=0.10,!=0.12.2,<1.1', '>=1.1rc1', '<=0.12.4', '===1.0',
+                                           '===not-a-version', '>=0.10,===foo', '>2', '<0.1', '>1,<1'])
+    def test_filter_matches_specifier_set(self, specifier):
+        releases = FLASK_RELEASES + EXTRA_RELEASES
+        index = VersionIndex(releases)
+        expected = sorted(SpecifierSet(specifier).filter(map(utils.convert_to_version, releases)))
+        assert index.filter(SpecifierSet(specifier)) == expected
+
+    def test_sorted_and_deduplicated(self):
+        index = VersionIndex(['1.0', '0.9', '1.0.0', '2.0'])
+        assert list(map(str, index.versions)) == ['0.9', '1.0', '2.0']
+        assert utils.convert_to_version('1.0') in index
+        assert utils.convert_to_version('1.5') not in index
+
+    def test_results_are_memoized(self):
+        index = VersionIndex(FLASK_RELEASES)
+        assert index.filter(SpecifierSet('>=1.0')) is index.filter(SpecifierSet('>=1.0'))